@@ -0,0 +1,22 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from account.models import Profile
+from document.utils import utils
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def profile_changed(sender, instance, **kwargs):
+    utils.bump_data_version(instance.company_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # Logging in only updates last_login which isn't shown anywhere
+    if update_fields is not None and set(update_fields) == {"last_login"}:
+        return
+    profile = Profile.objects.filter(user=instance).values("company_id").first()
+    if profile is not None:
+        utils.bump_data_version(profile["company_id"])
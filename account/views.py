@@ -2,15 +2,18 @@ from django.contrib import messages
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.models import User
-from django.core.exceptions import PermissionDenied
-from django.shortcuts import render, get_object_or_404, redirect
+from django.db.models import Q
+from django.shortcuts import render, redirect
 from django.urls import reverse
 from django.utils.crypto import get_random_string
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.cache import cache_control
 
 from account.forms import LoginForm, RegistrationForm, UserEditForm, UserEditByAdminForm, ProfileEditByAdminForm
 from account.models import Profile
 from document.models import Company
+from document.utils import utils
 
 
 class LoginView(View):
@@ -116,11 +119,8 @@ class ProfileDetailView(LoginRequiredMixin, View):
     Access roles: all
     """
     def get(self, request, company_name, employee_num):
-        company = get_object_or_404(Company, name=company_name)
-        if request.user.profile.company != company:
-            raise PermissionDenied
-
-        profile = get_object_or_404(Profile, company=company, employee_num=employee_num)
+        profile = utils.get_company_object(request, Profile.objects.select_related("user"), company_name,
+                                           employee_num=employee_num)
         user = profile.user
         return render(request, "account/profile_detail.html", {"user": user})
 
@@ -153,14 +153,69 @@ class UserListView(LoginRequiredMixin, View):
     """
     See meta information about the company and the list of users.
 
+    Users are loaded with their profiles in one query, filtered by ?role=, ?active= and ?name=,
+    sorted by ?sort= (a key of SORTING, with "-" for descending order) and split by pages with keyset pagination.
+
     Access company: lists data for company of request user
     Access roles: all, but edit links are disabled for non-admins in template
     """
+    read_from_replica = True
+    page_size = 50
+    # Orderings end with the employee number, so they are unique within the company
+    SORTING = {
+        "num": ["profile__employee_num"],
+        "name": ["last_name", "first_name", "profile__employee_num"],
+        "email": ["email", "profile__employee_num"],
+        "role": ["profile__role", "profile__employee_num"],
+    }
+
+    @method_decorator(cache_control(private=True, no_cache=True))
+    @method_decorator(utils.company_data_condition)
     def get(self, request):
         company = request.user.profile.company
-        profiles = Profile.objects.filter(company=company)
-        users = [profile.user for profile in profiles]
-        return render(request, "account/list_users.html", {"users": users})
+        users = User.objects.filter(profile__company=company).select_related("profile")
+
+        role = request.GET.get("role")
+        if role in dict(Profile.ROLES):
+            users = users.filter(profile__role=role)
+        active = request.GET.get("active")
+        if active in ("yes", "no"):
+            users = users.filter(is_active=(active == "yes"))
+        name = request.GET.get("name", "").strip()
+        if name:
+            users = users.filter(Q(first_name__icontains=name) | Q(last_name__icontains=name)
+                                 | Q(email__icontains=name))
+
+        sort = request.GET.get("sort", "num")
+        if sort.lstrip("-") not in self.SORTING:
+            sort = "num"
+        ordering = self.SORTING[sort.lstrip("-")]
+        if sort.startswith("-"):
+            ordering = [f"-{field}" for field in ordering]
+
+        users, next_cursor = utils.keyset_paginate(users, ordering, request.GET.get("after"), self.page_size)
+
+        # Links keep the filters and the sorting
+        params = request.GET.copy()
+        params.pop("after", None)
+        next_params = params.copy()
+        next_params["after"] = next_cursor
+        sort_queries = {}
+        for key in self.SORTING:
+            sort_params = params.copy()
+            sort_params["sort"] = f"-{key}" if sort == key else key
+            sort_queries[key] = sort_params.urlencode()
+
+        ctx = {
+            "company": company,
+            "users": users,
+            "roles": Profile.ROLES,
+            "filters": {"role": role, "active": active, "name": name, "sort": sort},
+            "first_query": params.urlencode() if "after" in request.GET else None,
+            "next_query": next_params.urlencode() if next_cursor else None,
+            "sort_queries": sort_queries,
+        }
+        return render(request, "account/list_users.html", ctx)
 
 
 class EditUserByAdminView(LoginRequiredMixin, UserPassesTestMixin, View):
@@ -177,22 +232,18 @@ class EditUserByAdminView(LoginRequiredMixin, UserPassesTestMixin, View):
         return self.request.user.profile.role == "admin"
 
     def get(self, request, company_name, employee_num):
-        company = get_object_or_404(Company, name=company_name)
-        profile = get_object_or_404(Profile, company=company, employee_num=employee_num)
+        profile = utils.get_company_object(request, Profile.objects.select_related("user"), company_name,
+                                           employee_num=employee_num)
         user = profile.user
-        if request.user.profile.company != company:
-            raise PermissionDenied
 
         user_form = UserEditByAdminForm(instance=user)
         profile_form = ProfileEditByAdminForm(instance=user.profile)
         return render(request, "account/edit_by_admin.html", {"user_form": user_form, "profile_form": profile_form})
 
     def post(self, request, company_name, employee_num):
-        company = get_object_or_404(Company, name=company_name)
-        profile = get_object_or_404(Profile, employee_num=employee_num)
+        profile = utils.get_company_object(request, Profile.objects.select_related("user"), company_name,
+                                           employee_num=employee_num)
         user = profile.user
-        if request.user.profile.company != company:
-            raise PermissionDenied
 
         user_form = UserEditByAdminForm(instance=user, data=request.POST)
         profile_form = ProfileEditByAdminForm(instance=user.profile, data=request.POST)
@@ -0,0 +1,153 @@
+"""
+PostgreSQL backend with health checks of persistent connections, an optional in-process connection pool and
+migrations which work with partitioned tables (see schema.py).
+
+It's configured with extra keys of the database settings (see DB_* variables in settings.py):
+- HEALTH_CHECKS: boolean, check a reused persistent connection (CONN_MAX_AGE > 0) before the first query
+  of a request and reconnect if the server closed it,
+- POOL: dictionary with SIZE (maximum number of connections of the process) and TIMEOUT (seconds to wait
+  for a free connection) or None; with the pool, closing a connection returns it to the pool instead.
+"""
+import os
+import threading
+from collections import deque
+
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+from psycopg2 import extensions, extras
+
+from actudoc.db.postgresql.schema import DatabaseSchemaEditor
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    :param connect: function creating a new connection
+    :param size: integer, maximum number of connections (idle and in use)
+    :param timeout: float, seconds to wait for a free connection
+    """
+    def __init__(self, connect, size, timeout):
+        self.connect = connect
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = deque()
+        self.lock = threading.Lock()
+
+    def get(self, check=False):
+        """
+        Get an idle connection or a new one if there is none.
+
+        :param check: boolean, whether to check that the idle connection still works (the server may have closed it)
+        :return: psycopg2 connection
+        """
+        if not self.slots.acquire(timeout=self.timeout):
+            raise OperationalError(f"No free database connection in the pool after {self.timeout} s.")
+        try:
+            with self.lock:
+                connection = self.idle.pop() if self.idle else None
+            if connection is not None and check and not connection_is_usable(connection):
+                connection.close()
+            if connection is None or connection.closed:
+                connection = self.connect()
+            return connection
+        except Exception:
+            self.slots.release()
+            raise
+
+    def put(self, connection):
+        try:
+            if not connection.closed:
+                status = connection.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    connection.close()
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            if not connection.closed:
+                with self.lock:
+                    self.idle.append(connection)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        with self.lock:
+            while self.idle:
+                self.idle.pop().close()
+
+
+def new_connection(conn_params):
+    connection = base.Database.connect(**conn_params)
+    # Same as Django's backend: JSON is decoded by the JSONField
+    extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+    return connection
+
+
+def connection_is_usable(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    except base.Database.Error:
+        return False
+    return True
+
+
+def get_pool(alias, conn_params, connect, size, timeout):
+    """Get the pool of the database in the current process (pools aren't shared with forked processes)."""
+    key = (os.getpid(), alias, tuple(sorted((name, str(value)) for name, value in conn_params.items())))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(connect, size, timeout)
+        return _pools[key]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    SchemaEditorClass = DatabaseSchemaEditor
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+        self.pool = None
+
+    @property
+    def pool_settings(self):
+        return self.settings_dict.get("POOL")
+
+    def get_new_connection(self, conn_params):
+        if not self.pool_settings:
+            return super().get_new_connection(conn_params)
+
+        self.pool = get_pool(self.alias, conn_params, lambda: new_connection(conn_params),
+                             self.pool_settings.get("SIZE", 10), self.pool_settings.get("TIMEOUT", 5))
+        connection = self.pool.get(check=self.settings_dict.get("HEALTH_CHECKS", False))
+        self.isolation_level = self.settings_dict["OPTIONS"].get("isolation_level", connection.isolation_level)
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            self.pool.put(self.connection)
+
+    def connect(self):
+        super().connect()
+        # A new connection doesn't need a health check
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        # Called at the start and the end of each request: the next request checks its connection again
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (self.connection is not None and self.settings_dict.get("HEALTH_CHECKS") and not self.health_check_done
+                and not self.in_atomic_block):
+            if not connection_is_usable(self.connection):
+                self.close()
+            self.health_check_done = True
+        super().ensure_connection()
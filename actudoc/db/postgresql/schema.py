@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+
+from django.db.backends.postgresql import schema
+
+
+class DatabaseSchemaEditor(schema.DatabaseSchemaEditor):
+    """
+    Schema editor which doesn't create foreign keys referencing partitioned tables (see partition_documents).
+
+    The primary key of a partitioned table includes the partition key, so PostgreSQL can't create a foreign key
+    to its id and migrations adding one would fail. The relation is kept by Django, like the foreign keys dropped
+    by partitioning.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._partitioned_tables = None
+
+    def partitioned_tables(self):
+        if self._partitioned_tables is None:
+            with self.connection.cursor() as cursor:
+                cursor.execute("SELECT c.relname FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid")
+                self._partitioned_tables = {row[0] for row in cursor.fetchall()}
+        return self._partitioned_tables
+
+    @contextmanager
+    def skip_partitioned_references(self, fields):
+        """Don't create the constraints of the foreign keys which reference partitioned tables."""
+        skipped = [field for field in fields if field.remote_field and field.db_constraint
+                   and field.remote_field.model._meta.db_table in self.partitioned_tables()]
+        for field in skipped:
+            field.db_constraint = False
+        try:
+            yield
+        finally:
+            for field in skipped:
+                field.db_constraint = True
+
+    def create_model(self, model):
+        with self.skip_partitioned_references(model._meta.local_fields):
+            super().create_model(model)
+
+    def add_field(self, model, field):
+        with self.skip_partitioned_references([field]):
+            super().add_field(model, field)
+
+    def alter_field(self, model, old_field, new_field, strict=False):
+        # Foreign keys to the altered field are rebuilt too if its type changes
+        fields = [new_field] + [rel.field for rel in new_field.model._meta.related_objects]
+        with self.skip_partitioned_references(fields):
+            super().alter_field(model, old_field, new_field, strict)
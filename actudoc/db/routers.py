@@ -0,0 +1,101 @@
+import contextvars
+import itertools
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+
+_read_database = contextvars.ContextVar("read_database", default=None)
+_wrote = contextvars.ContextVar("wrote", default=False)
+
+_lock = threading.Lock()
+_cycle = None
+_cycle_replicas = None
+_unhealthy_until = {}
+
+
+def mark_unhealthy(alias):
+    """Skip the replica for REPLICA_RETRY_SECONDS."""
+    _unhealthy_until[alias] = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+
+
+def replica_is_healthy(alias):
+    if _unhealthy_until.get(alias, 0) > time.monotonic():
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError:
+        mark_unhealthy(alias)
+        return False
+    return True
+
+
+def choose_replica():
+    """
+    Choose the replica for the reads of a request: the next one in round-robin order which is healthy.
+
+    :return: string, alias of the database (the primary if all replicas are down)
+    """
+    global _cycle, _cycle_replicas
+    replicas = settings.REPLICA_DATABASES
+    with _lock:
+        if _cycle_replicas != replicas:
+            _cycle = itertools.cycle(replicas)
+            _cycle_replicas = list(replicas)
+        candidates = [next(_cycle) for _ in replicas]
+    for alias in candidates:
+        if replica_is_healthy(alias):
+            return alias
+    return "default"
+
+
+def use_replica(alias):
+    """
+    Send reads of the current request (context) to the database.
+
+    :param alias: string, alias of the database or None to read from the primary
+    :return: tokens to pass to reset()
+    """
+    return _read_database.set(alias), _wrote.set(False)
+
+
+def read_from(alias):
+    """Send the following reads of the current request (context) to the database."""
+    _read_database.set(alias)
+
+
+def reset(tokens):
+    """
+    Stop reading from the replica.
+
+    :return: boolean, whether the request wrote to the primary
+    """
+    wrote = _wrote.get()
+    _read_database.reset(tokens[0])
+    _wrote.reset(tokens[1])
+    return wrote
+
+
+class ReplicaRouter:
+    """
+    Send reads of read-only views to a replica chosen by ReplicaMiddleware and everything else to the primary.
+
+    Once a request writes, its following reads go to the primary too, so it doesn't read stale data.
+    Replicas are copies of the primary, so they are never migrated.
+    """
+    def db_for_read(self, model, **hints):
+        return _read_database.get() or "default"
+
+    def db_for_write(self, model, **hints):
+        if _read_database.get() is not None:
+            _read_database.set(None)
+        _wrote.set(True)
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.REPLICA_DATABASES
@@ -60,6 +60,32 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Measurements of requests sent in Server-Timing headers, logs and /metrics; with PERFORMANCE_TRACE_MEMORY
+# the peak memory is measured too, but requests of a process are then handled one at a time
+PERFORMANCE_MIDDLEWARE = (os.getenv("PERFORMANCE_MIDDLEWARE") == "True")
+PERFORMANCE_TRACE_MEMORY = (os.getenv("PERFORMANCE_TRACE_MEMORY") == "True")
+if PERFORMANCE_MIDDLEWARE:
+    MIDDLEWARE.insert(0, 'document.middleware.PerformanceMiddleware')
+
+# Statements run more than QUERY_REPEAT_THRESHOLD times in a request are logged (QUERY_DETECTOR=True)
+# and fail the tests in actudoc/tests
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", 10))
+if os.getenv("QUERY_DETECTOR") == "True":
+    MIDDLEWARE.insert(0, 'document.middleware.QueryDetectorMiddleware')
+
+# Stack-sampled profiles of requests of document and account views slower than PROFILER_THRESHOLD_MS,
+# listed at /admin/profiles/ (PROFILER_ENABLED=True)
+PROFILER_ENABLED = (os.getenv("PROFILER_ENABLED") == "True")
+PROFILER_THRESHOLD_MS = int(os.getenv("PROFILER_THRESHOLD_MS", 500))
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", 5))
+PROFILER_DIR = os.getenv("PROFILER_DIR", os.path.join(BASE_DIR, "profiles"))
+PROFILER_MAX_FILES = int(os.getenv("PROFILER_MAX_FILES", 200))
+if PROFILER_ENABLED:
+    MIDDLEWARE.insert(0, 'document.middleware.ProfilerMiddleware')
+
+# Token which allows scraping /metrics without logging in (Authorization: Bearer <token>)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
 ROOT_URLCONF = 'actudoc.urls'
 
 TEMPLATES = [
@@ -109,6 +135,58 @@ if os.environ.get('GITHUB_WORKFLOW'):
            'PORT': 5432,
         }
     }
+    # Test mirror of the primary, so tests check which database the router sends queries to (see ReplicaRouter)
+    DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
+# Persistent connections (seconds, 0 closes the connection after each request), health checks of reused
+# connections and in-process connection pool (see actudoc/db/postgresql/base.py); with the backend,
+# migrations adding foreign keys to partitioned tables don't fail either (see actudoc/db/postgresql/schema.py)
+DATABASES['default']['ENGINE'] = 'actudoc.db.postgresql'
+DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv("DB_CONN_MAX_AGE", 0))
+DATABASES['default']['HEALTH_CHECKS'] = (os.getenv("DB_HEALTH_CHECKS") == "True")
+if os.getenv("DB_POOL") == "True":
+    DATABASES['default']['POOL'] = {
+        'SIZE': int(os.getenv("DB_POOL_SIZE", 10)),
+        'TIMEOUT': float(os.getenv("DB_POOL_TIMEOUT", 5)),
+    }
+
+# Read replicas (DB_REPLICAS=host[:port],...): read-only views read from them, round-robin, skipping replicas
+# which are down for REPLICA_RETRY_SECONDS; after a write, the session reads from the primary for
+# REPLICA_STICKY_SECONDS, so the user doesn't see stale data
+REPLICA_DATABASES = []
+for i, replica in enumerate(filter(None, os.getenv("DB_REPLICAS", "").split(",")), start=1):
+    host, _, port = replica.partition(":")
+    DATABASES[f'replica{i}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(f'replica{i}')
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 10))
+REPLICA_RETRY_SECONDS = int(os.getenv("REPLICA_RETRY_SECONDS", 30))
+if REPLICA_DATABASES:
+    DATABASE_ROUTERS = ['actudoc.db.routers.ReplicaRouter']
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.contrib.auth.middleware.AuthenticationMiddleware') + 1,
+                      'document.middleware.ReplicaMiddleware')
+
+# Async views of downloads, document list, search and the JSON API under ASGI (uvicorn, daphne)
+ASYNC_VIEWS = (os.getenv("ASYNC_VIEWS") == "True")
+# Number of threads running database queries of the async views
+ASYNC_DB_THREADS = int(os.getenv("ASYNC_DB_THREADS", 8))
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        'LOCATION': os.getenv("CACHE_LOCATION", ""),
+    }
+}
+
+# Rendered fragments of pages are cached per version of company's data (0 turns the caching off)
+FRAGMENT_CACHE_TIMEOUT = int(os.getenv("FRAGMENT_CACHE_TIMEOUT", 60 * 60))
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -153,6 +231,56 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = os.getenv("MEDIA_URL", default="/media/")
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Checkpoint and reports of scrub_documents (checks of stored files)
+SCRUB_DIR = os.getenv("SCRUB_DIR", os.path.join(BASE_DIR, "scrub"))
+
+# Cold storage: files of superseded documents not downloaded for COLD_AFTER_DAYS are packed into compressed
+# archives in COLD_STORAGE_DIR, or the bucket COLD_STORAGE_BUCKET of the object store if it's set (tier_documents),
+# and promoted back after COLD_PROMOTE_ACCESSES downloads within COLD_PROMOTE_DAYS; archives in which the remaining
+# documents take less than COLD_COMPACT_BELOW of the space are repacked
+COLD_STORAGE_DIR = os.getenv("COLD_STORAGE_DIR", os.path.join(BASE_DIR, "cold"))
+COLD_STORAGE_BUCKET = os.getenv("COLD_STORAGE_BUCKET", default="")
+COLD_AFTER_DAYS = int(os.getenv("COLD_AFTER_DAYS", 180))
+COLD_ARCHIVE_MAX_SIZE = int(os.getenv("COLD_ARCHIVE_MAX_SIZE", 1024 * 1024 * 1024))
+COLD_PROMOTE_ACCESSES = int(os.getenv("COLD_PROMOTE_ACCESSES", 3))
+COLD_PROMOTE_DAYS = int(os.getenv("COLD_PROMOTE_DAYS", 7))
+COLD_COMPACT_BELOW = float(os.getenv("COLD_COMPACT_BELOW", 0.5))
+
+# Uploaded files are stored in an S3-compatible object store instead of MEDIA_ROOT if S3_BUCKET is set
+S3_BUCKET = os.getenv("S3_BUCKET", default="")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", default="")
+S3_REGION = os.getenv("S3_REGION", default="")
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID", default="")
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY", default="")
+S3_URL_EXPIRE = int(os.getenv("S3_URL_EXPIRE", 60))
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", 8 * 1024 * 1024))
+S3_MULTIPART_CHUNK_SIZE = int(os.getenv("S3_MULTIPART_CHUNK_SIZE", 8 * 1024 * 1024))
+if S3_BUCKET:
+    DEFAULT_FILE_STORAGE = "document.storage.S3Storage"
+
+# Directories of uploaded documents: "flat" (company/document) or "sharded" (company/xx/yy/document)
+MEDIA_LAYOUT = os.getenv("MEDIA_LAYOUT", default="flat")
+
+# Background processing of uploaded files (0 means processing in the web process)
+BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", 2))
+
+# Thumbnails of the first page of documents
+THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", 240))
+THUMBNAIL_MAX_AGE = 60 * 60 * 24 * 365
+
+# Checksums of uploaded files are calculated while they are received (for duplicate checks)
+FILE_UPLOAD_HANDLERS = [
+    "document.upload_handlers.HashingUploadHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+
+# Linearized ("fast web view") copies of uploaded PDFs made with qpdf in the background
+LINEARIZE_PDFS = (os.getenv("LINEARIZE_PDFS") == "True")
+
+# Minimum estimated similarity of texts of near-duplicate documents (0 to 1, see utils/similarity.py)
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", 0.8))
+
 LOGIN_REDIRECT_URL = "main"
 LOGIN_URL = "/account/login"
 LOGOUT_URL = "/account/logout"
@@ -0,0 +1,48 @@
+import pytest
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+
+from document.utils.queries import QueryDetector
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "allow_repeated_queries: don't check the test for repeated queries")
+
+
+@pytest.fixture(autouse=True)
+def repeated_queries(request):
+    """
+    Fail tests whose requests run a statement more than QUERY_REPEAT_THRESHOLD times (N+1 queries).
+
+    Only queries of requests sent by the test client are checked, not the ones creating the test data.
+    Tests which run repeated queries on purpose are marked with @pytest.mark.allow_repeated_queries.
+    """
+    if request.node.get_closest_marker("allow_repeated_queries"):
+        yield None
+        return
+
+    reports = []
+    detector = QueryDetector(settings.QUERY_REPEAT_THRESHOLD)
+    detector.recording = False
+
+    def start(**kwargs):
+        detector.reset()
+        detector.recording = True
+
+    def finish(**kwargs):
+        if detector.recording and detector.repeated():
+            reports.append(detector.report())
+        detector.recording = False
+
+    request_started.connect(start)
+    request_finished.connect(finish)
+    try:
+        with detector:
+            yield detector
+    finally:
+        request_started.disconnect(start)
+        request_finished.disconnect(finish)
+
+    if reports:
+        pytest.fail(f"Repeated queries (more than {settings.QUERY_REPEAT_THRESHOLD} times) in a request:\n"
+                    + "\n".join(reports), pytrace=False)
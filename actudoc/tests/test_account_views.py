@@ -4,6 +4,7 @@ from django.test import Client, TestCase
 
 from account.models import Profile
 from document.models import Company
+from document.utils import utils
 
 
 class ExtendedTestCase(TestCase):
@@ -187,6 +188,70 @@ class TestUserListViewFix01(ExtendedTestCase):
         self.assertEqual(response.status_code, 200)
 
 
+class TestUserListView(ExtendedTestCase):
+    def create_employees(self, company, n):
+        for i in range(2, n + 2):
+            user = User.objects.create_user(username=str(i), email=f"user{i}@example.com", first_name=f"First{i}",
+                                            last_name=f"Last{i % 7}", is_active=i % 5 != 0)
+            Profile.objects.create(company=company, user=user, employee_num=i,
+                                   role="contributor" if i % 2 else "viewer")
+
+    def test_number_of_queries(self):
+        user = self.create_and_log_viewer()
+        self.create_employees(user.profile.company, 5)
+        with self.assertNumQueries(5):
+            self.client.get("/account/users/")
+
+        # The number of queries doesn't depend on the number of users
+        for i in range(7, 60):
+            other = User.objects.create_user(username=str(i), email=f"user{i}@example.com")
+            Profile.objects.create(company=user.profile.company, user=other, employee_num=i)
+        with self.assertNumQueries(5):
+            response = self.client.get("/account/users/")
+        self.assertEqual(len(response.context["users"]), 50)
+
+    def test_filter_and_sort(self):
+        user = self.create_and_log_viewer()
+        self.create_employees(user.profile.company, 20)
+
+        response = self.client.get("/account/users/?role=contributor&active=yes")
+        users = response.context["users"]
+        self.assertTrue(users)
+        self.assertTrue(all(u.profile.role == "contributor" and u.is_active for u in users))
+
+        response = self.client.get("/account/users/?name=last3")
+        self.assertEqual({u.last_name for u in response.context["users"]}, {"Last3"})
+
+        response = self.client.get("/account/users/?sort=-num")
+        nums = [u.profile.employee_num for u in response.context["users"]]
+        self.assertEqual(nums, sorted(nums, reverse=True))
+
+    def test_keyset_pagination(self):
+        user = self.create_and_log_viewer()
+        self.create_employees(user.profile.company, 120)
+
+        seen = []
+        query = "sort=name&active=yes"
+        while query:
+            response = self.client.get(f"/account/users/?{query}")
+            seen += [(u.last_name, u.first_name, u.profile.employee_num) for u in response.context["users"]]
+            query = response.context["next_query"]
+            if query:
+                self.assertIn("active=yes", query)
+        expected = User.objects.filter(profile__company=user.profile.company, is_active=True)
+        self.assertEqual(seen, sorted((u.last_name, u.first_name, u.profile.employee_num)
+                                      for u in expected.select_related("profile")))
+
+        # Invalid cursor shows the first page
+        response = self.client.get("/account/users/?after=invalid")
+        self.assertEqual(response.status_code, 200)
+        first_page = [u.pk for u in response.context["users"]]
+        for values in (["x"], [{"a": 1}], [[1]], [1, 2]):
+            response = self.client.get("/account/users/", {"after": utils.encode_keyset_cursor(values)})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([u.pk for u in response.context["users"]], first_page)
+
+
 class TestEditUserByAdminViewFix05(ExtendedTestCase):
     fixtures = ["05.json"]
 
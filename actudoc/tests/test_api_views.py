@@ -0,0 +1,158 @@
+import json
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
+
+from account.models import Profile
+from document.models import Category, Company, Document, Product
+
+
+class ExtendedTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.company = Company.objects.create(name="alpha", full_name="alpha", code="1234")
+        self.product = Product.objects.create(company=self.company, company_product_id=1, name="Term", model="TERM")
+        self.category = Category.objects.create(company=self.company, company_category_id=1, name="Terms")
+
+    def create_and_log_user(self, role="viewer", company=None):
+        company = company or self.company
+        user = User.objects.create(username=str(User.objects.count() + 1), email=f"{role}@{company.name}.com")
+        Profile.objects.create(company=company, user=user, employee_num=user.pk, role=role)
+        self.client.force_login(user)
+        return user
+
+    def use_temporary_media_root(self):
+        """Store files saved in the test in a temporary MEDIA_ROOT, which is removed after the test."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media_root = override_settings(MEDIA_ROOT=directory.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def create_documents(self, user, n):
+        for i in range(1, n + 1):
+            document = Document.objects.create(
+                company=self.company,
+                company_document_id=i,
+                category=self.category,
+                validity_start=f"2022-01-{i:02d}",
+                file=f"alpha/{i}/{i}.pdf",
+                title=f"Document {i}",
+                created_by=user,
+            )
+            document.product.add(self.product)
+
+
+class TestDocumentApiView(ExtendedTestCase):
+    def test_get(self):
+        # Log-in is required
+        response = self.client.get("/api/alpha/documents/")
+        self.assertEqual(response.status_code, 403)
+
+        user = self.create_and_log_user()
+        self.create_documents(user, n=5)
+
+        response = self.client.get("/api/alpha/documents/")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([d["id"] for d in data["results"]], [5, 4, 3, 2, 1])
+        self.assertEqual(data["results"][0]["products"], [1])
+        self.assertEqual(data["results"][0]["category"], 1)
+        self.assertIsNone(data["next"])
+
+        # Sparse fieldsets
+        response = self.client.get("/api/alpha/documents/?fields=id,title")
+        self.assertEqual(response.json()["results"][0], {"id": 5, "title": "Document 5"})
+        response = self.client.get("/api/alpha/documents/?fields=id,unknown")
+        self.assertEqual(response.status_code, 400)
+
+        # Cursor pagination
+        response = self.client.get("/api/alpha/documents/?fields=id&limit=2")
+        data = response.json()
+        self.assertEqual([d["id"] for d in data["results"]], [5, 4])
+        response = self.client.get(data["next"])
+        data = response.json()
+        self.assertEqual([d["id"] for d in data["results"]], [3, 2])
+        response = self.client.get(data["next"])
+        data = response.json()
+        self.assertEqual([d["id"] for d in data["results"]], [1])
+        self.assertIsNone(data["next"])
+
+        # Bulk retrieval by ids
+        response = self.client.get("/api/alpha/documents/?fields=id&ids=1,3,99")
+        self.assertEqual([d["id"] for d in response.json()["results"]], [3, 1])
+
+        # Single document
+        response = self.client.get("/api/alpha/documents/2")
+        self.assertEqual(response.json()["title"], "Document 2")
+        response = self.client.get("/api/alpha/documents/99")
+        self.assertEqual(response.status_code, 404)
+
+        # Conditional GET
+        response = self.client.get("/api/alpha/documents/")
+        response = self.client.get("/api/alpha/documents/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_get_other_company(self):
+        beta = Company.objects.create(name="beta", full_name="beta", code="5678")
+        self.create_and_log_user(company=beta)
+        response = self.client.get("/api/alpha/documents/")
+        self.assertEqual(response.status_code, 403)
+
+    def test_post(self):
+        self.use_temporary_media_root()
+        data = {
+            "products": "1",
+            "category": "1",
+            "validity_start": "2022-02-01",
+            "title": "New document",
+            "file": SimpleUploadedFile("new.pdf", b"%PDF-1.4", content_type="application/pdf"),
+        }
+
+        # Viewers can't add documents
+        self.create_and_log_user()
+        response = self.client.post("/api/alpha/documents/", data)
+        self.assertEqual(response.status_code, 403)
+
+        self.create_and_log_user(role="contributor")
+        data["file"].seek(0)
+        response = self.client.post("/api/alpha/documents/", data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["id"], 1)
+        self.assertEqual(response.json()["products"], [1])
+
+        # Edit with JSON, fields missing in the request are unchanged
+        response = self.client.patch("/api/alpha/documents/1", json.dumps({"title": "Changed"}),
+                                     content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        document = Document.objects.get()
+        self.assertEqual(document.title, "Changed")
+        self.assertEqual(str(document.validity_start), "2022-02-01")
+        self.assertEqual(list(document.product.all()), [self.product])
+
+        response = self.client.patch("/api/alpha/documents/1", json.dumps({"category": 99}),
+                                     content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.delete("/api/alpha/documents/1")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(Document.objects.count(), 0)
+
+
+class TestProductApiView(ExtendedTestCase):
+    def test_post(self):
+        self.create_and_log_user(role="admin")
+        response = self.client.post("/api/alpha/products/", json.dumps({"name": "Annuity", "model": "ANN"}),
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {"id": 2, "name": "Annuity", "model": "ANN"})
+
+        response = self.client.post("/api/alpha/products/", json.dumps({"model": "ANN"}),
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("name", response.json()["errors"])
+
+        response = self.client.get("/api/alpha/products/")
+        self.assertEqual([p["id"] for p in response.json()["results"]], [1, 2])
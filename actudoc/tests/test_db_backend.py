@@ -0,0 +1,50 @@
+import threading
+
+from django.db import OperationalError
+from django.test import SimpleTestCase
+from psycopg2 import extensions
+
+from actudoc.db.postgresql.base import ConnectionPool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.rolled_back = False
+        self.info = type("Info", (), {"transaction_status": extensions.TRANSACTION_STATUS_IDLE})()
+
+    def close(self):
+        self.closed = True
+
+    def rollback(self):
+        self.rolled_back = True
+        self.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+
+class TestConnectionPool(SimpleTestCase):
+    def test_reuse(self):
+        pool = ConnectionPool(FakeConnection, size=2, timeout=0.01)
+        connection = pool.get()
+        pool.put(connection)
+        self.assertIs(pool.get(), connection)
+
+        # Connection left in a transaction is rolled back, a closed one is replaced
+        connection.info.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+        pool.put(connection)
+        self.assertTrue(connection.rolled_back)
+        connection = pool.get()
+        connection.close()
+        pool.put(connection)
+        self.assertIsNot(pool.get(), connection)
+
+    def test_size(self):
+        pool = ConnectionPool(FakeConnection, size=2, timeout=0.01)
+        connections = [pool.get(), pool.get()]
+        with self.assertRaises(OperationalError):
+            pool.get()
+
+        # A connection returned by another thread can be taken
+        thread = threading.Thread(target=pool.put, args=(connections[0],))
+        thread.start()
+        thread.join()
+        self.assertIs(pool.get(), connections[0])
@@ -1,18 +1,56 @@
 import datetime
+import hashlib
+import json
 import os
-
-from django.contrib.auth.models import User
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import PermissionDenied
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.db import connection, connections, transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.test import AsyncRequestFactory, Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.template.backends.django import Template as DjangoTemplate
+from django.test.utils import CaptureQueriesContext
 
 from account.models import Profile
-from document.models import Category, Company, Document, Product, History
+from actudoc import urls
+from actudoc.db import routers
+from document import async_urls, async_views, models
+from document.middleware import PerformanceMiddleware, ReplicaMiddleware
+from document.models import Category, ColdDocument, Company, Document, DocumentStatistic, Product, History
+from document.utils import (benchmark, facets, instrumentation, linearize, media_layout, metadata, metrics,
+                            partitioning, profiler, queries, scrub, similarity, synthetic, thumbnails, tiering,
+                            uploads, utils)
 
 
 class ExtendedTestCase(TestCase):
     def setUp(self):
         self.client = Client()
 
+    def create_temporary_directory(self):
+        """Create a directory which is removed after the test."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return directory.name
+
+    def use_temporary_media_root(self):
+        """Store files saved in the test in a temporary MEDIA_ROOT."""
+        media_root = override_settings(MEDIA_ROOT=self.create_temporary_directory())
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
     def create_and_log_viewer(self):
         company = Company.objects.create(name="alpha", full_name="alpha", code="1234")
         user = User.objects.create(username="1", email="viewer@example.com")
@@ -51,16 +89,16 @@ class ExtendedTestCase(TestCase):
 
     def create_documents(self, user, product, category, n=10):
         for i in range(n):
-            Document.objects.create(
+            document = Document.objects.create(
                 company=user.profile.company,
                 company_document_id=i,
-                product=product,
                 category=category,
                 validity_start=f"2022-01-0{i+1}" if i < 9 else f"2022-01-{i+1}",
                 file=f"{i}.pdf",
                 title="My document",
                 created_by=user
             )
+            document.product.add(product)
         return None
 
 
@@ -97,6 +135,31 @@ class TestMainView(ExtendedTestCase):
         self.assertEqual(len(response.context.get("documents")), 4)
 
 
+class TestMainViewCardCache(ExtendedTestCase):
+    def test_get(self):
+        user = self.create_and_log_viewer()
+        product = self.create_product(company=user.profile.company)
+        category = self.create_category(company=user.profile.company)
+        self.create_documents(user=user, product=product, category=category, n=2)
+
+        response = self.client.get("/")
+        self.assertContains(response, "Term Life Insurance (TERM02)", count=2)
+
+        # Cached cards are not used after changes to the product or category of the document
+        product.name = "Whole of Life"
+        product.save()
+        category.name = "Terms"
+        category.save()
+        response = self.client.get("/")
+        self.assertContains(response, "Whole of Life (TERM02)", count=2)
+        self.assertContains(response, "Terms", count=2)
+
+        document = Document.objects.get(company_document_id=0)
+        document.product.clear()
+        response = self.client.get("/")
+        self.assertContains(response, "Whole of Life (TERM02)", count=1)
+
+
 class TestMainViewFix01(ExtendedTestCase):
     fixtures = ["01.json"]
 
@@ -182,6 +245,60 @@ class TestManageViewFix01(ExtendedTestCase):
         self.assertEqual(len(response.context.get("categories")), 1)
 
 
+class TestManageViewConditional(ExtendedTestCase):
+    def test_get(self):
+        user = self.create_and_log_contributor()
+        response = self.client.get("/manage/")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        # Page hasn't changed
+        response = self.client.get("/manage/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Any change to company's data changes the page
+        self.create_product(company=user.profile.company)
+        response = self.client.get("/manage/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context.get("products")), 1)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class TestStatisticsView(ExtendedTestCase):
+    def test_get(self):
+        response = self.client.get("/statistics/")
+        self.assertEqual(response.status_code, 302)
+
+        user = self.create_and_log_viewer()
+        product = self.create_product(company=user.profile.company)
+        category = self.create_category(company=user.profile.company)
+        self.create_documents(user=user, product=product, category=category, n=3)
+
+        response = self.client.get("/statistics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context.get("total"), 3)
+        self.assertEqual(response.context.get("by_product"), [("Term Life Insurance (TERM02)", 3)])
+        self.assertEqual(response.context.get("by_category"), [("Technical description", 3)])
+
+        # Statistics are updated with changes to documents
+        other_category = Category.objects.create(company=user.profile.company, company_category_id=2, name="Terms")
+        document = Document.objects.get(company_document_id=0)
+        document.category = other_category
+        document.save()
+        document.product.clear()
+        Document.objects.get(company_document_id=1).delete()
+
+        response = self.client.get("/statistics/")
+        self.assertEqual(response.context.get("total"), 2)
+        self.assertEqual(response.context.get("by_product"), [("Term Life Insurance (TERM02)", 1)])
+        self.assertEqual(response.context.get("by_category"), [("Technical description", 1), ("Terms", 1)])
+
+        # Full rebuild gives the same statistics
+        incremental = set(DocumentStatistic.objects.filter(count__gt=0).values_list("dimension", "key", "count"))
+        call_command("rebuild_statistics", stdout=StringIO())
+        self.assertEqual(set(DocumentStatistic.objects.values_list("dimension", "key", "count")), incremental)
+
+
 class TestAddProductView(ExtendedTestCase):
     def test_get(self):
         response = self.client.get("/product/add/")
@@ -783,3 +900,1140 @@ class TestDownloadDocumentViewFix01(ExtendedTestCase):
         response = self.client.get("/download/alpha/1")
         self.assertEqual(response.status_code, 200)
         os.remove("media/alpha/fileA.pdf")
+
+
+class TestThumbnailView(ExtendedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_media_root()
+
+    def test_get(self):
+        user = self.create_and_log_viewer()
+        product = self.create_product(company=user.profile.company)
+        category = self.create_category(company=user.profile.company)
+        self.create_documents(user=user, product=product, category=category, n=1)
+        document = Document.objects.get()
+        document.file.save("0.pdf", ContentFile(b"%PDF-1.4"))
+
+        # Thumbnail is generated in the background, so there might be none yet
+        response = self.client.get("/thumbnail/alpha/0")
+        self.assertEqual(response.status_code, 404)
+
+        # Checksum of the file is saved even if the thumbnail can't be rendered
+        metadata.extract_metadata(document.pk)
+        document.refresh_from_db()
+        self.assertEqual(len(document.sha256), 64)
+
+        document.thumbnail.save(thumbnails.thumbnail_path(document, document.sha256), ContentFile(b"png"))
+        response = self.client.get("/thumbnail/alpha/0")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], f'"{document.sha256}"')
+        self.assertIn("max-age", response["Cache-Control"])
+
+        # Browser can revalidate its copy
+        response = self.client.get("/thumbnail/alpha/0", HTTP_IF_NONE_MATCH=f'"{document.sha256}"')
+        self.assertEqual(response.status_code, 304)
+
+        # Thumbnail is deleted with the document
+        thumbnail_name = document.thumbnail.name
+        document.delete()
+        self.assertFalse(document.thumbnail.storage.exists(thumbnail_name))
+
+
+@override_settings(MIDDLEWARE=["document.middleware.PerformanceMiddleware"] + settings.MIDDLEWARE,
+                   PERFORMANCE_TRACE_MEMORY=True, METRICS_TOKEN="secret")
+class TestPerformanceMiddleware(ExtendedTestCase):
+    def setUp(self):
+        super().setUp()
+        for histogram in metrics.HISTOGRAMS.values():
+            histogram.reset()
+
+    def test_measurements(self):
+        user = self.create_and_log_viewer()
+        product = self.create_product(company=user.profile.company)
+        category = self.create_category(company=user.profile.company)
+        self.create_documents(user=user, product=product, category=category, n=3)
+
+        with self.assertLogs("actudoc.performance", level="INFO") as logs:
+            response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("db;dur=", response["Server-Timing"])
+        self.assertIn('"view": "document.views.MainView"', logs.output[0])
+
+        # Metrics are only available to superusers and scrapers with the token
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('actudoc_request_duration_seconds_count{view="document.views.MainView"} 1', content)
+        self.assertIn('actudoc_request_queries_bucket{view="document.views.MainView"', content)
+        self.assertIn('actudoc_request_peak_memory_bytes_count{view="document.views.MainView"} 1', content)
+
+    def test_template_time(self):
+        # Rendering is timed since the start of the application, not since the first request
+        self.assertTrue(getattr(DjangoTemplate.render, "performance_timed", False))
+        self.create_and_log_viewer()
+        response = self.client.get("/")
+        self.assertNotIn("template;dur=0.0", response["Server-Timing"])
+
+    def test_streaming_bytes(self):
+        def get_response(request):
+            request.performance_view_name = "streaming"
+            return StreamingHttpResponse(iter([b"12345", b"678"]))
+
+        request = RequestFactory().get("/stream")
+        response = PerformanceMiddleware(get_response)(request)
+        self.assertIn("db;dur=", response["Server-Timing"])
+        with self.assertLogs("actudoc.performance", level="INFO") as logs:
+            self.assertEqual(b"".join(response.streaming_content), b"12345678")
+        self.assertEqual(json.loads(logs.records[0].getMessage())["bytes"], 8)
+
+    def test_memory_traced_one_request_at_a_time(self):
+        running = []
+        overlaps = []
+
+        def get_response(request):
+            running.append(request)
+            overlaps.append(len(running))
+            time.sleep(0.05)
+            running.remove(request)
+            return HttpResponse("ok")
+
+        middleware = PerformanceMiddleware(get_response)
+        threads = [threading.Thread(target=middleware, args=(RequestFactory().get("/"),)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(overlaps, [1, 1, 1])
+
+
+class TestQueryDetector(ExtendedTestCase):
+    def test_fingerprint(self):
+        self.assertEqual(queries.fingerprint("SELECT * FROM t WHERE id = 12 AND name = 'O''Neil'"),
+                         "SELECT * FROM t WHERE id = ? AND name = ?")
+        self.assertEqual(queries.fingerprint("SELECT * FROM t WHERE id IN (%s, %s,\n %s)"),
+                         "SELECT * FROM t WHERE id IN (...)")
+
+    def test_repeated(self):
+        user = self.create_and_log_viewer()
+        product = self.create_product(company=user.profile.company)
+        category = self.create_category(company=user.profile.company)
+        self.create_documents(user=user, product=product, category=category, n=4)
+
+        with queries.QueryDetector(threshold=3) as detector:
+            for document in Document.objects.all():
+                document.category.name
+        repeated = detector.repeated()
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0]["count"], 4)
+        self.assertIn('FROM "document_category"', repeated[0]["sql"])
+        self.assertIn("test_document_views.py", repeated[0]["callers"][0][0])
+        self.assertIn("4x", detector.report())
+
+
+class TestProfilerMiddleware(ExtendedTestCase):
+    def test_slow_request(self):
+        directory = self.create_temporary_directory()
+        user = self.create_and_log_viewer()
+        product = self.create_product(company=user.profile.company)
+        category = self.create_category(company=user.profile.company)
+        self.create_documents(user=user, product=product, category=category, n=10)
+
+        with self.settings(PROFILER_THRESHOLD_MS=0, PROFILER_INTERVAL_MS=1, PROFILER_DIR=directory,
+                           PROFILER_MAX_FILES=2):
+            with self.settings(MIDDLEWARE=["document.middleware.ProfilerMiddleware"] + settings.MIDDLEWARE):
+                # Test client keeps the middleware of its first request
+                client = Client()
+                client.force_login(user)
+                for _ in range(3):
+                    client.get("/")
+                client.get("/account/login/")
+
+            profiles = profiler.list_profiles(directory)
+            # Only the latest profiles are kept and only document and account views are profiled
+            self.assertEqual(len(profiles), 2)
+            self.assertEqual({profile["view"] for profile in profiles},
+                             {"document.views.MainView", "account.views.LoginView"})
+
+            # Profiles are only available to superusers
+            response = self.client.get("/admin/profiles/")
+            self.assertEqual(response.status_code, 403)
+            user.is_superuser = True
+            user.save()
+            response = self.client.get("/admin/profiles/")
+            self.assertContains(response, "document.views.MainView")
+
+            response = self.client.get(f"/admin/profiles/{profiles[0]['name']}")
+            self.assertEqual(response.status_code, 200)
+            self.assertRegex(response.content.decode().splitlines()[0], r"^\S+;\S+ \d+$")
+            response = self.client.get("/admin/profiles/missing.json")
+            self.assertEqual(response.status_code, 404)
+
+
+@override_settings(ASYNC_DB_THREADS=0)
+class TestAsyncViews(ExtendedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_media_root()
+
+    def test_main(self):
+        user = self.create_and_log_viewer()
+        product = self.create_product(company=user.profile.company)
+        category = self.create_category(company=user.profile.company)
+        self.create_documents(user=user, product=product, category=category, n=3)
+
+        request = AsyncRequestFactory().get("/search/", {"phrase": "My document"})
+        request.user = user
+        response = async_to_sync(async_views.main)(request)
+        self.assertContains(response, "My document", count=3)
+
+    def test_download(self):
+        user = self.create_and_log_viewer()
+        product = self.create_product(company=user.profile.company)
+        category = self.create_category(company=user.profile.company)
+        self.create_documents(user=user, product=product, category=category, n=1)
+        Document.objects.get().file.save("0.pdf", ContentFile(b"%PDF-1.4 content"))
+
+        request = AsyncRequestFactory().get("/download/alpha/0")
+        request.user = user
+        response = async_to_sync(async_views.download)(request, "alpha", "0")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4 content")
+        response.close()
+
+        with self.assertRaises(PermissionDenied):
+            async_to_sync(async_views.download)(request, "beta", "0")
+
+        request.user = AnonymousUser()
+        response = async_to_sync(async_views.download)(request, "alpha", "0")
+        self.assertEqual(response.status_code, 302)
+
+
+# URLs of the ASGI deployment (ASYNC_VIEWS=True) for TestAsyncViewsInPool
+urlpatterns = async_urls.urlpatterns + urls.urlpatterns
+
+
+@unittest.skipUnless("replica" in settings.DATABASES, "Needs the replica database (a test mirror of the primary)")
+@override_settings(ROOT_URLCONF=__name__, ASYNC_DB_THREADS=2,
+                   MIDDLEWARE=["document.middleware.PerformanceMiddleware"] + settings.MIDDLEWARE + [
+                       "document.middleware.ReplicaMiddleware"],
+                   DATABASE_ROUTERS=["actudoc.db.routers.ReplicaRouter"], REPLICA_DATABASES=["replica"],
+                   REPLICA_STICKY_SECONDS=60)
+class TestAsyncViewsInPool(TransactionTestCase):
+    # The data is committed, so that the connections of the pool's threads see it
+    databases = {"default", "replica"}
+
+    def get_main(self):
+        """Get the document list, recording (thread, database) of the queries of documents and their number."""
+        executed = []
+
+        def record(execute, sql, params, many, context):
+            executed.append((threading.current_thread().name, context["connection"].alias, sql))
+            return execute(sql, params, many, context)
+
+        with instrumentation.execute_wrapper(record):
+            response = async_to_sync(self.async_client.get)("/")
+        self.assertEqual(response.status_code, 200)
+        return response, [(thread, alias) for thread, alias, sql in executed if '"document_document"' in sql], \
+            len(executed)
+
+    def test_context_in_pool(self):
+        company = Company.objects.create(name="alpha", full_name="alpha", code="1234")
+        user = User.objects.create(username="1", email="contributor@example.com")
+        Profile.objects.create(company=company, user=user, employee_num=1, role="contributor")
+        self.async_client.force_login(user)
+
+        # Documents are read in the pool from the replica chosen by the middleware, and the queries of the pool
+        # are measured
+        response, document_queries, n_queries = self.get_main()
+        self.assertTrue(document_queries)
+        self.assertTrue(all(thread.startswith("actudoc-db") and alias == "replica"
+                            for thread, alias in document_queries))
+        self.assertIn(f'desc="{n_queries} queries"', response["Server-Timing"])
+
+        # A write of the async API makes the session read from the primary
+        response = async_to_sync(self.async_client.post)("/api/alpha/products/", json.dumps(
+            {"name": "Term Life", "model": "TERM02"}), content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertGreater(self.async_client.session[ReplicaMiddleware.sticky_key], time.time())
+        response, document_queries, n_queries = self.get_main()
+        self.assertTrue(document_queries)
+        self.assertTrue(all(alias == "default" for thread, alias in document_queries))
+
+
+# The test database stands in for the replica, as with TEST MIRROR of replicas in settings.py
+@override_settings(MIDDLEWARE=settings.MIDDLEWARE + ["document.middleware.ReplicaMiddleware"],
+                   DATABASE_ROUTERS=["actudoc.db.routers.ReplicaRouter"], REPLICA_DATABASES=["default"],
+                   REPLICA_STICKY_SECONDS=60)
+class TestReplicaRouting(ExtendedTestCase):
+    def test_sticky_after_write(self):
+        self.create_and_log_contributor()
+        response = self.client.get("/")
+        self.assertEqual(response.wsgi_request.read_database, "default")
+
+        # Views which aren't read-only always use the primary
+        response = self.client.get("/product/add/")
+        self.assertIsNone(response.wsgi_request.read_database)
+
+        # After a write, the session reads from the primary
+        response = self.client.post("/product/add/", {"name": "Term Life Insurance", "model": "TERM02"})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get("/")
+        self.assertIsNone(response.wsgi_request.read_database)
+
+        session = self.client.session
+        session[ReplicaMiddleware.sticky_key] = 0
+        session.save()
+        response = self.client.get("/manage/")
+        self.assertEqual(response.wsgi_request.read_database, "default")
+
+    def test_unhealthy_replica(self):
+        with self.settings(REPLICA_DATABASES=["default", "replica"], REPLICA_RETRY_SECONDS=60):
+            # Down replica is skipped, so the reads are spread over the healthy ones only
+            routers.mark_unhealthy("replica")
+            self.assertEqual({routers.choose_replica() for _ in range(4)}, {"default"})
+
+            # Without healthy replicas, reads go to the primary
+            routers.mark_unhealthy("default")
+            self.assertEqual(routers.choose_replica(), "default")
+            self.assertFalse(routers.replica_is_healthy("default"))
+        routers._unhealthy_until.clear()
+
+
+@unittest.skipUnless("replica" in settings.DATABASES, "Needs the replica database (a test mirror of the primary)")
+@override_settings(MIDDLEWARE=settings.MIDDLEWARE + ["document.middleware.ReplicaMiddleware"],
+                   DATABASE_ROUTERS=["actudoc.db.routers.ReplicaRouter"], REPLICA_DATABASES=["replica"],
+                   REPLICA_STICKY_SECONDS=60)
+class TestReplicaDatabases(TransactionTestCase):
+    # The data is committed, so that the replica's own connection sees it
+    databases = {"default", "replica"}
+
+    def document_queries(self, context):
+        return [query["sql"] for query in context if '"document_document"' in query["sql"]]
+
+    def test_routing(self):
+        company = Company.objects.create(name="alpha", full_name="alpha", code="1234")
+        user = User.objects.create(username="1", email="contributor@example.com")
+        Profile.objects.create(company=company, user=user, employee_num=1, role="contributor")
+        self.client.force_login(user)
+
+        # Read-only views read from the replica
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections["replica"]) as replica:
+            response = self.client.get("/")
+        self.assertEqual(response.wsgi_request.read_database, "replica")
+        self.assertTrue(self.document_queries(replica))
+        self.assertFalse(self.document_queries(primary))
+
+        # Writes go to the primary, and so do the following reads of the session
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections["replica"]) as replica:
+            response = self.client.post("/product/add/", {"name": "Term Life Insurance", "model": "TERM02"})
+            self.assertEqual(response.status_code, 302)
+            response = self.client.get("/")
+        self.assertIsNone(response.wsgi_request.read_database)
+        self.assertTrue([query for query in primary if query["sql"].startswith("INSERT")])
+        self.assertTrue(self.document_queries(primary))
+        self.assertEqual(len(replica), 0)
+
+        # select_for_update uses the primary and so do the reads after it
+        tokens = routers.use_replica("replica")
+        try:
+            self.assertEqual(Document.objects.all().db, "replica")
+            with transaction.atomic(), CaptureQueriesContext(connections["default"]) as primary:
+                list(Document.objects.select_for_update().filter(company=company))
+            self.assertEqual(len(self.document_queries(primary)), 1)
+            self.assertEqual(Document.objects.all().db, "default")
+        finally:
+            self.assertTrue(routers.reset(tokens))
+
+
+class TestPartitionDocuments(ExtendedTestCase):
+    def test_requires_postgresql(self):
+        if connection.vendor == "postgresql":
+            self.skipTest("PostgreSQL supports partitioning")
+        with self.assertRaises(CommandError):
+            call_command("partition_documents", "--dry-run", stdout=StringIO())
+
+    def create_partitioned_data(self):
+        user = self.create_and_log_contributor()
+        company = user.profile.company
+        category = Category.objects.create(company=company, company_category_id=1, name="Terms")
+        product = Product.objects.create(company=company, company_product_id=1, name="Term Life", model="TERM02")
+        for i in range(3):
+            document = Document.objects.create(company=company, company_document_id=i, title=f"Terms {i}",
+                                               category=category, created_by=user, file=f"terms{i}.pdf",
+                                               validity_start=datetime.date(2022, 1, 1))
+            document.product.add(product)
+            History.objects.create(document=document, element="title", changed_from="Terms", changed_to=f"Terms {i}",
+                                   changed_by=user)
+        # Tables with pending checks of deferred foreign keys can't be altered in the same transaction
+        connection.check_constraints()
+        return user, company, category, product
+
+    @unittest.skipUnless(connection.vendor == "postgresql", "Partitioning needs PostgreSQL")
+    def test_partition(self):
+        user, company, category, product = self.create_partitioned_data()
+        self.assertEqual(History.objects.filter(company=company).count(), 3)
+
+        call_command("partition_documents", "--method", "list", "--batch-size", "2", stdout=StringIO())
+        tables = partitioning.partitioned_tables()
+        self.assertTrue({table for table, key in partitioning.get_targets().values()} <= tables)
+        self.assertNotIn(Document.product.through._meta.db_table, tables)
+        self.assertEqual(Document.objects.filter(company=company, product=product).count(), 3)
+        self.assertEqual(History.objects.filter(company=company).count(), 3)
+
+        # New documents of new companies go to the default partition
+        other = Company.objects.create(name="gamma", full_name="gamma", code="9012")
+        Document.objects.create(company=other, company_document_id=0, title="Terms", category=category,
+                                created_by=user, file="terms.pdf", validity_start=datetime.date(2022, 1, 1))
+        self.assertEqual(Document.objects.count(), 4)
+
+        with self.assertRaises(CommandError):
+            call_command("partition_documents", "--tables", "documents", stdout=StringIO())
+
+    @unittest.skipUnless(connection.vendor == "postgresql", "Partitioning needs PostgreSQL")
+    def test_migrate_after_partition(self):
+        user, company, category, product = self.create_partitioned_data()
+        call_command("partition_documents", "--tables", "documents", "--partitions", "4", stdout=StringIO())
+
+        # Migrations which create foreign keys to documents (similarity) can be unapplied and applied again
+        call_command("migrate", "document", "0034", verbosity=0)
+        call_command("migrate", "document", verbosity=0)
+        self.assertIn(Document._meta.db_table, partitioning.partitioned_tables())
+        document = Document.objects.filter(company=company).first()
+        similarity.store_signature(document.pk, similarity.minhash(similarity.shingles("terms of the product")))
+        self.assertEqual(models.SimilarityBucket.objects.filter(document=document).count(), similarity.BANDS)
+        self.assertEqual(History.objects.filter(company=company).count(), 3)
+
+    @unittest.skipUnless(connection.vendor == "postgresql", "Partitioning needs PostgreSQL")
+    def test_unapplied_migrations(self):
+        self.create_partitioned_data()
+        call_command("migrate", "document", "0037", verbosity=0)
+        with self.assertRaises(CommandError):
+            call_command("partition_documents", "--dry-run", stdout=StringIO())
+        call_command("migrate", "document", verbosity=0)
+        self.assertEqual(History.objects.exclude(company=None).count(), 3)
+
+
+class TestCompanyResolver(ExtendedTestCase):
+    def test_get_company_object(self):
+        user = self.create_and_log_contributor()
+        company = user.profile.company
+        self.create_documents(user, self.create_product(company), self.create_category(company), n=1)
+        request = RequestFactory().get("/")
+        request.user = User.objects.select_related("profile").get(pk=user.pk)
+
+        # The company comes from the map and is joined to the object
+        utils.get_company_id("beta")
+        with self.assertNumQueries(1):
+            document = utils.get_company_object(request, Document, "beta", company_document_id=0)
+            self.assertEqual(document.company.name, "beta")
+
+        other = Company.objects.create(name="gamma", full_name="gamma", code="9012")
+        with self.assertRaises(PermissionDenied):
+            utils.get_company_object(request, Document, "gamma", company_document_id=0)
+        with self.assertRaises(PermissionDenied):
+            utils.get_company_object(request, Document, "missing", company_document_id=0)
+        with self.assertRaises(Http404):
+            utils.get_company_object(request, Document, "beta", company_document_id=1)
+
+        # Renaming a company invalidates the map
+        company.name, other.name = "delta", "beta"
+        company.save()
+        other.save()
+        self.assertEqual(utils.get_company_id("delta"), company.pk)
+        with self.assertRaises(PermissionDenied):
+            utils.get_company_object(request, Document, "beta", company_document_id=0)
+
+    def test_renamed_in_other_process(self):
+        user = self.create_and_log_contributor()
+        old = user.profile.company
+        self.assertEqual(utils.get_company_id("beta"), old.pk)
+
+        # Another process renames the company and creates a new one with its name (without signals of this process)
+        Company.objects.filter(pk=old.pk).update(name="delta")
+        Company.objects.bulk_create([Company(name="beta", full_name="beta", code="9012")])
+        new = Company.objects.get(name="beta")
+        other = User.objects.create(username="3", email="other@example.com")
+        Profile.objects.create(company=new, user=other, employee_num=1, role="contributor")
+        self.create_documents(other, self.create_product(new), self.create_category(new), n=1)
+
+        request = RequestFactory().get("/")
+        request.user = User.objects.select_related("profile").get(pk=other.pk)
+        self.assertTrue(utils.user_is_employee(request, "beta"))
+        self.assertEqual(utils.get_company_object(request, Document, "beta", company_document_id=0).company, new)
+        self.assertEqual(utils.get_company_id("beta"), new.pk)
+        self.client.force_login(other)
+        response = self.client.get("/api/beta/documents/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 1)
+
+        # The user of the renamed company is still denied access to the new one
+        request.user = User.objects.select_related("profile").get(pk=user.pk)
+        self.assertFalse(utils.user_is_employee(request, "beta"))
+        with self.assertRaises(PermissionDenied):
+            utils.get_company_object(request, Document, "beta", company_document_id=0)
+
+    def test_views(self):
+        user = self.create_and_log_contributor()
+        company = user.profile.company
+        self.create_documents(user, self.create_product(company), self.create_category(company), n=1)
+        self.client.get("/document/beta/0")
+        with self.assertNumQueries(8):
+            response = self.client.get("/document/beta/0")
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get("/document/alpha/0")
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post("/document/delete/beta/0")
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Document.objects.exists())
+
+
+class TestSyntheticData(ExtendedTestCase):
+    def test_split_documents(self):
+        self.assertEqual(synthetic.split_documents(100, 3), [34, 33, 33])
+        counts = synthetic.split_documents(1000, 4, skew=1.0)
+        self.assertEqual(sum(counts), 1000)
+        self.assertEqual(counts, sorted(counts, reverse=True))
+
+    def test_bulk_insert(self):
+        company = Company.objects.create(name="alpha", full_name="alpha", code="1234")
+        synthetic.bulk_insert(Product, (
+            Product(company=company, company_product_id=i, name=f"Product {i}", model=f"MOD{i}") for i in range(5)
+        ), batch_size=2)
+        self.assertEqual(list(Product.objects.order_by("company_product_id").values_list("model", flat=True)),
+                         [f"MOD{i}" for i in range(5)])
+
+    def test_generate_company(self):
+        company = synthetic.generate_company("synth1", products=4, categories=2, documents=20, users=3, files=False,
+                                             batch_size=7)
+        self.assertEqual(Profile.objects.filter(company=company).count(), 3)
+        self.assertEqual(Product.objects.filter(company=company).count(), 4)
+        self.assertEqual(Category.objects.filter(company=company).count(), 2)
+        documents = Document.objects.filter(company=company)
+        self.assertEqual(sorted(documents.values_list("company_document_id", flat=True)), list(range(1, 21)))
+        links = Document.product.through.objects.filter(document__company=company)
+        self.assertEqual(links.count(), sum(document.product.count() for document in documents))
+        self.assertTrue(all(1 <= document.product.count() <= 3 for document in documents))
+        self.assertEqual(sum(DocumentStatistic.objects.filter(company=company, dimension="category")
+                             .values_list("count", flat=True)), 20)
+
+    def test_add_to_existing_company(self):
+        user = self.create_and_log_viewer()
+        company = user.profile.company
+        category = self.create_category(company)
+        self.create_documents(user, self.create_product(company), category, n=3)
+
+        synthetic.generate_company("alpha", products=0, categories=0, documents=5, users=1, files=False)
+        self.assertEqual(sorted(Document.objects.values_list("company_document_id", flat=True)), list(range(8)))
+        self.assertEqual(Profile.objects.get(company=company, user__username="alpha-2").employee_num, 2)
+        # Dates of the category continue after its latest document
+        new_dates = Document.objects.filter(company_document_id__gte=3).values_list("validity_start", flat=True)
+        self.assertEqual(sorted(new_dates), [datetime.date(2022, 1, 4 + i) for i in range(5)])
+
+        Document.objects.filter(company_document_id=7).update(validity_start=datetime.date.max)
+        with self.assertRaises(ValueError):
+            synthetic.generate_company("alpha", products=0, categories=0, documents=1, users=0, files=False)
+        self.assertEqual(Document.objects.count(), 8)
+
+
+class TestBenchmark(ExtendedTestCase):
+    def test_percentile(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(benchmark.percentile(values, 0), 1)
+        self.assertEqual(benchmark.percentile(values, 50), 3)
+        self.assertEqual(benchmark.percentile(values, 95), 5)
+        self.assertEqual(benchmark.percentile(values, 100), 5)
+        self.assertEqual(benchmark.percentile([0.25], 99), 0.25)
+        self.assertEqual(benchmark.percentile(list(range(1, 101)), 95), 95)
+
+    def test_summarize(self):
+        summary = benchmark.summarize([0.001, 0.002, 0.003, 0.010], queries=[3, 5, 4, 4], errors=1)
+        self.assertEqual(summary["requests"], 4)
+        self.assertEqual(summary["errors"], 1)
+        self.assertEqual(summary["mean_ms"], 4.0)
+        self.assertEqual(summary["p50_ms"], 2.0)
+        self.assertEqual(summary["p95_ms"], 10.0)
+        self.assertEqual(summary["max_ms"], 10.0)
+        self.assertEqual(summary["queries_per_request"], 4.0)
+        self.assertEqual(summary["max_queries"], 5)
+        self.assertNotIn("queries_per_request", benchmark.summarize([0.001]))
+
+    def test_compare(self):
+        results = {"client": {"main": {"p50_ms": 2.0, "p95_ms": 6.0}},
+                   "wsgi": {"main": {"p50_ms": 1.0, "p95_ms": 3.0, "throughput_rps": 250.0}}}
+        baseline = {"client": {"main": {"p50_ms": 4.0, "p95_ms": 3.0}}}
+        client, wsgi = benchmark.compare(results, baseline)
+        self.assertIn("p50      2.00 ms", client)
+        self.assertIn("(p50 0.50x, p95 2.00x of baseline)", client)
+        self.assertIn("250.0 req/s", wsgi)
+        self.assertNotIn("baseline", wsgi)
+
+    def test_benchmark_user(self):
+        company = synthetic.generate_company("bench1", products=1, categories=1, documents=0, users=1, files=False)
+        self.assertEqual(benchmark.benchmark_user(company).profile.role, "admin")
+        company = synthetic.generate_company("bench2", products=1, categories=1, documents=0, users=4, files=False)
+        self.assertEqual(benchmark.benchmark_user(company).profile.employee_num, 2)
+
+        with self.assertRaises(CommandError):
+            call_command("benchmark_actudoc", "--users", "0", stdout=StringIO())
+
+
+class TestMediaLayout(ExtendedTestCase):
+    def test_migrate(self):
+        user = self.create_and_log_viewer()
+        company = user.profile.company
+        self.create_documents(user, self.create_product(company), self.create_category(company), n=3)
+        with tempfile.TemporaryDirectory() as root, self.settings(MEDIA_ROOT=root):
+            for document in Document.objects.all():
+                document.file.name = f"alpha/{document.company_document_id}/{document.company_document_id}.pdf"
+                document.thumbnail.name = f"alpha/{document.company_document_id}/thumbnail.png"
+                document.save()
+                os.makedirs(os.path.join(root, "alpha", str(document.company_document_id)))
+                for name in (document.file.name, document.thumbnail.name):
+                    with open(os.path.join(root, name), "w") as fh:
+                        fh.write(name)
+            os.remove(os.path.join(root, "alpha/2/2.pdf"))
+            os.remove(os.path.join(root, "alpha/2/thumbnail.png"))
+            os.rmdir(os.path.join(root, "alpha/2"))
+
+            out = StringIO()
+            call_command("migrate_media_layout", "--layout", "sharded", "--batch-size", "2", stdout=out, stderr=out)
+            self.assertIn("2 documents moved to the sharded layout, 1 with missing files", out.getvalue())
+            document = Document.objects.get(company_document_id=1)
+            directory = models.document_directory("alpha", 1, "sharded")
+            self.assertEqual(document.file.name, f"{directory}/1.pdf")
+            self.assertEqual(document.thumbnail.name, f"{directory}/thumbnail.png")
+            with open(os.path.join(root, document.file.name)) as fh:
+                self.assertEqual(fh.read(), "alpha/1/1.pdf")
+            self.assertEqual(sorted(os.listdir(os.path.join(root, "alpha"))),
+                             sorted({models.document_directory("alpha", i, "sharded").split("/")[1] for i in (0, 1)}))
+
+            # Files which are already in the new directory are skipped, e.g. after an interrupted migration
+            call_command("migrate_media_layout", "--layout", "flat", stdout=StringIO(), stderr=StringIO())
+            os.makedirs(os.path.join(root, directory))
+            os.link(os.path.join(root, "alpha/1/1.pdf"), os.path.join(root, directory, "1.pdf"))
+            out = StringIO()
+            call_command("migrate_media_layout", "--layout", "sharded", stdout=out, stderr=StringIO())
+            self.assertIn("2 documents moved", out.getvalue())
+            self.assertTrue(os.path.exists(os.path.join(root, directory, "thumbnail.png")))
+            self.assertFalse(os.path.exists(os.path.join(root, "alpha/1")))
+
+    def test_concurrent_thumbnail(self):
+        user = self.create_and_log_viewer()
+        company = user.profile.company
+        self.create_documents(user, self.create_product(company), self.create_category(company), n=1)
+        with tempfile.TemporaryDirectory() as root, self.settings(MEDIA_ROOT=root):
+            document = Document.objects.get()
+            document.file.save("terms.pdf", ContentFile(b"%PDF-1.4 terms"))
+            link_directory = media_layout.link_directory
+
+            def link_and_render(*args):
+                # A thumbnail is stored by a background task after the files were linked
+                linked = link_directory(*args)
+                if not Document.objects.get().thumbnail:
+                    name = document.thumbnail.storage.save("alpha/0/thumbnail.png", ContentFile(b"png"))
+                    Document.objects.update(thumbnail=name)
+                return linked
+
+            # Files are moved in this thread, so the test database can be written while they're linked
+            executor = mock.MagicMock()
+            executor.return_value.__enter__.return_value.map = map
+            with mock.patch.object(media_layout, "link_directory", side_effect=link_and_render), \
+                    mock.patch("document.management.commands.migrate_media_layout.ThreadPoolExecutor", executor):
+                call_command("migrate_media_layout", "--layout", "sharded", stdout=StringIO(), stderr=StringIO())
+            document = Document.objects.get()
+            directory = models.document_directory("alpha", 0, "sharded")
+            self.assertEqual(document.thumbnail.name, f"{directory}/thumbnail.png")
+            with document.thumbnail.open("rb") as fh:
+                self.assertEqual(fh.read(), b"png")
+
+    def test_upload_path(self):
+        company = Company(name="alpha")
+        with self.settings(MEDIA_LAYOUT="sharded"):
+            path = models.document_path(Document(company=company, company_document_id=7), "terms.pdf")
+        self.assertRegex(path, r"^alpha/[0-9a-f]{2}/[0-9a-f]{2}/7/terms.pdf$")
+
+
+class TestScrubDocuments(ExtendedTestCase):
+    def test_scrub(self):
+        user = self.create_and_log_viewer()
+        company = user.profile.company
+        self.create_documents(user, self.create_product(company), self.create_category(company), n=20)
+        with tempfile.TemporaryDirectory() as root, self.settings(MEDIA_ROOT=root, SCRUB_DIR=f"{root}/scrub"):
+            for document in Document.objects.all():
+                document.file.name = f"alpha/{document.company_document_id}/document.pdf"
+                document.sha256 = hashlib.sha256(b"%PDF").hexdigest()
+                document.save()
+                os.makedirs(os.path.join(root, "alpha", str(document.company_document_id)))
+                with open(os.path.join(root, document.file.name), "wb") as fh:
+                    fh.write(b"%PDF")
+            with open(os.path.join(root, "alpha/1/document.pdf"), "wb") as fh:
+                fh.write(b"%PDF corrupted")
+            os.remove(os.path.join(root, "alpha/2/document.pdf"))
+            Document.objects.filter(company_document_id=3).update(sha256="")
+            with open(os.path.join(root, "alpha/0/left-over.pdf"), "wb") as fh:
+                fh.write(b"%PDF")
+
+            # The first run stops early and the second one continues from the checkpoint
+            out = StringIO()
+            call_command("scrub_documents", "--workers", "1", "--max-documents", "1", stdout=out)
+            self.assertIn("Checked 16 documents", out.getvalue())
+            out = StringIO()
+            call_command("scrub_documents", "--workers", "1", "--rate", "1", stdout=out)
+            self.assertIn("Checked 4 documents", out.getvalue())
+            self.assertIn("Scrub finished: 1 corrupt, 1 missing, 1 no_checksum, 17 ok, 1 orphan", out.getvalue())
+
+            report_path = out.getvalue().strip().split("Report: ")[1]
+            with open(report_path) as fh:
+                problems = json.load(fh)["problems"]
+            self.assertEqual({(problem["status"], problem["file"]) for problem in problems}, {
+                ("corrupt", "alpha/1/document.pdf"), ("missing", "alpha/2/document.pdf"),
+                ("no_checksum", "alpha/3/document.pdf"), ("orphan", "alpha/0/left-over.pdf")})
+            self.assertFalse(os.path.exists(f"{root}/scrub/checkpoint.json"))
+
+
+class TestTiering(ExtendedTestCase):
+    def test_cold_storage(self):
+        user = self.create_and_log_viewer()
+        company = user.profile.company
+        self.create_documents(user, self.create_product(company), self.create_category(company), n=3)
+        long_ago = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        Document.objects.update(created_at=long_ago)
+        with tempfile.TemporaryDirectory() as root, \
+                self.settings(MEDIA_ROOT=root, COLD_STORAGE_DIR=f"{root}/cold", COLD_ARCHIVE_MAX_SIZE=10,
+                              COLD_PROMOTE_ACCESSES=2, BACKGROUND_WORKERS=0):
+            for document in Document.objects.all():
+                document.file.save("document.pdf", ContentFile(b"%PDF-1.4 " * 100 + bytes([document.pk])))
+
+            # The newest document in the category isn't superseded
+            out = StringIO()
+            call_command("tier_documents", "--days", "30", stdout=out)
+            self.assertIn("2 documents moved to cold storage", out.getvalue())
+            self.assertEqual(len(os.listdir(f"{root}/cold")), 2)
+            document = Document.objects.get(company_document_id=0)
+            self.assertFalse(os.path.exists(os.path.join(root, document.file.name)))
+
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                response = self.client.get("/download/alpha/0")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4 " * 100 + bytes([document.pk]))
+            self.assertEqual(callbacks, [])
+            self.assertIsNotNone(Document.objects.get(pk=document.pk).last_accessed_at)
+
+            # Files in cold storage pass the scrub
+            document.sha256 = hashlib.sha256(b"%PDF-1.4 " * 100 + bytes([document.pk])).hexdigest()
+            document.save()
+            self.assertEqual(scrub.check_document(Document.objects.select_related("cold").get(pk=document.pk),
+                                                  scrub.Throttle(0)), "ok")
+
+            # The second download promotes the document back
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.get("/download/alpha/0")
+            with self.captureOnCommitCallbacks(execute=True):
+                for callback in callbacks:
+                    callback()
+            self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4 " * 100 + bytes([document.pk]))
+            self.assertFalse(ColdDocument.objects.filter(document=document).exists())
+            self.assertTrue(os.path.exists(os.path.join(root, document.file.name)))
+            # Its archive is deleted with it
+            self.assertEqual(len(os.listdir(f"{root}/cold")), 1)
+
+            # Recently downloaded documents stay
+            call_command("tier_documents", "--days", "30", stdout=StringIO())
+            self.assertFalse(ColdDocument.objects.filter(document=document).exists())
+
+    def test_compact_archives(self):
+        user = self.create_and_log_viewer()
+        company = user.profile.company
+        self.create_documents(user, self.create_product(company), self.create_category(company), n=4)
+        Document.objects.update(created_at=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc))
+        with tempfile.TemporaryDirectory() as root, \
+                self.settings(MEDIA_ROOT=root, COLD_STORAGE_DIR=f"{root}/cold", COLD_COMPACT_BELOW=0.5):
+            for document in Document.objects.all():
+                document.file.save("document.pdf", ContentFile(os.urandom(1000)))
+            contents = {document.pk: document.file.read() for document in Document.objects.all()}
+
+            # The 3 superseded documents are in one archive
+            call_command("tier_documents", "--days", "30", stdout=StringIO())
+            self.assertEqual(len(os.listdir(f"{root}/cold")), 1)
+            archive = ColdDocument.objects.values_list("archive", flat=True).distinct().get()
+
+            # With 2 documents left in it, the archive isn't repacked
+            first, second, third = ColdDocument.objects.select_related("document").order_by("offset")
+            with self.captureOnCommitCallbacks(execute=True):
+                first.document.delete()
+            out = StringIO()
+            call_command("tier_documents", "--days", "30", stdout=out)
+            self.assertNotIn("repacked", out.getvalue())
+
+            with self.captureOnCommitCallbacks(execute=True):
+                second.document.delete()
+            out = StringIO()
+            call_command("tier_documents", "--days", "30", stdout=out)
+            self.assertIn("1 archives repacked", out.getvalue())
+            third.refresh_from_db()
+            self.assertNotEqual(third.archive, archive)
+            self.assertEqual(third.offset, 0)
+            self.assertEqual(os.listdir(f"{root}/cold"), [third.archive])
+            self.assertEqual(os.path.getsize(f"{root}/cold/{third.archive}"), third.length)
+            self.assertEqual(b"".join(tiering.read_cold(third)), contents[third.document_id])
+
+            # The archive is deleted with its last document
+            with self.captureOnCommitCallbacks(execute=True):
+                third.document.delete()
+            self.assertEqual(os.listdir(f"{root}/cold"), [])
+
+
+class TestLinearizedDownload(ExtendedTestCase):
+    def test_linearize_and_range(self):
+        user = self.create_and_log_viewer()
+        company = user.profile.company
+        self.create_documents(user, self.create_product(company), self.create_category(company), n=1)
+
+        def fake_qpdf(command, **kwargs):
+            if command[1] == "--check-linearization":
+                return subprocess.CompletedProcess(command, 2)
+            with open(command[2], "rb") as fh, open(command[3], "wb") as out:
+                out.write(b"linearized " + fh.read())
+            return subprocess.CompletedProcess(command, 0)
+
+        with tempfile.TemporaryDirectory() as root, self.settings(MEDIA_ROOT=root, LINEARIZE_PDFS=True):
+            document = Document.objects.get()
+            document.file.save("terms.pdf", ContentFile(b"%PDF-1.4 terms"))
+            original_etag = self.client.get("/download/alpha/0", HTTP_RANGE="bytes=0-3")["ETag"]
+            with mock.patch("subprocess.run", side_effect=fake_qpdf):
+                linearize.linearize_document(document.pk)
+            document.refresh_from_db()
+            self.assertEqual(document.linearized.name, "alpha/0/terms-linearized.pdf")
+
+            response = self.client.get("/download/alpha/0")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Accept-Ranges"], "bytes")
+            self.assertEqual(b"".join(response.streaming_content), b"linearized %PDF-1.4 terms")
+            self.assertEqual(response["Content-Disposition"], "inline; filename=terms.pdf")
+
+            response = self.client.get("/download/alpha/0", HTTP_RANGE="bytes=11-14")
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response["Content-Range"], "bytes 11-14/25")
+            self.assertEqual(b"".join(response.streaming_content), b"%PDF")
+            response = self.client.get("/download/alpha/0", HTTP_RANGE="bytes=-5")
+            self.assertEqual(b"".join(response.streaming_content), b"terms")
+            response = self.client.get("/download/alpha/0", HTTP_RANGE="bytes=25-")
+            self.assertEqual(response.status_code, 416)
+            self.assertEqual(response["Content-Range"], "bytes */25")
+
+            # A range is only sent if it's of the same file: the client resuming the original gets the whole copy
+            etag = self.client.get("/download/alpha/0")["ETag"]
+            self.assertNotEqual(etag, original_etag)
+            response = self.client.get("/download/alpha/0", HTTP_RANGE="bytes=11-14", HTTP_IF_RANGE=original_etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b"".join(response.streaming_content), b"linearized %PDF-1.4 terms")
+            response = self.client.get("/download/alpha/0", HTTP_RANGE="bytes=11-14", HTTP_IF_RANGE=etag)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b"".join(response.streaming_content), b"%PDF")
+            for header in ("bytes=0-", "bytes=-5"):
+                with self.assertRaises(ValueError):
+                    utils.parse_range(header, 0)
+
+            # The original is sent if the copy is missing and both are deleted with the document
+            os.remove(os.path.join(root, document.linearized.name))
+            response = self.client.get("/download/alpha/0")
+            self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4 terms")
+            document.linearized.save("terms-linearized.pdf", ContentFile(b"linearized"))
+            document.delete()
+            self.assertEqual(os.listdir(os.path.join(root, "alpha/0")), [])
+
+
+class TestDocumentMetadata(ExtendedTestCase):
+    def test_backfill(self):
+        user = self.create_and_log_viewer()
+        company = user.profile.company
+        self.create_documents(user, self.create_product(company), self.create_category(company), n=3)
+
+        def fake_poppler(command, **kwargs):
+            if command[0] == "pdftoppm":
+                with open(command[-1] + ".png", "wb") as fh:
+                    fh.write(b"png")
+            output = b"Title:          Terms and conditions\nProducer:       LibreOffice 7.3\nPages:          12\n"
+            return subprocess.CompletedProcess(command, 0, stdout=output)
+
+        with tempfile.TemporaryDirectory() as root, self.settings(MEDIA_ROOT=root):
+            for document in Document.objects.exclude(company_document_id=2):
+                document.file.save("terms.pdf", ContentFile(b"%PDF-1.4 terms"))
+
+            etag = self.client.get("/statistics/")["ETag"]
+            out = StringIO()
+            data_version = Company.objects.get(pk=company.pk).data_version
+            with mock.patch("subprocess.run", side_effect=fake_poppler):
+                call_command("backfill_metadata", "--workers", "2", stdout=out)
+            self.assertIn("Metadata of 2 documents extracted, 1 files missing", out.getvalue())
+            # The data version is changed once for the chunk of documents
+            self.assertEqual(Company.objects.get(pk=company.pk).data_version, data_version + 1)
+            document = Document.objects.get(company_document_id=0)
+            self.assertEqual((document.size, document.page_count, document.producer, document.pdf_title),
+                             (14, 12, "LibreOffice 7.3", "Terms and conditions"))
+            self.assertEqual(document.sha256, hashlib.sha256(b"%PDF-1.4 terms").hexdigest())
+            # Thumbnails are rendered from the same copy of the file
+            self.assertEqual(document.thumbnail.name, thumbnails.thumbnail_path(document, document.sha256))
+            with document.thumbnail.open("rb") as fh:
+                self.assertEqual(fh.read(), b"png")
+
+            # Pages show the metadata without reading the files
+            response = self.client.get("/document/alpha/0")
+            self.assertContains(response, "14\xa0bytes, 12 pages")
+            # Totals are kept in the statistics and the cached page is rendered again after the backfill
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get("/statistics/", HTTP_IF_NONE_MATCH=etag)
+            self.assertFalse([query for query in context if '"document_document"' in query["sql"]])
+            self.assertEqual((response.context["total_size"], response.context["total_pages"]), (28, 24))
+            call_command("rebuild_statistics", stdout=StringIO())
+            self.assertEqual(set(DocumentStatistic.objects.filter(dimension__in=["size", "pages"]).values_list(
+                "dimension", "count")), {("size", 28), ("pages", 24)})
+            Document.objects.get(company_document_id=0).delete()
+            self.assertEqual(set(DocumentStatistic.objects.filter(dimension__in=["size", "pages"]).values_list(
+                "dimension", "count")), {("size", 14), ("pages", 12)})
+
+    def test_extract_with_thumbnail(self):
+        user = self.create_and_log_viewer()
+        company = user.profile.company
+        self.create_documents(user, self.create_product(company), self.create_category(company), n=1)
+
+        def fake_poppler(command, **kwargs):
+            if command[0] == "pdftoppm":
+                with open(command[-1] + ".png", "wb") as fh:
+                    fh.write(b"png")
+            return subprocess.CompletedProcess(command, 0, stdout=b"Pages:          3\n")
+
+        with tempfile.TemporaryDirectory() as root, self.settings(MEDIA_ROOT=root):
+            document = Document.objects.get()
+            document.file.save("terms.pdf", ContentFile(b"%PDF-1.4 terms"))
+            # The file is read once for the checksum, the metadata and the thumbnail
+            with mock.patch("subprocess.run", side_effect=fake_poppler), \
+                    mock.patch.object(metadata, "read_chunks", wraps=metadata.read_chunks) as read_chunks:
+                metadata.extract_metadata(document.pk)
+            self.assertEqual(read_chunks.call_count, 1)
+            document.refresh_from_db()
+            self.assertEqual(document.page_count, 3)
+            self.assertEqual(document.thumbnail.name, thumbnails.thumbnail_path(document, document.sha256))
+            self.assertEqual(DocumentStatistic.objects.get(dimension="pages").count, 3)
+
+            # The thumbnail isn't rendered again for the same file
+            with mock.patch("subprocess.run", side_effect=fake_poppler) as run:
+                metadata.extract_metadata(document.pk)
+            self.assertEqual([call.args[0][0] for call in run.call_args_list], ["pdfinfo"])
+            self.assertEqual(DocumentStatistic.objects.get(dimension="pages").count, 3)
+
+        # Without pdfinfo, only the size and the checksum are extracted
+        with mock.patch("subprocess.run", side_effect=FileNotFoundError):
+            self.assertEqual(metadata.read_pdf_info("document.pdf"), {})
+
+    def test_process_upload(self):
+        user = self.create_and_log_viewer()
+        company = user.profile.company
+        self.create_documents(user, self.create_product(company), self.create_category(company), n=1)
+
+        def fake_tools(command, **kwargs):
+            if command[0] == "pdftoppm":
+                with open(command[-1] + ".png", "wb") as fh:
+                    fh.write(b"png")
+            elif command[0] == "pdftotext":
+                return subprocess.CompletedProcess(command, 0, stdout=b"the terms and conditions of the policy")
+            elif command[1:2] == ["--check-linearization"]:
+                return subprocess.CompletedProcess(command, 2)
+            elif command[0] == "qpdf":
+                with open(command[2], "rb") as fh, open(command[3], "wb") as out:
+                    out.write(b"linearized " + fh.read())
+            return subprocess.CompletedProcess(command, 0, stdout=b"Pages:          3\n")
+
+        with tempfile.TemporaryDirectory() as root, self.settings(MEDIA_ROOT=root, LINEARIZE_PDFS=True):
+            document = Document.objects.get()
+            document.file.save("terms.pdf", ContentFile(b"%PDF-1.4 terms"))
+            storage = document.file.storage
+            # The file is read from the storage once for the metadata, the thumbnail, the signature and
+            # the linearized copy
+            with mock.patch("subprocess.run", side_effect=fake_tools), \
+                    mock.patch.object(storage, "open", wraps=storage.open) as storage_open:
+                uploads.process_upload(document.pk)
+            self.assertEqual(storage_open.call_count, 1)
+
+            document.refresh_from_db()
+            self.assertEqual(document.page_count, 3)
+            self.assertEqual(document.thumbnail.name, thumbnails.thumbnail_path(document, document.sha256))
+            self.assertTrue(models.DocumentSignature.objects.filter(document=document).exists())
+            with document.linearized.open("rb") as fh:
+                self.assertEqual(fh.read(), b"linearized %PDF-1.4 terms")
+
+            # Nothing is stored for a document deleted in the meantime
+            with mock.patch("subprocess.run", side_effect=fake_tools), \
+                    mock.patch.object(metadata, "store_metadata", return_value=None):
+                uploads.process_upload(document.pk)
+            self.assertEqual(sorted(os.listdir(os.path.join(root, "alpha/0"))),
+                             sorted(os.path.basename(name) for name in (document.file.name, document.thumbnail.name,
+                                                                      document.linearized.name)))
+
+
+class TestDuplicateUpload(ExtendedTestCase):
+    def test_duplicate_content(self):
+        user = self.create_and_log_contributor()
+        company = user.profile.company
+        product = self.create_product(company)
+        category = self.create_category(company)
+
+        def upload(filename, content, validity_start):
+            data = {
+                "product": product.pk,
+                "category": category.pk,
+                "validity_start": validity_start,
+                "file": SimpleUploadedFile(filename, content, content_type="application/pdf"),
+                "title": "Terms",
+            }
+            response = self.client.post("/document/add/", data, follow=True)
+            return [str(message) for message in response.context["messages"]]
+
+        with tempfile.TemporaryDirectory() as root, self.settings(MEDIA_ROOT=root):
+            self.assertEqual(upload("terms.pdf", b"%PDF-1.4 terms", "2022-01-01"), ["Document added!"])
+            document = Document.objects.get(company=company, company_document_id=1)
+            self.assertEqual((document.sha256, document.size), (hashlib.sha256(b"%PDF-1.4 terms").hexdigest(), 14))
+
+            # The checksum is calculated while the file is received, a different name doesn't matter
+            with self.assertNumQueries(1):
+                self.assertIsNone(utils.get_duplicate_msg(document))
+            messages = upload("terms-2023.pdf", b"%PDF-1.4 terms", "2023-01-01")
+            self.assertEqual(messages, ["This exact file is already document #1.", "Document added!"])
+            self.assertEqual(upload("terms-2024.pdf", b"%PDF-1.4 new terms", "2024-01-01"), ["Document added!"])
+
+
+class TestSimilarity(ExtendedTestCase):
+    @staticmethod
+    def terms(year, n=300):
+        return " ".join(f"clause {i} the insurer pays {i * 7 % 13} percent" for i in range(n)).replace(
+            "clause 150", f"valid from {year}")
+
+    def test_signatures(self):
+        first = similarity.minhash(similarity.shingles(self.terms(2022)))
+        second = similarity.minhash(similarity.shingles(self.terms(2023)))
+        other = similarity.minhash(similarity.shingles("Technical description of the cash flow model " * 50))
+        self.assertEqual(first.dtype, np.uint32)
+        self.assertEqual(len(first), similarity.PERMUTATIONS)
+        self.assertGreater(similarity.similarity(first, second), 0.9)
+        self.assertLess(similarity.similarity(first, other), 0.1)
+
+        # Similar texts share buckets, signatures survive a round trip through the database field
+        self.assertTrue(set(similarity.buckets(first)) & set(similarity.buckets(second)))
+        self.assertFalse(set(similarity.buckets(first)) & set(similarity.buckets(other)))
+        self.assertTrue(np.array_equal(similarity.from_bytes(similarity.to_bytes(first)), first))
+        self.assertEqual(len(similarity.shingles("")), 0)
+
+    def test_similar_documents(self):
+        user = self.create_and_log_viewer()
+        company = user.profile.company
+        self.create_documents(user, self.create_product(company), self.create_category(company), n=4)
+        texts = {0: "", 1: self.terms(2022), 2: self.terms(2023), 3: "Technical description of the model " * 50}
+
+        def fake_pdftotext(command, **kwargs):
+            with open(command[-2], "rb") as fh:
+                return subprocess.CompletedProcess(command, 0, stdout=fh.read())
+
+        with tempfile.TemporaryDirectory() as root, self.settings(MEDIA_ROOT=root):
+            for document in Document.objects.filter(company=company):
+                if document.company_document_id in texts:
+                    document.file.save("terms.pdf", ContentFile(texts[document.company_document_id].encode()))
+
+            out = StringIO()
+            data_version = Company.objects.get(pk=company.pk).data_version
+            with mock.patch("subprocess.run", side_effect=fake_pdftotext):
+                call_command("index_similarity", "--workers", "2", stdout=out)
+        self.assertIn("Signatures of 3 documents computed, 1 files missing or without text", out.getvalue())
+        self.assertEqual(models.SimilarityBucket.objects.count(), 3 * similarity.BANDS)
+        # The data version is changed once for the chunk of documents
+        self.assertEqual(Company.objects.get(pk=company.pk).data_version, data_version + 1)
+
+        first, second = (Document.objects.get(company=company, company_document_id=pk) for pk in (1, 2))
+        similar = similarity.similar_documents(first)
+        self.assertEqual([document for document, _ in similar], [second])
+        self.assertGreater(similar[0][1], 0.9)
+        self.assertEqual(similarity.similar_documents(Document.objects.get(company=company, company_document_id=3)),
+                         [])
+
+        response = self.client.get("/document/alpha/1")
+        self.assertContains(response, "Similar documents")
+        self.assertContains(response, 'href="/document/alpha/2"')
+        # The report reads the pairs stored with the signatures
+        with self.assertNumQueries(6):
+            response = self.client.get("/statistics/duplicates/")
+        self.assertEqual([(pair.first, pair.second) for pair in response.context["pairs"]], [(first, second)])
+        self.assertContains(response, 'href="/document/alpha/2"')
+
+        # Pairs are stored again for another threshold
+        with self.settings(SIMILARITY_THRESHOLD=0.999):
+            call_command("index_similarity", "--pairs", stdout=StringIO())
+        self.assertFalse(models.SimilarPair.objects.exists())
+        call_command("index_similarity", "--pairs", "--company", "alpha", stdout=StringIO())
+        self.assertEqual(list(models.SimilarPair.objects.values_list("first", "second")), [(first.pk, second.pk)])
+
+        # Other companies' documents are not similar
+        other = self.create_and_log_contributor()
+        self.create_documents(other, self.create_product(other.profile.company),
+                              self.create_category(other.profile.company), n=1)
+        copy = Document.objects.get(company=other.profile.company)
+        response = self.client.get(f"/document/{other.profile.company.name}/0")
+        self.assertNotContains(response, "Similar documents")
+        similarity.store_signature(copy.pk, similarity.minhash(similarity.shingles(self.terms(2022))))
+        # Storing a signature changes the data version, so cached pages are rendered again
+        response = self.client.get(f"/document/{other.profile.company.name}/0", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([document for document, _ in similarity.similar_documents(first)], [second])
+        self.assertEqual(similarity.similar_documents(copy), [])
+
+        # Pairs are deleted with their documents
+        second.delete()
+        self.assertFalse(models.SimilarPair.objects.exists())
+
+
+class TestFacets(ExtendedTestCase):
+    def test_facets(self):
+        user = self.create_and_log_viewer()
+        company = user.profile.company
+        product = self.create_product(company)
+        category = self.create_category(company)
+        self.create_documents(user, product, category, n=20)
+        other_product = Product.objects.create(company=company, company_product_id=2, name="Annuity", model="ANN01")
+        other_category = Category.objects.create(company=company, company_category_id=2, name="Terms")
+        for document in Document.objects.filter(company_document_id__gte=15):
+            document.validity_start = document.validity_start.replace(year=2021)
+            document.category = other_category
+            document.save()
+            document.product.add(other_product)
+
+        with self.assertNumQueries(1):
+            counts = facets.counts(Document.objects.filter(company=company, product=other_product))
+        self.assertEqual(counts, {"product": {product.pk: 5, other_product.pk: 5}, "category": {other_category.pk: 5},
+                                  "year": {2021: 5}, "creator": {user.pk: 5}})
+        self.assertIsInstance(next(iter(counts["year"])), int)
+
+        # Filters combine with the phrase and with each other
+        response = self.client.get("/search/", {"phrase": "My document", "product": "1"})
+        self.assertEqual(response.context["documents"].paginator.count, 20)
+        filters = dict(response.context["facets"])
+        self.assertEqual(filters["Product"], [("Term Life Insurance (TERM02)", 20, True, "phrase=My+document"),
+                                              ("Annuity (ANN01)", 5, False, "phrase=My+document&product=2")])
+        self.assertEqual(filters["Year"], [(2022, 15, False, "phrase=My+document&product=1&year=2022"),
+                                           (2021, 5, False, "phrase=My+document&product=1&year=2021")])
+        self.assertContains(response, 'href="?phrase=My+document&amp;product=1&amp;page=2"')
+
+        response = self.client.get("/search/", {"product": "1", "category": "2", "year": "2021", "page": "1"})
+        self.assertEqual(response.context["documents"].paginator.count, 5)
+        self.assertEqual(dict(response.context["facets"])["Created by"][0][1:3], (5, False))
+        response = self.client.get("/search/", {"year": "2020"})
+        self.assertEqual(response.context["documents"].paginator.count, 0)
+        for params in ({"year": "last"}, {"year": "0"}, {"year": "99999"}, {"creator": "99"}, {"creator": "abc"},
+                       {"year": "²"}, {"creator": "²"}, {"creator": "1²"}):
+            self.assertEqual(self.client.get("/search/", params).status_code, 404)
+
+        # The latest documents aren't counted
+        self.assertEqual(self.client.get("/").context["facets"], [])
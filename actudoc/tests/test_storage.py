@@ -0,0 +1,181 @@
+import io
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+
+from account.models import Profile
+from document.models import Category, Company, Document
+from document.storage import S3Storage
+from document.utils import tiering
+
+
+class FakeClientError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeNoSuchKey(FakeClientError):
+    def __init__(self):
+        super().__init__("NoSuchKey")
+
+
+class FakeS3Client:
+    """In-process stand-in for the boto3 S3 client with the calls used by S3Storage."""
+    exceptions = type("Exceptions", (), {"ClientError": FakeClientError, "NoSuchKey": FakeNoSuchKey})
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+        self.fail_part = None
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.calls.append("put_object")
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key, Range=None):
+        if (Bucket, Key) not in self.objects:
+            raise FakeNoSuchKey()
+        body = self.objects[(Bucket, Key)]
+        if Range is not None:
+            self.calls.append(f"get_object {Range}")
+            start, end = Range[len("bytes="):].split("-")
+            body = body[int(start):int(end) + 1]
+        return {"Body": io.BytesIO(body)}
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise FakeClientError("404")
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        upload_id = f"upload-{len(self.uploads)}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_part:
+            raise FakeClientError("500")
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[(Bucket, Key)] = b"".join(parts[part["PartNumber"]] for part in MultipartUpload["Parts"])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append("abort_multipart_upload")
+        self.uploads.pop(UploadId)
+
+    def generate_presigned_url(self, method, Params, ExpiresIn):
+        return f"https://s3.example.com/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+
+@override_settings(S3_MULTIPART_THRESHOLD=10, S3_MULTIPART_CHUNK_SIZE=4, S3_URL_EXPIRE=30)
+class TestS3Storage(SimpleTestCase):
+    def test_save_and_open(self):
+        client = FakeS3Client()
+        storage = S3Storage(bucket="documents", client=client)
+
+        name = storage.save("alpha/1/small.pdf", ContentFile(b"small"))
+        self.assertEqual(client.calls, ["put_object"])
+        with storage.open(name) as fh:
+            self.assertEqual(fh.read(), b"small")
+
+        # Bigger files are uploaded in parts
+        name = storage.save("alpha/2/big.pdf", ContentFile(b"0123456789abc"))
+        self.assertEqual(client.calls, ["put_object"])
+        self.assertEqual(storage.size(name), 13)
+        with storage.open(name) as fh:
+            self.assertEqual(fh.read(), b"0123456789abc")
+
+        # Existing names are not overwritten
+        self.assertNotEqual(storage.save("alpha/1/small.pdf", ContentFile(b"other")), "alpha/1/small.pdf")
+
+        storage.delete(name)
+        self.assertFalse(storage.exists(name))
+        with self.assertRaises(FileNotFoundError):
+            storage.open(name)
+
+    def test_failed_multipart_upload(self):
+        client = FakeS3Client()
+        client.fail_part = 2
+        storage = S3Storage(bucket="documents", client=client)
+        with self.assertRaises(FakeClientError):
+            storage.save("alpha/1/big.pdf", ContentFile(b"0123456789abc"))
+        self.assertEqual(client.calls, ["abort_multipart_upload"])
+        self.assertEqual(client.uploads, {})
+        self.assertFalse(storage.exists("alpha/1/big.pdf"))
+
+    def test_presigned_url(self):
+        storage = S3Storage(bucket="documents", client=FakeS3Client())
+        url = storage.presigned_download_url("alpha/1/terms.pdf", "application/pdf")
+        self.assertEqual(url, "https://s3.example.com/documents/alpha/1/terms.pdf?expires=30")
+
+
+class TestDownloadFromS3(TestCase):
+    def test_redirect(self):
+        company = Company.objects.create(name="alpha", full_name="alpha", code="1234")
+        user = User.objects.create(username="1", email="viewer@example.com")
+        Profile.objects.create(company=company, user=user, employee_num=1)
+        category = Category.objects.create(company=company, company_category_id=1, name="Terms")
+        storage = S3Storage(bucket="documents", client=FakeS3Client())
+
+        with mock.patch.object(Document.file.field, "storage", storage):
+            document = Document(company=company, company_document_id=1, category=category, title="Terms",
+                                validity_start="2022-01-01", created_by=user)
+            document.file.save("terms.pdf", ContentFile(b"%PDF-1.4"))
+            self.assertTrue(storage.exists("alpha/1/terms.pdf"))
+
+            client = Client()
+            client.force_login(user)
+            response = client.get("/download/alpha/1")
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response.url.startswith("https://s3.example.com/documents/alpha/1/terms.pdf"))
+
+            document.delete()
+            self.assertFalse(storage.exists("alpha/1/terms.pdf"))
+
+
+class TestColdStorageInS3(TestCase):
+    def test_archive_in_bucket(self):
+        company = Company.objects.create(name="alpha", full_name="alpha", code="1234")
+        user = User.objects.create(username="1", email="viewer@example.com")
+        category = Category.objects.create(company=company, company_category_id=1, name="Terms")
+        client = FakeS3Client()
+        storage = S3Storage(bucket="documents", client=client)
+        archives = S3Storage(bucket="cold", client=client)
+
+        with mock.patch.object(Document.file.field, "storage", storage), \
+                mock.patch.object(tiering, "archive_storage", return_value=archives):
+            documents = []
+            for n in range(2):
+                document = Document(company=company, company_document_id=n, category=category, title="Terms",
+                                    validity_start=f"2022-01-0{n + 1}", created_by=user)
+                document.file.save("terms.pdf", ContentFile(b"%PDF-1.4 " * 10 + bytes([n])))
+                documents.append(document)
+
+            self.assertEqual(tiering.move_to_cold(documents, 1024 * 1024), 2)
+            self.assertEqual([key for bucket, key in client.objects if bucket == "documents"], [])
+            (archive,) = [key for bucket, key in client.objects if bucket == "cold"]
+
+            # Only the part of the archive with the document is downloaded
+            client.calls = []
+            entry = documents[1].cold
+            self.assertEqual(b"".join(tiering.read_cold(entry)), b"%PDF-1.4 " * 10 + bytes([1]))
+            self.assertEqual(client.calls, [f"get_object bytes={entry.offset}-{entry.offset + entry.length - 1}"])
+
+            # The archive is deleted with its last document
+            with self.captureOnCommitCallbacks(execute=True):
+                tiering.promote(documents[0].pk)
+            self.assertTrue(archives.exists(archive))
+            with self.captureOnCommitCallbacks(execute=True):
+                documents[1].delete()
+            self.assertFalse(archives.exists(archive))
+            self.assertTrue(storage.exists(documents[0].file.name))
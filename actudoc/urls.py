@@ -18,8 +18,12 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from document import views as document_views
+
 
 urlpatterns = [
+    path('admin/profiles/', document_views.ProfileListView.as_view(), name="profiles"),
+    path('admin/profiles/<str:name>', document_views.ProfileDetailView.as_view(), name="profile"),
     path('admin/', admin.site.urls),
     path('', include('django.contrib.auth.urls')),
     path('account/', include('account.urls', namespace='account')),
@@ -0,0 +1,395 @@
+import base64
+import binascii
+import hashlib
+import json
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.exceptions import PermissionDenied
+from django.db import IntegrityError, transaction
+from django.forms.models import model_to_dict
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.views import View
+
+from document import forms
+from document import models
+from document.utils import tasks, uploads, utils
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400, errors=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.errors = errors
+
+    def as_dict(self):
+        data = {"error": self.message}
+        if self.errors:
+            data["errors"] = self.errors
+        return data
+
+
+def encode_cursor(pk):
+    return base64.urlsafe_b64encode(str(pk).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, binascii.Error):
+        raise ApiError("Invalid cursor.")
+
+
+class ApiView(LoginRequiredMixin, View):
+    """
+    Base of the JSON API views.
+
+    Objects are identified by their internal id within the company (e.g. company_document_id), as in the HTML views.
+    The API supports:
+    - sparse responses with ?fields=id,title,
+    - cursor pagination with ?cursor= and ?limit= (the response contains the url of the next page),
+    - bulk retrieval with ?ids=1,2,3,
+    - conditional GET requests with ETag / If-None-Match.
+
+    Resources define `fields` which map the name of an API field to the lookup used in QuerySet.values().
+    Fields with lookup None are computed by the resource in add_computed_fields().
+
+    Access company: company name is in url and then check in get_company()
+    Access roles: all can read, only contributors and admins can write
+    """
+    raise_exception = True
+    model = None
+    company_id_field = None
+    fields = {}
+    ordering = "pk"
+    form_class = None
+    edit_form_class = None
+    page_size = 100
+    max_page_size = 1000
+
+    def handle_no_permission(self):
+        return JsonResponse({"error": "Authentication required."}, status=403)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as error:
+            return JsonResponse(error.as_dict(), status=error.status)
+        except PermissionDenied:
+            return JsonResponse({"error": "Permission denied."}, status=403)
+        except Http404:
+            return JsonResponse({"error": "Not found."}, status=404)
+
+    def http_method_not_allowed(self, request, *args, **kwargs):
+        return JsonResponse({"error": "Method not allowed."}, status=405)
+
+    def get_company(self, company_name, write=False):
+        if not utils.user_is_employee(self.request, company_name):
+            raise PermissionDenied
+        if write and not utils.user_is_contributor_or_admin(self.request):
+            raise PermissionDenied
+        return self.request.user.profile.company
+
+    def get_queryset(self, company):
+        return self.model.objects.filter(company=company)
+
+    def get_object(self, company, company_object_id):
+        try:
+            return self.get_queryset(company).get(**{self.company_id_field: company_object_id})
+        except self.model.DoesNotExist:
+            raise Http404
+
+    def get_field_names(self):
+        requested = self.request.GET.get("fields")
+        if not requested:
+            return list(self.fields)
+
+        names = [name.strip() for name in requested.split(",") if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ApiError(f"Unknown fields: {', '.join(unknown)}.")
+        return names
+
+    def get_limit(self):
+        limit = self.request.GET.get("limit", self.page_size)
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ApiError("Limit must be an integer.")
+        return max(1, min(limit, self.max_page_size))
+
+    def serialize(self, queryset, names):
+        """Get the list of dictionaries with the requested fields, reading only the columns needed."""
+        lookups = [self.fields[name] for name in names if self.fields[name] is not None]
+        rows = list(queryset.values("pk", *lookups))
+        objects = [{name: row[self.fields[name]] for name in names if self.fields[name] is not None} for row in rows]
+        self.add_computed_fields(objects, [row["pk"] for row in rows], names)
+        return rows, objects
+
+    def add_computed_fields(self, objects, pks, names):
+        pass
+
+    def json_response(self, data, status=200):
+        response = JsonResponse(data, status=status)
+        if self.request.method == "GET":
+            etag = f'"{hashlib.md5(response.content).hexdigest()}"'
+            response["ETag"] = etag
+            response = get_conditional_response(self.request, etag=etag, response=response)
+        return response
+
+    def get(self, request, company_name, company_object_id=None):
+        company = self.get_company(company_name)
+        queryset = self.get_queryset(company)
+        names = self.get_field_names()
+
+        if company_object_id is not None:
+            queryset = queryset.filter(**{self.company_id_field: company_object_id})
+            _, objects = self.serialize(queryset, names)
+            if not objects:
+                raise Http404
+            return self.json_response(objects[0])
+
+        queryset = self.filter_queryset(queryset)
+
+        # Bulk retrieval of objects by their ids within the company
+        ids = request.GET.get("ids")
+        if ids:
+            try:
+                ids = [int(i) for i in ids.split(",")]
+            except ValueError:
+                raise ApiError("Ids must be integers separated by commas.")
+            if len(ids) > self.max_page_size:
+                raise ApiError(f"At most {self.max_page_size} ids can be requested at once.")
+            queryset = queryset.filter(**{f"{self.company_id_field}__in": ids}).order_by(self.ordering)
+            _, objects = self.serialize(queryset, names)
+            return self.json_response({"results": objects, "next": None})
+
+        # Cursor pagination is stable when objects are added and cheap for deep pages
+        cursor = request.GET.get("cursor")
+        if cursor:
+            pk = decode_cursor(cursor)
+            lookup = "pk__lt" if self.ordering.startswith("-") else "pk__gt"
+            queryset = queryset.filter(**{lookup: pk})
+
+        limit = self.get_limit()
+        rows, objects = self.serialize(queryset.order_by(self.ordering)[:limit + 1], names)
+        next_url = None
+        if len(objects) > limit:
+            objects = objects[:limit]
+            query = request.GET.copy()
+            query["cursor"] = encode_cursor(rows[limit - 1]["pk"])
+            next_url = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+        return self.json_response({"results": objects, "next": next_url})
+
+    def filter_queryset(self, queryset):
+        return queryset
+
+    def get_data(self):
+        if self.request.content_type == "application/json":
+            try:
+                data = json.loads(self.request.body or b"{}")
+            except ValueError:
+                raise ApiError("Invalid JSON.")
+            if not isinstance(data, dict):
+                raise ApiError("JSON object expected.")
+            return data
+        return {key: values if len(values) > 1 else values[0] for key, values in self.request.POST.lists()}
+
+    def to_form_data(self, data, company):
+        return data
+
+    def limit_choices(self, form, company):
+        pass
+
+    def save(self, obj, form):
+        try:
+            with transaction.atomic():
+                obj.save()
+                form.save_m2m()
+        except IntegrityError:
+            raise ApiError("The object conflicts with an existing one.", status=409)
+
+    def post(self, request, company_name, company_object_id=None):
+        if company_object_id is not None or self.form_class is None:
+            return self.http_method_not_allowed(request)
+
+        company = self.get_company(company_name, write=True)
+        form = self.form_class(self.to_form_data(self.get_data(), company), request.FILES)
+        self.limit_choices(form, company)
+        if not form.is_valid():
+            raise ApiError("Invalid data.", errors=form.errors.get_json_data())
+
+        obj = form.save(commit=False)
+        obj.company = company
+        company_object_id = utils.get_next_company_id(self.get_queryset(company), self.company_id_field)
+        setattr(obj, self.company_id_field, company_object_id)
+        self.before_create(obj)
+        self.save(obj, form)
+        self.after_create(obj)
+
+        _, objects = self.serialize(self.get_queryset(company).filter(pk=obj.pk), list(self.fields))
+        return self.json_response(objects[0], status=201)
+
+    def before_create(self, obj):
+        pass
+
+    def after_create(self, obj):
+        pass
+
+    def patch(self, request, company_name, company_object_id=None):
+        form_class = self.edit_form_class or self.form_class
+        if company_object_id is None or form_class is None:
+            return self.http_method_not_allowed(request)
+
+        company = self.get_company(company_name, write=True)
+        obj = self.get_object(company, company_object_id)
+
+        # Fields missing in the request keep their current values
+        form_data = model_to_dict(obj, fields=form_class._meta.fields)
+        for key, value in form_data.items():
+            if isinstance(value, list):
+                form_data[key] = [related.pk for related in value]
+        form_data.update(self.to_form_data(self.get_data(), company))
+
+        form = form_class(form_data, instance=obj)
+        self.limit_choices(form, company)
+        if not form.is_valid():
+            raise ApiError("Invalid data.", errors=form.errors.get_json_data())
+        self.save(form.save(commit=False), form)
+
+        _, objects = self.serialize(self.get_queryset(company).filter(pk=obj.pk), list(self.fields))
+        return self.json_response(objects[0])
+
+    def delete(self, request, company_name, company_object_id=None):
+        if company_object_id is None or self.form_class is None:
+            return self.http_method_not_allowed(request)
+
+        company = self.get_company(company_name, write=True)
+        self.get_object(company, company_object_id).delete()
+        return HttpResponse(status=204)
+
+
+class ProductApiView(ApiView):
+    model = models.Product
+    company_id_field = "company_product_id"
+    fields = {
+        "id": "company_product_id",
+        "name": "name",
+        "model": "model",
+    }
+    form_class = forms.ProductForm
+
+
+class CategoryApiView(ApiView):
+    model = models.Category
+    company_id_field = "company_category_id"
+    fields = {
+        "id": "company_category_id",
+        "name": "name",
+    }
+    form_class = forms.CategoryForm
+
+
+class DocumentApiView(ApiView):
+    """
+    Documents refer to products and categories by their ids within the company.
+    New documents are sent as multipart/form-data (with the file); edits are sent as JSON.
+    """
+    model = models.Document
+    company_id_field = "company_document_id"
+    ordering = "-pk"
+    fields = {
+        "id": "company_document_id",
+        "title": "title",
+        "description": "description",
+        "products": None,
+        "category": "category__company_category_id",
+        "validity_start": "validity_start",
+        "file": "file",
+        "created_by": "created_by__email",
+        "created_at": "created_at",
+        "size": "size",
+        "page_count": "page_count",
+        "sha256": "sha256",
+    }
+    form_class = forms.DocumentAddForm
+    edit_form_class = forms.DocumentEditForm
+
+    def add_computed_fields(self, objects, pks, names):
+        if "products" not in names:
+            return
+
+        products = {pk: [] for pk in pks}
+        through = models.Document.product.through.objects.filter(document_id__in=pks).order_by("product_id")
+        for document_id, company_product_id in through.values_list("document_id", "product__company_product_id"):
+            products[document_id].append(company_product_id)
+        for obj, pk in zip(objects, pks):
+            obj["products"] = products[pk]
+
+    def filter_queryset(self, queryset):
+        # Documents can be filtered like on the main page
+        company_product_id = self.request.GET.get("product")
+        if company_product_id:
+            queryset = queryset.filter(product__company_product_id=company_product_id)
+        company_category_id = self.request.GET.get("category")
+        if company_category_id:
+            queryset = queryset.filter(category__company_category_id=company_category_id)
+        return queryset
+
+    def to_form_data(self, data, company):
+        data = dict(data)
+        if "products" in data:
+            company_product_ids = data.pop("products")
+            if not isinstance(company_product_ids, list):
+                company_product_ids = [company_product_ids]
+            data["product"] = list(models.Product.objects.filter(
+                company=company, company_product_id__in=company_product_ids).values_list("pk", flat=True))
+            if len(data["product"]) != len(set(company_product_ids)):
+                raise ApiError("Unknown products.")
+        if "category" in data:
+            category = models.Category.objects.filter(company=company, company_category_id=data["category"]).first()
+            if category is None:
+                raise ApiError("Unknown category.")
+            data["category"] = category.pk
+        return data
+
+    def limit_choices(self, form, company):
+        form.fields["product"].queryset = models.Product.objects.filter(company=company)
+        form.fields["category"].queryset = models.Category.objects.filter(company=company)
+
+    def before_create(self, obj):
+        obj.created_by = self.request.user
+        obj.sha256 = getattr(self.request, "upload_sha256", {}).get("file", "")
+        obj.size = obj.file.size
+
+    def after_create(self, obj):
+        tasks.submit_on_commit(uploads.process_upload, obj.pk)
+
+
+class HistoryApiView(ApiView):
+    """History of changes is read-only; it can be filtered by document with ?document=."""
+    model = models.History
+    ordering = "-pk"
+    fields = {
+        "document": "document__company_document_id",
+        "element": "element",
+        "changed_from": "changed_from",
+        "changed_to": "changed_to",
+        "changed_by": "changed_by__email",
+        "changed_at": "changed_at",
+    }
+
+    def get_queryset(self, company):
+        return self.model.objects.filter(company=company)
+
+    def filter_queryset(self, queryset):
+        company_document_id = self.request.GET.get("document")
+        if company_document_id:
+            queryset = queryset.filter(document__company_document_id=company_document_id)
+        return queryset
+
+    def get(self, request, company_name, company_object_id=None):
+        if self.request.GET.get("ids"):
+            raise ApiError("History can't be retrieved by ids.")
+        return super().get(request, company_name)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class DocumentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'document'
+
+    def ready(self):
+        from document import signals  # noqa: F401
+        from document.middleware import time_template_rendering
+
+        time_template_rendering()
@@ -0,0 +1,17 @@
+from django.urls import path
+
+from document import async_views
+
+urlpatterns = [
+    path('', async_views.main, name="main"),
+    path('search/', async_views.main, name="search"),
+    path('download/<company_name>/<company_document_id>', async_views.download, name="download"),
+
+    path('api/<company_name>/documents/', async_views.document_api, name="api_documents"),
+    path('api/<company_name>/documents/<int:company_object_id>', async_views.document_api, name="api_document"),
+    path('api/<company_name>/products/', async_views.product_api, name="api_products"),
+    path('api/<company_name>/products/<int:company_object_id>', async_views.product_api, name="api_product"),
+    path('api/<company_name>/categories/', async_views.category_api, name="api_categories"),
+    path('api/<company_name>/categories/<int:company_object_id>', async_views.category_api, name="api_category"),
+    path('api/<company_name>/history/', async_views.history_api, name="api_history"),
+]
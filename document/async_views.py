@@ -0,0 +1,120 @@
+"""
+Async views of the I/O-bound endpoints, routed instead of the sync ones when ASYNC_VIEWS=True (see README).
+
+Django 3.2 has no async ORM, so database work runs in a bounded thread pool of ASYNC_DB_THREADS threads
+rather than on the event loop (or in the single thread used by sync_to_async by default). The work runs in a copy
+of the request's context, so the database chosen by ReplicaMiddleware and the measurements of the middlewares
+follow it into the pool.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections
+
+from document import api, models, views
+from document.utils import instrumentation, utils
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.ASYNC_DB_THREADS, thread_name_prefix="actudoc-db")
+    return _executor
+
+
+def _call_instrumented(func, args, kwargs):
+    with instrumentation.follow():
+        return func(*args, **kwargs)
+
+
+def _call_in_pool(context, func, args, kwargs):
+    try:
+        return context.run(_call_instrumented, func, args, kwargs)
+    finally:
+        # Threads of the pool don't get request_finished, so connections are released as after a request
+        close_old_connections()
+
+
+def _restore_context(context):
+    """Set the context variables changed in the copy of the context in the current context."""
+    for variable, value in context.items():
+        try:
+            changed = variable.get() is not value
+        except LookupError:
+            changed = True
+        if changed:
+            variable.set(value)
+
+
+async def run_sync(func, *args, **kwargs):
+    """
+    Run a blocking function (ORM queries, template rendering, file system) without blocking the event loop.
+
+    With ASYNC_DB_THREADS=0 the function runs in Django's thread for sync code (useful in tests,
+    where all queries must run in the thread holding the test transaction).
+
+    :param func: function to run
+    :return: result of the function
+    """
+    if settings.ASYNC_DB_THREADS == 0:
+        return await sync_to_async(func)(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    try:
+        return await loop.run_in_executor(get_executor(), functools.partial(_call_in_pool, context, func, args,
+                                                                            kwargs))
+    finally:
+        # As with sync_to_async, the request sees the variables set by the function, e.g. that it wrote to the
+        # primary database (see routers.py)
+        _restore_context(context)
+
+
+def async_view(sync_view):
+    """
+    Get an async view which runs the sync view in the bounded thread pool.
+
+    :param sync_view: view function, e.g. views.MainView.as_view()
+    :return: coroutine function
+    """
+    async def view(request, *args, **kwargs):
+        return await run_sync(sync_view, request, *args, **kwargs)
+
+    # Keeps the name of the view in the performance measurements
+    view.view_class = getattr(sync_view, "view_class", None)
+    return view
+
+
+def _open_document_file(request, company_name, company_document_id):
+    if not request.user.is_authenticated:
+        return None
+    documents = models.Document.objects.select_related("cold")
+    document = utils.get_company_object(request, documents, company_name, company_document_id=company_document_id)
+    return utils.document_file_response(request, document)
+
+
+async def download(request, company_name, company_document_id):
+    """
+    Download a document's file, streamed in chunks instead of read into memory.
+
+    Access company: company name is in url and then check in _open_document_file()
+    Access roles: all
+    """
+    response = await run_sync(_open_document_file, request, company_name, company_document_id)
+    if response is None:
+        return redirect_to_login(request.get_full_path())
+    return response
+
+
+main = async_view(views.MainView.as_view())
+document_api = async_view(api.DocumentApiView.as_view())
+product_api = async_view(api.ProductApiView.as_view())
+category_api = async_view(api.CategoryApiView.as_view())
+history_api = async_view(api.HistoryApiView.as_view())
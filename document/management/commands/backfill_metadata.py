@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from document.models import Company, Document
+from document.utils import metadata, utils
+
+
+class Command(BaseCommand):
+    help = "Extract size, checksum, page count, producer and title of files of existing documents and render " \
+           "their thumbnails"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--company", type=str, help="Short name of the company (all companies by default)")
+        parser.add_argument("--workers", type=int, default=4, help="Number of files read in parallel")
+        parser.add_argument("--all", action="store_true", help="Also documents which already have the metadata")
+
+    def handle(self, *args, **options):
+        documents = Document.objects.select_related("cold").order_by("id")
+        if options["company"]:
+            if not Company.objects.filter(name=options["company"]).exists():
+                raise CommandError(f"Company {options['company']} does not exist.")
+            documents = documents.filter(company__name=options["company"])
+        if not options["all"]:
+            documents = documents.filter(size__isnull=True)
+
+        # Files are read and pdfinfo and pdftoppm are run in threads (all of them release the GIL); the database
+        # is updated here
+        processed = missing = 0
+        last_id = 0
+        chunk_size = options["workers"] * 16
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            while True:
+                chunk = list(documents.filter(id__gt=last_id)[:chunk_size])
+                if not chunk:
+                    break
+                last_id = chunk[-1].id
+                company_ids = set()
+                for document, values in zip(chunk, pool.map(metadata.read_metadata, chunk)):
+                    if values is None:
+                        missing += 1
+                        continue
+                    company_ids.add(metadata.store_metadata(document.pk, values, bump_version=False))
+                # Cached pages are rendered again once per chunk, not after each document
+                for company_id in company_ids:
+                    utils.bump_data_version(company_id)
+                processed += len(chunk)
+                self.stdout.write(f"Processed {processed} documents")
+        self.stdout.write(f"Metadata of {processed - missing} documents extracted, {missing} files missing")
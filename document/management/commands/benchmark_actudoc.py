@@ -0,0 +1,109 @@
+import datetime
+import json
+import platform
+import random
+import tempfile
+import time
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from document.utils import benchmark, synthetic
+
+
+class Command(BaseCommand):
+    help = "Benchmark the hot endpoints on synthetic data; results are saved as JSON so that runs can be compared"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--companies", type=int, default=1)
+        parser.add_argument("--products", type=int, default=20, help="Number of products per company")
+        parser.add_argument("--categories", type=int, default=10, help="Number of categories per company")
+        parser.add_argument("--documents", type=int, default=1000, help="Number of documents per company")
+        parser.add_argument("--users", type=int, default=10, help="Number of users per company")
+        parser.add_argument("--requests", type=int, default=50, help="Number of requests per endpoint")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--no-server", action="store_true", help="Skip requests through the local WSGI server")
+        parser.add_argument("--concurrency", type=int, default=0,
+                            help="Number of concurrent clients measuring throughput of the WSGI server (0 skips it)")
+        parser.add_argument("--asgi", action="store_true",
+                            help="Measure throughput of the ASGI deployment with async views too (needs uvicorn)")
+        parser.add_argument("--keepdb", action="store_true", help="Keep the benchmark database between runs")
+        parser.add_argument("--output", type=str, default="benchmark.json")
+        parser.add_argument("--compare", type=str, help="JSON file with results of a previous run")
+
+    def handle(self, *args, **options):
+        if options["users"] < 1:
+            raise CommandError("The benchmark needs at least one user per company (--users).")
+
+        # The benchmark runs on a separate (test) database, so the data of the application is never touched.
+        # Background tasks run in the web process, because spawned workers would connect to the application database.
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keepdb"])
+        try:
+            with override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix="actudoc-benchmark-"), BACKGROUND_WORKERS=0):
+                report = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+        with open(options["output"], "w") as fh:
+            json.dump(report, fh, indent=2)
+        self.stdout.write(f"Results saved to {options['output']}")
+
+        baseline = {}
+        if options["compare"]:
+            with open(options["compare"]) as fh:
+                baseline = json.load(fh)["results"]
+        for line in benchmark.compare(report["results"], baseline):
+            self.stdout.write(line)
+
+    def run(self, options):
+        start = time.perf_counter()
+        companies = []
+        for i, name in enumerate(synthetic.next_company_names("bench", options["companies"])):
+            companies.append(synthetic.generate_company(
+                name, products=options["products"], categories=options["categories"],
+                documents=options["documents"], users=options["users"], seed=options["seed"] + i,
+            ))
+        generation_seconds = time.perf_counter() - start
+
+        # Requests are sent by a contributor (or the admin) of the first company
+        company = companies[0]
+        user = benchmark.benchmark_user(company)
+        clients = {"user": Client(), "anonymous": Client()}
+        clients["user"].force_login(user)
+
+        endpoints = benchmark.hot_endpoints(company, options["documents"])
+        rng = random.Random(options["seed"])
+        results = {"client": benchmark.run_client(endpoints, rng, clients, options["requests"])}
+
+        if not options["no_server"]:
+            session_cookie = f"sessionid={clients['user'].cookies['sessionid'].value}"
+            with benchmark.LocalServer() as server:
+                results["server"] = benchmark.run_server(endpoints, rng, server.url, session_cookie,
+                                                         options["requests"])
+                if options["concurrency"]:
+                    results["wsgi"] = benchmark.run_concurrent(endpoints, rng, server.url, session_cookie,
+                                                               options["requests"], options["concurrency"])
+
+            if options["asgi"]:
+                with override_settings(ROOT_URLCONF=benchmark.async_urlconf()), benchmark.AsgiServer() as server:
+                    results["asgi"] = benchmark.run_concurrent(endpoints, rng, server.url, session_cookie,
+                                                               options["requests"], max(1, options["concurrency"]))
+
+        return {
+            "meta": {
+                "date": datetime.datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "options": {key: options[key] for key in ("companies", "products", "categories", "documents",
+                                                          "users", "requests", "seed", "concurrency")},
+                "generation_seconds": round(generation_seconds, 3),
+                "peak_rss_kb": benchmark.peak_rss_kb(),
+            },
+            "results": results,
+        }
@@ -0,0 +1,58 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from document.utils import benchmark
+
+
+MODES = {
+    "new": {"CONN_MAX_AGE": 0, "HEALTH_CHECKS": False, "POOL": None},
+    "persistent": {"CONN_MAX_AGE": 600, "HEALTH_CHECKS": True, "POOL": None},
+    "pool": {"CONN_MAX_AGE": 0, "HEALTH_CHECKS": True, "POOL": {"SIZE": 4, "TIMEOUT": 5}},
+}
+
+QUERY = "SELECT id, title FROM document_document ORDER BY id DESC LIMIT 16"
+
+
+class Command(BaseCommand):
+    help = "Benchmark per-request latency of database work with a new connection per request, " \
+           "persistent connections and the connection pool (PostgreSQL only)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500, help="Number of simulated requests per mode")
+        parser.add_argument("--queries", type=int, default=3, help="Number of queries per request")
+        parser.add_argument("--output", type=str, help="JSON file for the results")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Connection pooling is only supported on PostgreSQL.")
+        from actudoc.db.postgresql.base import DatabaseWrapper
+
+        results = {}
+        for mode, overrides in MODES.items():
+            settings_dict = {**connection.settings_dict, **overrides}
+            wrapper = DatabaseWrapper(settings_dict, alias=f"benchmark_{mode}")
+            latencies = []
+            for _ in range(options["requests"]):
+                # The same as Django does around a request: close_old_connections() on request_started/finished
+                start = time.perf_counter()
+                wrapper.close_if_unusable_or_obsolete()
+                for _ in range(options["queries"]):
+                    with wrapper.cursor() as cursor:
+                        cursor.execute(QUERY)
+                        cursor.fetchall()
+                wrapper.close_if_unusable_or_obsolete()
+                latencies.append(time.perf_counter() - start)
+            wrapper.close()
+            if wrapper.pool is not None:
+                wrapper.pool.close()
+            results[mode] = benchmark.summarize(latencies)
+
+        for mode, summary in results.items():
+            self.stdout.write(f"{mode:>10} p50 {summary['p50_ms']:>8.2f} ms  p95 {summary['p95_ms']:>8.2f} ms  "
+                              f"mean {summary['mean_ms']:>8.2f} ms")
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(results, fh, indent=2)
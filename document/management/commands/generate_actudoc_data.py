@@ -0,0 +1,78 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from document.models import Company
+from document.utils import synthetic, tasks
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic companies with products, categories, users and documents (e.g. at production scale)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--companies", type=int, default=10)
+        parser.add_argument("--documents", type=int, default=10000, help="Total number of documents")
+        parser.add_argument("--products", type=int, default=50, help="Number of products per company")
+        parser.add_argument("--categories", type=int, default=15, help="Number of categories per company")
+        parser.add_argument("--users", type=int, default=20, help="Number of users per company")
+        parser.add_argument("--skew", type=float, default=1.0,
+                            help="Skew of company sizes (0 means that all companies have the same size)")
+        parser.add_argument("--prefix", type=str, default="synth", help="Prefix of names of new companies")
+        parser.add_argument("--company", type=str, action="append",
+                            help="Add data to this company instead of creating new ones (can be repeated)")
+        parser.add_argument("--no-files", action="store_true", help="Don't create files of documents")
+        parser.add_argument("--file-size", type=int, default=0, help="Size of sparse placeholder files in bytes")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options["company"]:
+            names = options["company"]
+        else:
+            names = synthetic.next_company_names(options["prefix"], options["companies"])
+        counts = synthetic.split_documents(options["documents"], len(names), options["skew"])
+
+        # SQLite allows only one writer at a time
+        workers = options["workers"] if connection.vendor == "postgresql" else 1
+        self.stdout.write(f"Generating {options['documents']} documents of {len(names)} companies "
+                          f"with {workers} worker(s)...")
+
+        start = time.perf_counter()
+        jobs = []
+        for i, (name, documents) in enumerate(zip(names, counts)):
+            jobs.append((name, {
+                "products": options["products"],
+                "categories": options["categories"],
+                "documents": documents,
+                "users": options["users"],
+                "seed": options["seed"] + i,
+                "files": not options["no_files"],
+                "file_size": options["file_size"],
+                "batch_size": options["batch_size"],
+            }))
+
+        try:
+            if workers == 1:
+                for name, job_options in jobs:
+                    self.report(*synthetic.generate_company_task(name, job_options))
+            else:
+                # Connections can't be shared with the workers
+                connection.close()
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=tasks.init_worker) as executor:
+                    futures = [executor.submit(synthetic.generate_company_task, name, job_options)
+                               for name, job_options in jobs]
+                    for future in as_completed(futures):
+                        self.report(*future.result())
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        self.stdout.write(f"Done in {time.perf_counter() - start:.1f} s; "
+                          f"there are {Company.objects.count()} companies in the database.")
+
+    def report(self, name, seconds):
+        self.stdout.write(f"{name}: generated in {seconds:.1f} s")
@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from document.models import Company, Document, DocumentSignature
+from document.utils import similarity, utils
+
+
+class Command(BaseCommand):
+    help = "Compute signatures of texts of existing documents, used to find near-duplicate documents"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--company", type=str, help="Short name of the company (all companies by default)")
+        parser.add_argument("--workers", type=int, default=4, help="Number of files read in parallel")
+        parser.add_argument("--all", action="store_true", help="Also documents which already have a signature")
+        parser.add_argument("--pairs", action="store_true",
+                            help="Only store the pairs of similar documents from the stored signatures, e.g. after "
+                                 "changing SIMILARITY_THRESHOLD")
+
+    def handle(self, *args, **options):
+        documents = Document.objects.select_related("cold").order_by("id")
+        if options["company"]:
+            if not Company.objects.filter(name=options["company"]).exists():
+                raise CommandError(f"Company {options['company']} does not exist.")
+            documents = documents.filter(company__name=options["company"])
+        if options["pairs"]:
+            self.store_pairs(documents)
+            return
+        if not options["all"]:
+            documents = documents.filter(signature__isnull=True)
+
+        # Files are read, pdftotext is run and signatures are computed in threads (all of them mostly release
+        # the GIL); the database is updated here
+        processed = skipped = 0
+        last_id = 0
+        chunk_size = options["workers"] * 16
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            while True:
+                chunk = list(documents.filter(id__gt=last_id)[:chunk_size])
+                if not chunk:
+                    break
+                last_id = chunk[-1].id
+                company_ids = set()
+                for document, signature in zip(chunk, pool.map(similarity.compute_signature, chunk)):
+                    if signature is None:
+                        skipped += 1
+                        continue
+                    company_ids.add(similarity.store_signature(document.pk, signature, bump_version=False))
+                # Cached pages are rendered again once per chunk, not after each document
+                for company_id in company_ids:
+                    utils.bump_data_version(company_id)
+                processed += len(chunk)
+                self.stdout.write(f"Processed {processed} documents")
+        self.stdout.write(f"Signatures of {processed - skipped} documents computed, "
+                          f"{skipped} files missing or without text")
+
+    def store_pairs(self, documents):
+        signatures = DocumentSignature.objects.filter(document__in=documents.values("id")).order_by("document_id")
+        signatures = signatures.values_list("document_id", "document__company_id", "minhash")
+        processed = 0
+        company_ids = set()
+        last_id = 0
+        while True:
+            chunk = list(signatures.filter(document_id__gt=last_id)[:500])
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+            with transaction.atomic():
+                for document_id, company_id, value in chunk:
+                    similarity.store_pairs(company_id, document_id, similarity.from_bytes(value))
+                    company_ids.add(company_id)
+            processed += len(chunk)
+            self.stdout.write(f"Processed {processed} documents")
+        for company_id in company_ids:
+            utils.bump_data_version(company_id)
+        self.stdout.write(f"Pairs of {processed} documents stored")
@@ -0,0 +1,99 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from document.models import Document
+from document.utils import media_layout
+
+
+class Command(BaseCommand):
+    help = "Move files of existing documents to the directory layout of MEDIA_LAYOUT; it can be interrupted " \
+           "and run again, and the documents stay downloadable during the migration"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--layout", choices=["flat", "sharded"], help="Target layout (MEDIA_LAYOUT by default)")
+        parser.add_argument("--company", type=str, help="Short name of the company (all companies by default)")
+        parser.add_argument("--workers", type=int, default=4, help="Number of threads moving files")
+        parser.add_argument("--batch-size", type=int, default=500, help="Number of documents updated at once")
+        parser.add_argument("--rate", type=float, default=0, help="Maximum number of documents moved per second")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the documents to move")
+
+    def handle(self, *args, **options):
+        layout = options["layout"] or settings.MEDIA_LAYOUT
+        if layout not in ("flat", "sharded"):
+            raise CommandError(f"Unknown layout {layout}.")
+
+        documents = Document.objects.select_related("company").only(
+            "id", "company_document_id", "file", "thumbnail", "linearized", "company__name").order_by("id")
+        if options["company"]:
+            documents = documents.filter(company__name=options["company"])
+
+        try:
+            root = Document.file.field.storage.path("")
+        except NotImplementedError:
+            raise CommandError("Only files stored in MEDIA_ROOT can be moved; object stores have no directories.")
+        moved = missing = 0
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            while True:
+                batch = list(documents.filter(id__gt=last_id)[:options["batch_size"]])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                start = time.monotonic()
+
+                moves = []
+                for document in batch:
+                    old_directory = os.path.dirname(document.file.name)
+                    new_directory = media_layout.target_directory(document, layout)
+                    if old_directory != new_directory:
+                        moves.append((document, old_directory, new_directory))
+                if options["dry_run"]:
+                    moved += len(moves)
+                    continue
+
+                # Files are linked to the new directories first, so both paths work until the documents are updated
+                linked = pool.map(lambda move: media_layout.link_directory(root, move[1], move[2]), moves)
+                ready = []
+                for move, ok in zip(moves, linked):
+                    if not ok:
+                        missing += 1
+                        self.stderr.write(f"Files of document {move[0].id} ({move[0].file.name}) are missing")
+                        continue
+                    ready.append(move)
+
+                # The documents are locked and renamed from their current files, so thumbnails and linearized copies
+                # stored in the meantime (e.g. by background tasks) aren't overwritten with the names read above
+                updated = []
+                with transaction.atomic():
+                    current = Document.objects.select_for_update().filter(
+                        pk__in=[document.pk for document, _, _ in ready]).only("file", "thumbnail", "linearized")
+                    current = {document.pk: document for document in current}
+                    for document, old_directory, new_directory in ready:
+                        document = current.get(document.pk)
+                        # Deleted or given another file in the meantime
+                        if document is None or os.path.dirname(document.file.name) != old_directory:
+                            continue
+                        # Files stored in the old directory since it was linked
+                        media_layout.link_directory(root, old_directory, new_directory)
+                        for field in ("file", "thumbnail", "linearized"):
+                            name = getattr(document, field).name
+                            getattr(document, field).name = media_layout.rename(name, old_directory, new_directory)
+                        updated.append((document, old_directory))
+                    Document.objects.bulk_update([document for document, _ in updated],
+                                                 ["file", "thumbnail", "linearized"])
+                list(pool.map(lambda update: media_layout.remove_directory(root, update[1]), updated))
+                moved += len(updated)
+                self.stdout.write(f"Moved {moved} documents (up to id {last_id})")
+
+                if options["rate"] and updated:
+                    time.sleep(max(0.0, len(updated) / options["rate"] - (time.monotonic() - start)))
+
+        if options["dry_run"]:
+            self.stdout.write(f"{moved} documents to move to the {layout} layout")
+        else:
+            self.stdout.write(f"{moved} documents moved to the {layout} layout, {missing} with missing files")
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+
+from actudoc.db.postgresql.schema import DatabaseSchemaEditor
+from document.models import Company
+from document.utils import partitioning
+
+
+class Command(BaseCommand):
+    help = "Partition documents and history by company on PostgreSQL, moving the existing rows to the partitions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--method", choices=["hash", "list"], default="hash",
+                            help="Hash partitions or one partition per company (list)")
+        parser.add_argument("--partitions", type=int, default=16, help="Number of hash partitions")
+        parser.add_argument("--tables", nargs="+", choices=["documents", "history"], default=["documents", "history"])
+        parser.add_argument("--batch-size", type=int, default=50000, help="Number of rows copied at once")
+        parser.add_argument("--dry-run", action="store_true", help="Print the SQL statements without running them")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql" or connection.pg_version < 110000:
+            raise CommandError("Partitioning needs PostgreSQL 11 or newer.")
+        # Later migrations adding foreign keys to documents would fail with Django's backend
+        if not issubclass(connection.SchemaEditorClass, DatabaseSchemaEditor):
+            raise CommandError("Partitioning needs the database ENGINE 'actudoc.db.postgresql'.")
+        executor = MigrationExecutor(connection)
+        if executor.migration_plan(executor.loader.graph.leaf_nodes()):
+            raise CommandError("There are unapplied migrations, run migrate first.")
+
+        targets = partitioning.get_targets()
+        already_partitioned = partitioning.partitioned_tables()
+        selected = [name for name in targets if name in options["tables"]]
+        skipped_references = already_partitioned | {targets[name][0] for name in selected}
+        company_ids = list(Company.objects.order_by("id").values_list("id", flat=True))
+
+        # All tables are replaced in one transaction: either all of them are partitioned or none
+        with transaction.atomic():
+            for name in selected:
+                table, key = targets[name]
+                if table in already_partitioned:
+                    self.stdout.write(f"{table} is already partitioned")
+                    continue
+
+                try:
+                    statements, notes = partitioning.plan(table, key, options["method"], options["partitions"],
+                                                          company_ids, skipped_references, options["batch_size"])
+                except ValueError as error:
+                    raise CommandError(str(error))
+
+                for note in notes:
+                    self.stdout.write(note)
+                if options["dry_run"]:
+                    for statement in statements:
+                        self.stdout.write(statement + ";")
+                    continue
+
+                with connection.cursor() as cursor:
+                    for statement in statements:
+                        cursor.execute(statement)
+                self.stdout.write(f"{table} partitioned by {options['method']} of {key}")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from document.models import Company
+from document.utils import statistics
+
+
+class Command(BaseCommand):
+    help = "Rebuild statistics of documents from scratch (e.g. nightly, to correct any drift of incremental updates)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--company", type=str, help="Short name of the company (all companies by default)")
+
+    def handle(self, *args, **options):
+        companies = Company.objects.order_by("id")
+        if options["company"]:
+            companies = companies.filter(name=options["company"])
+            if not companies.exists():
+                raise CommandError(f"Company {options['company']} does not exist.")
+
+        for company in companies.iterator():
+            n = statistics.rebuild(company)
+            self.stdout.write(f"{company.name}: {n} statistics")
@@ -0,0 +1,96 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from document.models import Document
+from document.utils import scrub
+
+
+class Command(BaseCommand):
+    help = "Check that files of documents exist and are not corrupted and find files of no document; " \
+           "the scrub continues from the last checkpoint, so it can be run in parts (e.g. every night)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Number of threads reading files")
+        parser.add_argument("--rate", type=float, default=0, help="Maximum rate of reading files in MB/s")
+        parser.add_argument("--max-documents", type=int, help="Stop after checking this many documents")
+        parser.add_argument("--max-minutes", type=float, help="Stop after this many minutes")
+        parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from scratch")
+        parser.add_argument("--skip-orphans", action="store_true", help="Don't look for files of no document")
+
+    def handle(self, *args, **options):
+        checkpoint_path = os.path.join(settings.SCRUB_DIR, "checkpoint.json")
+        if options["restart"] and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        checkpoint = scrub.load_checkpoint(checkpoint_path)
+        if checkpoint["last_id"]:
+            self.stdout.write(f"Continuing after document {checkpoint['last_id']}")
+
+        throttle = scrub.Throttle(options["rate"] * 1024 * 1024)
+        deadline = time.monotonic() + options["max_minutes"] * 60 if options["max_minutes"] else None
+        documents = Document.objects.filter(id__gt=checkpoint["last_id"]).select_related("cold").order_by("id")
+        n_checked = 0
+        finished = True
+
+        # Rows are streamed and checked in chunks of the size of the pool's queue, so memory use stays bounded
+        chunk_size = options["workers"] * 16
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            chunk = []
+            for document in documents.iterator(chunk_size=chunk_size):
+                chunk.append(document)
+                if len(chunk) < chunk_size:
+                    continue
+                self.check(pool, chunk, throttle, checkpoint, checkpoint_path)
+                n_checked += len(chunk)
+                chunk = []
+                if (options["max_documents"] and n_checked >= options["max_documents"]) or \
+                        (deadline and time.monotonic() > deadline):
+                    finished = False
+                    break
+            if chunk:
+                self.check(pool, chunk, throttle, checkpoint, checkpoint_path)
+                n_checked += len(chunk)
+
+        self.stdout.write(f"Checked {n_checked} documents")
+        if not finished:
+            self.stdout.write(f"Stopped after document {checkpoint['last_id']}; run again to continue")
+            return
+
+        if not options["skip_orphans"]:
+            try:
+                root = Document.file.field.storage.path("")
+            except NotImplementedError:
+                self.stdout.write("Files of no document are only looked for in MEDIA_ROOT")
+            else:
+                known = scrub.known_files()
+                for name in scrub.find_orphans(root, known, exclude=[settings.SCRUB_DIR]):
+                    checkpoint["problems"].append({"status": "orphan", "file": name})
+                    checkpoint["counts"]["orphan"] = checkpoint["counts"].get("orphan", 0) + 1
+
+        os.makedirs(settings.SCRUB_DIR, exist_ok=True)
+        report_path = os.path.join(settings.SCRUB_DIR, time.strftime("report-%Y%m%d-%H%M%S.json"))
+        with open(report_path, "w") as fh:
+            json.dump({"started_at": checkpoint["started_at"], "finished_at": time.time(),
+                       "counts": checkpoint["counts"], "problems": checkpoint["problems"]}, fh, indent=2)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        counts = ", ".join(f"{count} {status}" for status, count in sorted(checkpoint["counts"].items()))
+        self.stdout.write(f"Scrub finished: {counts or 'no documents'}")
+        self.stdout.write(f"Report: {report_path}")
+
+    def check(self, pool, documents, throttle, checkpoint, checkpoint_path):
+        statuses = pool.map(lambda document: scrub.check_document(document, throttle), documents)
+        for document, status in zip(documents, statuses):
+            checkpoint["counts"][status] = checkpoint["counts"].get(status, 0) + 1
+            if status != "ok":
+                checkpoint["problems"].append({"status": status, "document_id": document.id,
+                                               "company_id": document.company_id,
+                                               "company_document_id": document.company_document_id,
+                                               "file": document.file.name})
+        checkpoint["last_id"] = documents[-1].id
+        scrub.save_checkpoint(checkpoint_path, checkpoint)
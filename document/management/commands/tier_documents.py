@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from document.models import Company
+from document.utils import tiering
+
+
+class Command(BaseCommand):
+    help = "Move files of superseded documents which were not downloaded for a long time to cold storage " \
+           "(compressed archives in COLD_STORAGE_DIR or COLD_STORAGE_BUCKET); downloads read them from there " \
+           "transparently. Archives mostly of promoted or deleted documents are repacked."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="Days without a download (COLD_AFTER_DAYS by default)")
+        parser.add_argument("--company", type=str, help="Short name of the company (all companies by default)")
+        parser.add_argument("--limit", type=int, help="Maximum number of documents moved")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the documents to move")
+
+    def handle(self, *args, **options):
+        company = None
+        if options["company"]:
+            company = Company.objects.filter(name=options["company"]).first()
+            if company is None:
+                raise CommandError(f"Company {options['company']} does not exist.")
+
+        days = options["days"] if options["days"] is not None else settings.COLD_AFTER_DAYS
+        documents = tiering.candidates(days, company)
+        if options["limit"]:
+            documents = documents[:options["limit"]]
+
+        if options["dry_run"]:
+            self.stdout.write(f"{documents.count()} documents to move to cold storage")
+            return
+
+        moved = tiering.move_to_cold(documents.iterator(), settings.COLD_ARCHIVE_MAX_SIZE)
+        self.stdout.write(f"{moved} documents moved to cold storage")
+
+        repacked = tiering.compact_archives(settings.COLD_COMPACT_BELOW)
+        if repacked:
+            self.stdout.write(f"{repacked} archives repacked")
@@ -0,0 +1,270 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.template.backends.django import Template
+
+from actudoc.db import routers
+from document.utils import instrumentation, metrics, profiler, queries
+
+
+logger = logging.getLogger("actudoc.performance")
+queries_logger = logging.getLogger("actudoc.queries")
+
+_current_stats = contextvars.ContextVar("performance_stats", default=None)
+# tracemalloc measures the memory of the whole process
+_memory_lock = threading.Lock()
+
+
+class RequestStats:
+    """Measurements of a single request."""
+    def __init__(self):
+        self.db_time = 0
+        self.queries = 0
+        self.duplicate_queries = 0
+        self.template_time = 0
+        self.template_depth = 0
+        self.seen_queries = set()
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            key = (sql, repr(params))
+            if key in self.seen_queries:
+                self.duplicate_queries += 1
+            self.seen_queries.add(key)
+
+
+def _timed_render(render):
+    def wrapper(self, *args, **kwargs):
+        stats = _current_stats.get()
+        if stats is None:
+            return render(self, *args, **kwargs)
+
+        # Templates rendered inside other templates are already measured
+        stats.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            stats.template_depth -= 1
+            if stats.template_depth == 0:
+                stats.template_time += time.perf_counter() - start
+    wrapper.performance_timed = True
+    return wrapper
+
+
+def time_template_rendering():
+    """
+    Measure the rendering time of Django templates in requests measured by PerformanceMiddleware.
+
+    Called once from DocumentConfig.ready(), before templates are rendered in any thread.
+    """
+    if not getattr(Template.render, "performance_timed", False):
+        Template.render = _timed_render(Template.render)
+
+
+def _count_bytes(content, done):
+    size = 0
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        done(size)
+
+
+def get_view_name(view_func):
+    view_class = getattr(view_func, "view_class", None)
+    if view_class is not None:
+        return f"{view_class.__module__}.{view_class.__qualname__}"
+    return f"{view_func.__module__}.{view_func.__qualname__}"
+
+
+class ViewNameMixin:
+    """Store the dotted name of the resolved view in request.performance_view_name."""
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.performance_view_name = get_view_name(view_func)
+        return None
+
+
+class PerformanceMiddleware(ViewNameMixin):
+    """
+    Measure requests: wall time, database time, number of queries and repeated identical queries,
+    template rendering time, size of the response and (with PERFORMANCE_TRACE_MEMORY) peak Python memory.
+
+    The measurements are sent in the Server-Timing header, logged as a JSON line to the actudoc.performance logger
+    and kept in histograms by view which are exposed at /metrics. Streaming responses without Content-Length
+    are logged when they were sent, with the number of bytes sent.
+    It's enabled with PERFORMANCE_MIDDLEWARE=True.
+
+    Peak memory is traced for the whole process, so with PERFORMANCE_TRACE_MEMORY requests of the process are
+    handled one at a time: it's meant for diagnosing a single process, not for production traffic.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        trace_memory = settings.PERFORMANCE_TRACE_MEMORY
+        with _memory_lock if trace_memory else nullcontext():
+            return self.measure(request, trace_memory)
+
+    def measure(self, request, trace_memory):
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        if trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        try:
+            # Queries of async views in the thread pool are measured too (see instrumentation.py)
+            with instrumentation.execute_wrapper(stats.record_query):
+                response = self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        duration = time.perf_counter() - start
+
+        view = getattr(request, "performance_view_name", None)
+        if view is None:
+            return response
+
+        measurements = {
+            "duration": duration,
+            "db": stats.db_time,
+            "template": stats.template_time,
+            "queries": stats.queries,
+            "duplicate_queries": stats.duplicate_queries,
+            "bytes": None,
+            "memory": tracemalloc.get_traced_memory()[1] - memory_start if trace_memory else None,
+        }
+        response["Server-Timing"] = ", ".join([
+            f'total;dur={duration * 1000:.1f}',
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"',
+            f'template;dur={stats.template_time * 1000:.1f}',
+        ])
+
+        if not response.streaming:
+            measurements["bytes"] = len(response.content)
+        elif response.has_header("Content-Length"):
+            measurements["bytes"] = int(response["Content-Length"])
+        else:
+            def sent(size):
+                self.record(request, response, view, {**measurements, "bytes": size})
+            response.streaming_content = _count_bytes(response.streaming_content, sent)
+            return response
+
+        self.record(request, response, view, measurements)
+        return response
+
+    def record(self, request, response, view, measurements):
+        metrics.observe(view, measurements)
+        logger.info(json.dumps({
+            "view": view,
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            **{key: round(value, 6) if isinstance(value, float) else value for key, value in measurements.items()},
+        }))
+
+
+class QueryDetectorMiddleware(ViewNameMixin):
+    """
+    Log statements run more than QUERY_REPEAT_THRESHOLD times in a request (N+1 queries) with the template or view
+    lines which ran them, as warnings of the actudoc.queries logger.
+
+    It's meant for staging and enabled with QUERY_DETECTOR=True.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with queries.QueryDetector(settings.QUERY_REPEAT_THRESHOLD) as detector:
+            response = self.get_response(request)
+        if detector.repeated():
+            view = getattr(request, "performance_view_name", None) or request.path
+            queries_logger.warning("Repeated queries in %s %s:\n%s", request.method, view, detector.report())
+        return response
+
+
+class ProfilerMiddleware(ViewNameMixin):
+    """
+    Sample stacks of requests and save profiles of requests of document and account views which took longer than
+    PROFILER_THRESHOLD_MS to PROFILER_DIR (only the latest PROFILER_MAX_FILES are kept).
+
+    The profiles are listed at /admin/profiles/. It's enabled with PROFILER_ENABLED=True.
+    """
+    apps = ("document.", "account.")
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sampler = profiler.get_sampler(settings.PROFILER_INTERVAL_MS / 1000)
+
+    def __call__(self, request):
+        if self.sampler is None:
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        # Threads running the work of async views are sampled too (see instrumentation.py)
+        with instrumentation.sampled(self.sampler) as stacks:
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        view = getattr(request, "performance_view_name", "")
+        if view.startswith(self.apps) and duration * 1000 >= settings.PROFILER_THRESHOLD_MS and stacks:
+            info = {
+                "view": view,
+                "method": request.method,
+                "path": request.get_full_path(),
+                "status": response.status_code,
+                "duration": duration,
+                "time": time.time(),
+            }
+            try:
+                profiler.save_profile(settings.PROFILER_DIR, info, stacks, settings.PROFILER_MAX_FILES)
+            except OSError:
+                logger.exception("Profile of the request could not be saved")
+        return response
+
+
+class ReplicaMiddleware:
+    """
+    Read from a replica in GET requests of views with read_from_replica = True (see actudoc/db/routers.py).
+
+    After a request which wrote to the primary, the session reads from the primary for REPLICA_STICKY_SECONDS,
+    because replicas may lag behind. The alias of the replica is kept in request.read_database (None for the primary).
+    """
+    sticky_key = "_replica_sticky_until"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.read_database = None
+        tokens = routers.use_replica(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = routers.reset(tokens)
+        if wrote and hasattr(request, "session"):
+            request.session[self.sticky_key] = time.time() + settings.REPLICA_STICKY_SECONDS
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, "view_class", None)
+        sticky = hasattr(request, "session") and request.session.get(self.sticky_key, 0) > time.time()
+        if request.method in ("GET", "HEAD") and getattr(view_class, "read_from_replica", False) and not sticky:
+            request.read_database = routers.choose_replica()
+            routers.read_from(request.read_database)
+        return None
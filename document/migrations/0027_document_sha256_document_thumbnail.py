@@ -0,0 +1,23 @@
+# Generated by Django 3.2.13 on 2026-10-19 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0026_auto_20220706_1053'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='sha256',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='thumbnail',
+            field=models.FileField(blank=True, default='', editable=False, upload_to=''),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.13 on 2026-10-19 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0027_document_sha256_document_thumbnail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='data_updated_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='data_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.13 on 2026-10-19 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0028_company_data_version_company_data_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.13 on 2026-10-19 12:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0029_document_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentStatistic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('category', 'category'), ('product', 'product'), ('creator', 'creator'), ('month', 'month')], max_length=8)),
+                ('key', models.PositiveBigIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='document.company')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='documentstatistic',
+            index=models.Index(fields=['company', 'dimension'], name='document_do_company_3259e6_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='documentstatistic',
+            unique_together={('company', 'dimension', 'key')},
+        ),
+    ]
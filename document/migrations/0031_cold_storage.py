@@ -0,0 +1,33 @@
+# Generated by Django 3.2.13 on 2026-10-19 13:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0030_documentstatistic'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='last_accessed_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='ColdDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archive', models.CharField(max_length=100)),
+                ('offset', models.PositiveBigIntegerField()),
+                ('length', models.PositiveBigIntegerField()),
+                ('size', models.PositiveBigIntegerField()),
+                ('moved_at', models.DateTimeField(auto_now_add=True)),
+                ('accesses', models.PositiveIntegerField(default=0)),
+                ('accessed_at', models.DateTimeField(null=True)),
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cold', to='document.document')),
+            ],
+        ),
+    ]
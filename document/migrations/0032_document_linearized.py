@@ -0,0 +1,18 @@
+# Generated by Django 3.2.13 on 2026-10-19 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0031_cold_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='linearized',
+            field=models.FileField(blank=True, default='', editable=False, upload_to=''),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.13 on 2026-10-19 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0032_document_linearized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='page_count',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='pdf_title',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='producer',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='size',
+            field=models.PositiveBigIntegerField(editable=False, null=True),
+        ),
+    ]
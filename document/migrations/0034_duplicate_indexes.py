@@ -0,0 +1,17 @@
+# Generated by Django 3.2.13 on 2026-10-19 13:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0033_document_metadata'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['company', 'sha256'], name='document_do_company_a2fffb_idx'),
+        ),
+    ]
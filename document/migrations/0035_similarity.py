@@ -0,0 +1,35 @@
+# Generated by Django 3.2.13 on 2026-10-19 13:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0034_duplicate_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarityBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.BigIntegerField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similarity_buckets', to='document.document')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DocumentSignature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minhash', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='signature', to='document.document')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='similaritybucket',
+            index=models.Index(fields=['bucket'], name='document_si_bucket_44a1b3_idx'),
+        ),
+    ]
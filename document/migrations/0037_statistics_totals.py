@@ -0,0 +1,23 @@
+# Generated by Django 3.2.13 on 2026-10-19 13:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0035_similarity'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='documentstatistic',
+            name='count',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='documentstatistic',
+            name='dimension',
+            field=models.CharField(choices=[('category', 'category'), ('product', 'product'), ('creator', 'creator'), ('month', 'month'), ('size', 'size'), ('pages', 'pages')], max_length=8),
+        ),
+    ]
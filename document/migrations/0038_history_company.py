@@ -0,0 +1,33 @@
+# Generated by Django 3.2.13 on 2026-10-19 14:02
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def set_company(apps, schema_editor):
+    Document = apps.get_model("document", "Document")
+    History = apps.get_model("document", "History")
+    companies = Document.objects.filter(pk=OuterRef("document_id")).values("company_id")
+    History.objects.update(company_id=Subquery(companies))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0037_statistics_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='history',
+            name='company',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='document.company'),
+        ),
+        migrations.RunPython(set_company, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='history',
+            name='company',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='document.company'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.13 on 2026-10-19 14:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0038_history_company'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarPair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='document.company')),
+                ('first', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='document.document')),
+                ('second', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='document.document')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='similarpair',
+            index=models.Index(fields=['company', '-score'], name='document_si_company_046b70_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='similarpair',
+            unique_together={('first', 'second')},
+        ),
+    ]
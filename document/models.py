@@ -1,3 +1,5 @@
+import hashlib
+
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models
@@ -12,6 +14,8 @@ class Company(models.Model):
     name = models.CharField(max_length=32, unique=True)
     full_name = models.CharField(max_length=100)
     code = models.CharField(max_length=32, unique=True)
+    data_version = models.PositiveIntegerField(default=0, editable=False)
+    data_updated_at = models.DateTimeField(null=True, editable=False)
 
     def __str__(self):
         return f"{self.name}"
@@ -31,10 +35,8 @@ class Product(models.Model):
         return f"{self.name} ({self.model})"
 
     def delete(self, *args, **kwargs):
-        documents = self.document_set.all()
-        files = [document.file for document in documents]
-        for file in files:
-            file.delete()
+        for document in self.document_set.all():
+            document.delete_files()
         super().delete(*args, **kwargs)
 
     def number_of_documents(self):
@@ -55,10 +57,8 @@ class Category(models.Model):
         return self.name
 
     def delete(self, *args, **kwargs):
-        documents = self.document_set.all()
-        files = [document.file for document in documents]
-        for file in files:
-            file.delete()
+        for document in self.document_set.all():
+            document.delete_files()
         super().delete(*args, **kwargs)
 
     def number_of_documents(self):
@@ -70,8 +70,28 @@ class Category(models.Model):
         unique_together = ("company_category_id", "company")
 
 
+def document_directory(company_name, company_document_id, layout=None):
+    """
+    Get the directory of a document's files relative to MEDIA_ROOT.
+
+    The flat layout has one directory per document in the company's directory. The sharded layout spreads
+    them over two levels of 256 directories (by a hash of the document's id), so that no directory gets
+    too big for the file system, backups and rsync. Existing files are moved with migrate_media_layout.
+
+    :param company_name: string, name of the company
+    :param company_document_id: integer, id of the document within the company
+    :param layout: string, "flat" or "sharded" (MEDIA_LAYOUT by default)
+    :return: string
+    """
+    layout = layout or settings.MEDIA_LAYOUT
+    if layout == "sharded":
+        digest = hashlib.md5(str(company_document_id).encode()).hexdigest()
+        return f"{company_name}/{digest[:2]}/{digest[2:4]}/{company_document_id}"
+    return f"{company_name}/{company_document_id}"
+
+
 def document_path(instance, filename):
-    return f"{instance.company.name}/{instance.company_document_id}/{filename}"
+    return f"{document_directory(instance.company.name, instance.company_document_id)}/{filename}"
 
 
 class Document(models.Model):
@@ -85,27 +105,142 @@ class Document(models.Model):
     description = models.TextField(blank=True, null=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="create_user")
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    sha256 = models.CharField(max_length=64, blank=True, default="", editable=False)
+    size = models.PositiveBigIntegerField(null=True, editable=False)
+    page_count = models.PositiveIntegerField(null=True, editable=False)
+    producer = models.CharField(max_length=255, blank=True, default="", editable=False)
+    pdf_title = models.CharField(max_length=255, blank=True, default="", editable=False)
+    thumbnail = models.FileField(blank=True, default="", editable=False)
+    linearized = models.FileField(blank=True, default="", editable=False)
+    last_accessed_at = models.DateTimeField(null=True, editable=False)
 
     def __str__(self):
         return self.file.name
 
     def delete(self, *args, **kwargs):
-        self.file.delete()
+        self.delete_files()
         super().delete(*args, **kwargs)
 
+    def delete_files(self):
+        """Delete the document's file and the files derived from it."""
+        self.file.delete(save=False)
+        if self.thumbnail:
+            self.thumbnail.delete(save=False)
+        if self.linearized:
+            self.linearized.delete(save=False)
+
     def slug(self):
         return f"{self.company.name}-{self.company_document_id}"
 
     class Meta:
-        indexes = [models.Index(fields=["company", "company_document_id"])]
+        indexes = [
+            models.Index(fields=["company", "company_document_id"]),
+            models.Index(fields=["company", "sha256"]),
+        ]
         ordering = ["-id"]
         unique_together = ("company", "category", "validity_start")
 
 
+class ColdDocument(models.Model):
+    """
+    Location of a document's file moved to cold storage (see utils/tiering.py).
+
+    The file is compressed as a gzip member of an archive file, so it's read from the offset without
+    unpacking the archive. Documents downloaded often are promoted back to the storage of documents.
+    """
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, related_name="cold")
+    archive = models.CharField(max_length=100)
+    offset = models.PositiveBigIntegerField()
+    length = models.PositiveBigIntegerField()
+    size = models.PositiveBigIntegerField()
+    moved_at = models.DateTimeField(auto_now_add=True)
+    accesses = models.PositiveIntegerField(default=0)
+    accessed_at = models.DateTimeField(null=True)
+
+
+class DocumentSignature(models.Model):
+    """
+    MinHash signature of the text of a document's file, used to find near-duplicates (see utils/similarity.py).
+    """
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, related_name="signature")
+    minhash = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class SimilarityBucket(models.Model):
+    """
+    Locality-sensitive hashing bucket of one band of a document's signature.
+
+    Documents sharing a bucket in any band are candidates for near-duplicates, so they're found with an index lookup
+    instead of comparing all pairs of documents.
+    """
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name="similarity_buckets")
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=["bucket"])]
+
+
+class SimilarPair(models.Model):
+    """
+    Pair of a company's documents with similar texts (similarity at least SIMILARITY_THRESHOLD), stored when
+    the signature of the later one is stored, so that the report of near-duplicates is read page by page instead
+    of being computed. The first document has the lower primary key.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    first = models.ForeignKey(Document, on_delete=models.CASCADE, related_name="+")
+    second = models.ForeignKey(Document, on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ("first", "second")
+        indexes = [models.Index(fields=["company", "-score"])]
+
+
 class History(models.Model):
+    """
+    Change of a document's field.
+
+    The company is the document's, so history can be partitioned by company like documents (see
+    partition_documents).
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE)
     document = models.ForeignKey(Document, on_delete=models.CASCADE)
     element = models.CharField(max_length=100)
     changed_from = models.CharField(max_length=100)
     changed_to = models.CharField(max_length=100)
     changed_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="change_user")
     changed_at = models.DateTimeField(auto_now_add=True)
+
+    def save(self, *args, **kwargs):
+        if self.company_id is None:
+            self.company_id = self.document.company_id
+        super().save(*args, **kwargs)
+
+
+class DocumentStatistic(models.Model):
+    """
+    Number of company's documents by category, product, creator or month of creation, and the total size
+    and number of pages of their files.
+
+    The statistics are updated with each change to documents (see signals.py) and rebuilt by the
+    rebuild_statistics command. The key is the id of category, product or user or the month as YYYYMM
+    (0 for the totals).
+    """
+    DIMENSIONS = (
+        ("category", "category"),
+        ("product", "product"),
+        ("creator", "creator"),
+        ("month", "month"),
+        ("size", "size"),
+        ("pages", "pages"),
+    )
+    company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    dimension = models.CharField(max_length=8, choices=DIMENSIONS)
+    key = models.PositiveBigIntegerField()
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=["company", "dimension"])]
+        unique_together = ("company", "dimension", "key")
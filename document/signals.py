@@ -0,0 +1,118 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from document import models
+from document.utils import statistics, tiering, utils
+
+
+@receiver(post_save, sender=models.Company)
+def company_saved(sender, instance, **kwargs):
+    utils.forget_company_ids()
+    utils.bump_data_version(instance.pk)
+
+
+@receiver(post_delete, sender=models.Company)
+def company_deleted(sender, instance, **kwargs):
+    utils.forget_company_ids()
+
+
+@receiver(post_save, sender=models.Product)
+@receiver(post_delete, sender=models.Product)
+@receiver(post_save, sender=models.Category)
+@receiver(post_delete, sender=models.Category)
+@receiver(post_save, sender=models.Document)
+@receiver(post_delete, sender=models.Document)
+def company_object_changed(sender, instance, **kwargs):
+    utils.bump_data_version(instance.company_id)
+
+
+@receiver(m2m_changed, sender=models.Document.product.through)
+def document_products_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+
+    if not reverse:
+        documents = models.Document.objects.filter(pk=instance.pk)
+    elif action == "pre_clear":
+        documents = models.Document.objects.filter(product=instance)
+    else:
+        documents = models.Document.objects.filter(pk__in=pk_set)
+    utils.touch_documents(documents)
+    utils.bump_data_version(instance.company_id)
+
+
+@receiver(post_save, sender=models.Product)
+def product_saved(sender, instance, created, **kwargs):
+    # Cards of all documents show the name of the product
+    if not created:
+        utils.touch_documents(models.Document.objects.filter(product=instance))
+
+
+@receiver(pre_delete, sender=models.Product)
+def product_deleted(sender, instance, **kwargs):
+    utils.touch_documents(models.Document.objects.filter(product=instance))
+
+
+@receiver(post_save, sender=models.Category)
+def category_saved(sender, instance, created, **kwargs):
+    if not created:
+        utils.touch_documents(models.Document.objects.filter(category=instance))
+
+
+@receiver(post_save, sender=models.History)
+def history_saved(sender, instance, **kwargs):
+    utils.bump_data_version(instance.company_id)
+
+
+@receiver(pre_save, sender=models.Document)
+def document_statistics_pre_save(sender, instance, **kwargs):
+    instance._saved_category_id = None
+    if not instance._state.adding:
+        saved = models.Document.objects.filter(pk=instance.pk).values_list("category_id", flat=True)
+        instance._saved_category_id = saved.first()
+
+
+@receiver(post_save, sender=models.Document)
+def document_statistics_post_save(sender, instance, created, **kwargs):
+    if created:
+        statistics.add_document(instance, 1)
+    elif instance._saved_category_id is not None and instance._saved_category_id != instance.category_id:
+        statistics.add(instance.company_id, "category", instance._saved_category_id, -1)
+        statistics.add(instance.company_id, "category", instance.category_id, 1)
+
+
+@receiver(pre_delete, sender=models.Document)
+def document_statistics_pre_delete(sender, instance, **kwargs):
+    for product_id in instance.product.values_list("id", flat=True):
+        statistics.add(instance.company_id, "product", product_id, -1)
+    statistics.add_document(instance, -1)
+
+
+@receiver(m2m_changed, sender=models.Document.product.through)
+def document_statistics_products_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+
+    delta = -1 if action in ("post_remove", "pre_clear") else 1
+    if reverse:
+        n = instance.document_set.count() if action == "pre_clear" else len(pk_set)
+        statistics.add(instance.company_id, "product", instance.pk, delta * n)
+    else:
+        product_ids = instance.product.values_list("id", flat=True) if action == "pre_clear" else pk_set
+        for product_id in product_ids:
+            statistics.add(instance.company_id, "product", product_id, delta)
+
+
+@receiver(post_delete, sender=models.Product)
+@receiver(post_delete, sender=models.Category)
+def document_statistics_dimension_deleted(sender, instance, **kwargs):
+    dimension = "product" if sender is models.Product else "category"
+    models.DocumentStatistic.objects.filter(company_id=instance.company_id, dimension=dimension,
+                                            key=instance.pk).delete()
+
+
+@receiver(post_delete, sender=models.ColdDocument)
+def cold_document_deleted(sender, instance, **kwargs):
+    # The archive is deleted with its last document (promoted or deleted)
+    transaction.on_commit(lambda: tiering.delete_archive_if_unused(instance.archive))
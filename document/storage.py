@@ -0,0 +1,145 @@
+"""
+Storage of uploaded files in an S3-compatible object store (AWS S3, MinIO, Ceph...).
+
+It's used instead of MEDIA_ROOT when S3_BUCKET is set (see S3_* variables in settings.py), so that all nodes
+serve the same files. Downloads redirect to short-lived presigned URLs of the object store, so the files don't
+pass through the application, and big files are uploaded in parts.
+
+boto3 is only needed with this storage, so it's imported when the first request to the object store is made.
+"""
+import os
+import tempfile
+from contextlib import closing
+
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+
+
+def read_chunks(fh, chunk_size):
+    with closing(fh):
+        yield from iter(lambda: fh.read(chunk_size), b"")
+
+
+@deconstructible
+class S3Storage(Storage):
+    """
+    :param bucket: string, name of the bucket (S3_BUCKET by default)
+    :param client: S3 client (a boto3 client created from the settings by default)
+    """
+    def __init__(self, bucket=None, client=None):
+        self.bucket = bucket or settings.S3_BUCKET
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+
+            self._client = boto3.client(
+                "s3",
+                endpoint_url=settings.S3_ENDPOINT_URL or None,
+                region_name=settings.S3_REGION or None,
+                aws_access_key_id=settings.S3_ACCESS_KEY_ID or None,
+                aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY or None,
+            )
+        return self._client
+
+    def _open(self, name, mode="rb"):
+        if "w" in mode or "a" in mode:
+            raise ValueError("Files in the object store can only be opened for reading.")
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=name)["Body"]
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(name)
+
+        # Spooled to a local file, so that it can be read more than once (e.g. hashing and rendering)
+        fh = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        for chunk in iter(lambda: body.read(File.DEFAULT_CHUNK_SIZE), b""):
+            fh.write(chunk)
+        body.close()
+        fh.seek(0)
+        return File(fh, name=name)
+
+    def read_range(self, name, offset, length, chunk_size=File.DEFAULT_CHUNK_SIZE):
+        """
+        Read a part of the file without downloading the rest (e.g. a document in an archive of cold storage).
+
+        :param name: string, name of the file in the storage
+        :param offset: integer, position of the first byte
+        :param length: integer, number of bytes
+        :param chunk_size: integer, size of the chunks
+        :return: iterator of bytes
+        """
+        if not length:
+            return iter(())
+        # Requested right away, so that the part can be read after the file was deleted
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=name,
+                                          Range=f"bytes={offset}-{offset + length - 1}")["Body"]
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(name)
+        return read_chunks(body, chunk_size)
+
+    def _save(self, name, content):
+        if hasattr(content, "seek"):
+            content.seek(0)
+        size = content.size if hasattr(content, "size") else None
+        if size is not None and size <= settings.S3_MULTIPART_THRESHOLD:
+            self.client.put_object(Bucket=self.bucket, Key=name, Body=content.read(),
+                                   ContentType=self.content_type(name))
+            return name
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=name,
+                                                        ContentType=self.content_type(name))["UploadId"]
+        try:
+            parts = []
+            for number, chunk in enumerate(iter(lambda: content.read(settings.S3_MULTIPART_CHUNK_SIZE), b""), 1):
+                response = self.client.upload_part(Bucket=self.bucket, Key=name, UploadId=upload_id,
+                                                   PartNumber=number, Body=chunk)
+                parts.append({"PartNumber": number, "ETag": response["ETag"]})
+            self.client.complete_multipart_upload(Bucket=self.bucket, Key=name, UploadId=upload_id,
+                                                  MultipartUpload={"Parts": parts})
+        except Exception:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=name, UploadId=upload_id)
+            raise
+        return name
+
+    def content_type(self, name):
+        return "application/pdf" if name.lower().endswith(".pdf") else "application/octet-stream"
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=name)
+
+    def exists(self, name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=name)
+        except self.client.exceptions.ClientError as error:
+            if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def size(self, name):
+        return self.client.head_object(Bucket=self.bucket, Key=name)["ContentLength"]
+
+    def url(self, name, filename=None, content_type=None):
+        """
+        Get a presigned URL of the file which expires after S3_URL_EXPIRE seconds.
+
+        :param name: string, name of the file in the storage
+        :param filename: string, name of the file shown to the user (inline Content-Disposition)
+        :param content_type: string, Content-Type of the response
+        :return: string
+        """
+        params = {"Bucket": self.bucket, "Key": name}
+        if filename:
+            params["ResponseContentDisposition"] = f'inline; filename="{filename}"'
+        if content_type:
+            params["ResponseContentType"] = content_type
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=settings.S3_URL_EXPIRE)
+
+    def presigned_download_url(self, name, content_type, filename=None):
+        """Downloads redirect to this URL instead of streaming the file (see utils.document_file_response)."""
+        return self.url(name, filename=filename or os.path.basename(name), content_type=content_type)
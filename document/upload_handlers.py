@@ -0,0 +1,26 @@
+import hashlib
+
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Calculate SHA-256 checksums of uploaded files while they are streamed, so duplicates are found without
+    reading the files again.
+
+    It must be the first of FILE_UPLOAD_HANDLERS: it passes the data on to the handlers which store the file
+    and saves the checksums in request.upload_sha256 by the name of the form field.
+    """
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, "upload_sha256"):
+            self.request.upload_sha256 = {}
+        self.request.upload_sha256[self.field_name] = self.sha256.hexdigest()
+        return None
@@ -1,11 +1,15 @@
+from django.conf import settings
 from django.urls import path
 
-from document import views
+from document import api, views
 
 urlpatterns = [
     path('', views.MainView.as_view(), name="main"),
     path('search/', views.MainView.as_view(), name="search"),
     path('manage/', views.ManageView.as_view(), name="manage"),
+    path('statistics/', views.StatisticsView.as_view(), name="statistics"),
+    path('statistics/duplicates/', views.NearDuplicatesView.as_view(), name="near_duplicates"),
+    path('metrics', views.MetricsView.as_view(), name="metrics"),
 
     path('product/add/', views.AddProductView.as_view(), name="add_product"),
     path('product/edit/<company_name>/<company_product_id>', views.EditProductView.as_view(), name="edit_product"),
@@ -20,4 +24,18 @@ urlpatterns = [
     path('document/delete/<company_name>/<company_document_id>', views.DeleteDocumentView.as_view(), name="delete_document"),
     path('document/<company_name>/<company_document_id>', views.DocumentDetailView.as_view(), name="document_detail"),
     path('download/<company_name>/<company_document_id>', views.DownloadDocumentView.as_view(), name="download"),
+    path('thumbnail/<company_name>/<company_document_id>', views.ThumbnailView.as_view(), name="thumbnail"),
+
+    path('api/<company_name>/documents/', api.DocumentApiView.as_view(), name="api_documents"),
+    path('api/<company_name>/documents/<int:company_object_id>', api.DocumentApiView.as_view(), name="api_document"),
+    path('api/<company_name>/products/', api.ProductApiView.as_view(), name="api_products"),
+    path('api/<company_name>/products/<int:company_object_id>', api.ProductApiView.as_view(), name="api_product"),
+    path('api/<company_name>/categories/', api.CategoryApiView.as_view(), name="api_categories"),
+    path('api/<company_name>/categories/<int:company_object_id>', api.CategoryApiView.as_view(), name="api_category"),
+    path('api/<company_name>/history/', api.HistoryApiView.as_view(), name="api_history"),
 ]
+
+# Under ASGI, the I/O-bound endpoints are served by async views
+if settings.ASYNC_VIEWS:
+    from document import async_urls
+    urlpatterns = async_urls.urlpatterns + urlpatterns
@@ -0,0 +1,299 @@
+import math
+import resource
+import socket
+import sys
+import threading
+import time
+import types
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+
+from django.core.asgi import get_asgi_application
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+
+from account.models import Profile
+from document.utils import synthetic
+
+
+class Endpoint:
+    """
+    Endpoint under the benchmark.
+
+    :param name: string, name used in the results
+    :param path: function of the random generator returning the path of the request
+    :param method: string, "get" or "post"
+    :param data: function of the random generator returning the data of a POST request
+    :param client: string, which client sends the request: "user" (logged in) or "anonymous"
+    """
+    def __init__(self, name, path, method="get", data=None, client="user"):
+        self.name = name
+        self.path = path
+        self.method = method
+        self.data = data
+        self.client = client
+
+
+def percentile(values, p):
+    """Get the p-th percentile (nearest-rank method) of the values."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(p * len(ordered) / 100) - 1))
+    return ordered[index]
+
+
+def peak_rss_kb():
+    """Get peak resident set size of the process in kilobytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def summarize(latencies, queries=None, errors=0):
+    """
+    Summarize latencies (in seconds) and numbers of queries of the requests.
+
+    :return: dictionary with the statistics in milliseconds
+    """
+    summary = {
+        "requests": len(latencies),
+        "errors": errors,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+        "peak_rss_kb": peak_rss_kb(),
+    }
+    if queries:
+        summary["queries_per_request"] = round(sum(queries) / len(queries), 2)
+        summary["max_queries"] = max(queries)
+    return summary
+
+
+def benchmark_user(company):
+    """
+    Get the user sending the requests: the first contributor of the company, or its admin if there's none
+    (adding documents needs one of the roles).
+
+    :param company: company model object with synthetic data
+    :return: user model object or None
+    """
+    profiles = Profile.objects.filter(company=company, role__in=["contributor", "admin"]).select_related("user")
+    profile = profiles.filter(role="contributor").order_by("employee_num").first() or profiles.first()
+    return profile.user if profile else None
+
+
+def hot_endpoints(company, n_documents):
+    """
+    Get the endpoints most often used by users of the company.
+
+    :param company: company model object with synthetic data
+    :param n_documents: integer, number of documents of the company
+    :return: list of Endpoint objects
+    """
+    name = company.name
+    # Documents added during the benchmark must have unique validity start dates in the category
+    category_id = company.category_set.values_list("pk", flat=True).first()
+    dates = synthetic.next_validity_starts(company, [category_id])
+
+    def add_document_data(_):
+        return {
+            "product": company.product_set.values_list("pk", flat=True).first(),
+            "category": category_id,
+            "validity_start": synthetic.take_validity_start(dates, category_id).isoformat(),
+            "title": "Benchmark document",
+            "file": SimpleUploadedFile("benchmark.pdf", synthetic.tiny_pdf(), content_type="application/pdf"),
+        }
+
+    return [
+        Endpoint("main", lambda r: f"/?page={r.randint(1, 5)}"),
+        Endpoint("search", lambda r: f"/search/?phrase={r.choice(synthetic.WORDS)}"),
+        Endpoint("document_detail", lambda r: f"/document/{name}/{r.randint(1, n_documents)}"),
+        Endpoint("download", lambda r: f"/download/{name}/{r.randint(1, n_documents)}"),
+        Endpoint("manage", lambda r: "/manage/"),
+        Endpoint("add_document", lambda r: "/document/add/", method="post", data=add_document_data),
+        Endpoint("login", lambda r: "/account/login/", method="post", client="anonymous",
+                 data=lambda r: {"email": f"user1@{name}.example.com", "password": synthetic.PASSWORD}),
+    ]
+
+
+def run_client(endpoints, rng, clients, n_requests):
+    """
+    Send requests through the Django test client, counting the queries of each request.
+
+    :param endpoints: list of Endpoint objects
+    :param rng: random generator
+    :param clients: dictionary of test clients ("user" and "anonymous")
+    :param n_requests: integer, number of requests per endpoint
+    :return: dictionary of summaries by endpoint name
+    """
+    results = {}
+    for endpoint in endpoints:
+        client = clients[endpoint.client]
+        latencies, queries, errors = [], [], 0
+        for _ in range(n_requests):
+            path = endpoint.path(rng)
+            data = endpoint.data(rng) if endpoint.data else None
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = getattr(client, endpoint.method)(path, data) if data else client.get(path)
+                latencies.append(time.perf_counter() - start)
+            queries.append(len(context.captured_queries))
+            errors += response.status_code >= 400
+        results[endpoint.name] = summarize(latencies, queries, errors)
+    return results
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServer:
+    """Local multi-threaded WSGI server of the application, run in a thread of the current process."""
+    def __init__(self):
+        self.server = ThreadedWSGIServer(("127.0.0.1", 0), QuietWSGIRequestHandler, allow_reuse_address=False)
+        self.server.set_app(get_wsgi_application())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def fetch(url, session_cookie):
+    """
+    Send a GET request and read the whole response.
+
+    :return: tuple of the latency in seconds and whether the request failed
+    """
+    request = urllib.request.Request(url, headers={"Cookie": session_cookie})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+        failed = False
+    except HTTPError as error:
+        error.read()
+        failed = True
+    return time.perf_counter() - start, failed
+
+
+def run_server(endpoints, rng, server_url, session_cookie, n_requests):
+    """
+    Send GET requests over HTTP to a local WSGI server (as the logged-in user).
+
+    :param endpoints: list of Endpoint objects
+    :param rng: random generator
+    :param server_url: string, e.g. http://127.0.0.1:8000
+    :param session_cookie: string, value of the Cookie header
+    :param n_requests: integer, number of requests per endpoint
+    :return: dictionary of summaries by endpoint name
+    """
+    results = {}
+    for endpoint in endpoints:
+        if endpoint.method != "get":
+            continue
+        latencies, errors = [], 0
+        for _ in range(n_requests):
+            latency, failed = fetch(server_url + endpoint.path(rng), session_cookie)
+            latencies.append(latency)
+            errors += failed
+        results[endpoint.name] = summarize(latencies, errors=errors)
+    return results
+
+
+def run_concurrent(endpoints, rng, server_url, session_cookie, n_requests, concurrency):
+    """
+    Send GET requests over HTTP from concurrent clients and measure the throughput of the server.
+
+    :param concurrency: integer, number of clients sending requests at the same time
+    :return: dictionary of summaries (with throughput_rps) by endpoint name
+    """
+    results = {}
+    for endpoint in endpoints:
+        if endpoint.method != "get":
+            continue
+        urls = [server_url + endpoint.path(rng) for _ in range(n_requests)]
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            start = time.perf_counter()
+            responses = list(pool.map(lambda url: fetch(url, session_cookie), urls))
+            elapsed = time.perf_counter() - start
+        summary = summarize([latency for latency, _ in responses], errors=sum(failed for _, failed in responses))
+        summary["throughput_rps"] = round(n_requests / elapsed, 1)
+        results[endpoint.name] = summary
+    return results
+
+
+def async_urlconf():
+    """Get the URLconf of the application with the async views, as with ASYNC_VIEWS=True."""
+    from actudoc import urls
+    from document import async_urls
+    urlconf = types.ModuleType("async_urlconf")
+    urlconf.urlpatterns = [path('', include(async_urls))] + urls.urlpatterns
+    return urlconf
+
+
+class AsgiServer:
+    """
+    Local uvicorn server of the ASGI application, run in a thread of the current process.
+
+    uvicorn is imported only here, so it's needed only for the ASGI benchmark.
+    """
+    def __init__(self):
+        import uvicorn
+
+        self.socket = socket.socket()
+        self.socket.bind(("127.0.0.1", 0))
+        config = uvicorn.Config(get_asgi_application(), log_level="warning", lifespan="off")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, kwargs={"sockets": [self.socket]}, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.socket.getsockname()
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *args):
+        self.server.should_exit = True
+        self.thread.join()
+        self.socket.close()
+
+
+def compare(results, baseline):
+    """
+    Compare p50 and p95 latencies with results of a previous run.
+
+    :return: list of lines of text
+    """
+    lines = []
+    for mode, endpoints in results.items():
+        for name, summary in endpoints.items():
+            previous = baseline.get(mode, {}).get(name)
+            line = f"{mode:>8} {name:<16} p50 {summary['p50_ms']:>9.2f} ms  p95 {summary['p95_ms']:>9.2f} ms"
+            if "throughput_rps" in summary:
+                line += f"  {summary['throughput_rps']:>8.1f} req/s"
+            if previous:
+                line += f"  (p50 {summary['p50_ms'] / previous['p50_ms']:.2f}x, " \
+                        f"p95 {summary['p95_ms'] / previous['p95_ms']:.2f}x of baseline)"
+            lines.append(line)
+    return lines
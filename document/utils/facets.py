@@ -0,0 +1,80 @@
+from django.contrib.auth.models import User
+from django.db.models import BigIntegerField, CharField, Count, F, Value
+from django.db.models.functions import Cast, ExtractYear
+
+from document import models
+
+
+# Facets in the order they're shown: name of the URL parameter and the grouped expression. The keys are cast to
+# the same type, as PostgreSQL extracts years as double precision and the union would make all keys floats.
+FACETS = (
+    ("product", Cast(F("product"), BigIntegerField())),
+    ("category", Cast(F("category"), BigIntegerField())),
+    ("year", Cast(ExtractYear("validity_start"), BigIntegerField())),
+    ("creator", Cast(F("created_by"), BigIntegerField())),
+)
+
+
+def counts(documents):
+    """
+    Count the documents by product, category, year of validity start and creator in a single query.
+
+    The documents are grouped in a subquery, so joins of the filter (e.g. on products) don't limit the groups.
+
+    :param documents: queryset of documents (e.g. the search results)
+    :return: dictionary of facet names to dictionaries of keys (primary keys or years) to counts
+    """
+    base = models.Document.objects.filter(pk__in=documents.order_by().values("pk")).order_by()
+    queries = [
+        base.annotate(facet=Value(name, output_field=CharField()), key=expression).values("facet", "key").annotate(
+            n=Count("pk", distinct=True)).values_list("facet", "key", "n")
+        for name, expression in FACETS
+    ]
+    result = {name: {} for name, _ in FACETS}
+    for name, key, n in queries[0].union(*queries[1:], all=True):
+        if key is not None:
+            result[name][key] = n
+    return result
+
+
+def options(company, facet_counts, selected, params):
+    """
+    Get the clickable filters of the facets.
+
+    Each filter combines with the current ones (a selected one removes itself), so users narrow the results
+    step by step.
+
+    :param company: company model object
+    :param facet_counts: dictionary returned by counts()
+    :param selected: dictionary of facet names to the selected values of URL parameters
+    :param params: QueryDict of the current request (request.GET)
+    :return: list of (title, list of (label, count, is_selected, query_string)) tuples
+    """
+    products = models.Product.objects.filter(company=company, pk__in=facet_counts["product"])
+    categories = models.Category.objects.filter(company=company, pk__in=facet_counts["category"])
+    users = User.objects.filter(profile__company=company, pk__in=facet_counts["creator"]).select_related("profile")
+    facets = (
+        ("Product", "product", sorted(((str(p), p.company_product_id, facet_counts["product"][p.pk])
+                                       for p in products), key=lambda x: -x[2])),
+        ("Category", "category", sorted(((c.name, c.company_category_id, facet_counts["category"][c.pk])
+                                         for c in categories), key=lambda x: -x[2])),
+        ("Year", "year", [(year, year, n) for year, n in sorted(facet_counts["year"].items(), reverse=True)]),
+        ("Created by", "creator", sorted(((str(u), u.profile.employee_num, facet_counts["creator"][u.pk])
+                                          for u in users), key=lambda x: -x[2])),
+    )
+
+    result = []
+    for title, name, values in facets:
+        filters = []
+        for label, value, n in values:
+            query = params.copy()
+            query.pop("page", None)
+            is_selected = selected.get(name) == str(value)
+            if is_selected:
+                query.pop(name, None)
+            else:
+                query[name] = value
+            filters.append((label, n, is_selected, query.urlencode()))
+        if filters:
+            result.append((title, filters))
+    return result
@@ -0,0 +1,75 @@
+"""
+Instrumentation of a request which follows its work into other threads.
+
+Execute wrappers of database connections and the sampling profiler are bound to a thread, while async views run
+the work of a request in a thread pool (see async_views.run_sync). The middlewares install them with
+execute_wrapper() and sampled(), which also keep them in context variables, and the pool thread installs them
+again with follow().
+"""
+import contextvars
+import threading
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+
+_wrappers = contextvars.ContextVar("execute_wrappers", default=())
+_samplers = contextvars.ContextVar("samplers", default=())
+
+
+def _install_wrappers(stack, wrappers):
+    for connection in connections.all():
+        for wrapper in wrappers:
+            stack.enter_context(connection.execute_wrapper(wrapper))
+
+
+def _sample(stack, sampler, stacks):
+    thread_id = threading.get_ident()
+    sampler.start(thread_id)
+    stack.callback(lambda: stacks.update(sampler.stop(thread_id)))
+
+
+@contextmanager
+def execute_wrapper(wrapper):
+    """
+    Install the execute wrapper on the database connections of the current thread and of the threads which
+    run the work of the current request.
+
+    :param wrapper: callable(execute, sql, params, many, context), see Django's connection.execute_wrapper
+    """
+    token = _wrappers.set(_wrappers.get() + (wrapper,))
+    try:
+        with ExitStack() as stack:
+            _install_wrappers(stack, [wrapper])
+            yield
+    finally:
+        _wrappers.reset(token)
+
+
+@contextmanager
+def sampled(sampler):
+    """
+    Sample the stacks of the current thread and of the threads which run the work of the current request.
+
+    :param sampler: profiler.Sampler object
+    :return: context manager giving the Counter of numbers of samples by collapsed stack, filled on exit
+    """
+    stacks = Counter()
+    token = _samplers.set(_samplers.get() + ((sampler, stacks),))
+    try:
+        with ExitStack() as stack:
+            _sample(stack, sampler, stacks)
+            yield stacks
+    finally:
+        _samplers.reset(token)
+
+
+@contextmanager
+def follow():
+    """Install the execute wrappers and samplers of the request (from the context) in the current thread."""
+    with ExitStack() as stack:
+        _install_wrappers(stack, _wrappers.get())
+        for sampler, stacks in _samplers.get():
+            _sample(stack, sampler, stacks)
+        yield
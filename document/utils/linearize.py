@@ -0,0 +1,101 @@
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+from django.core.files import File
+
+from document import models
+
+
+logger = logging.getLogger(__name__)
+
+
+def linearized_path(document):
+    """
+    Get the path of the linearized copy; it is stored next to the document's file (see document_path).
+
+    :param document: document model object
+    :return: string, path relative to MEDIA_ROOT
+    """
+    name, extension = os.path.splitext(os.path.basename(document.file.name))
+    return f"{os.path.dirname(document.file.name)}/{name}-linearized{extension}"
+
+
+def linearize(pdf_path, output_path):
+    """
+    Linearize the PDF file ("fast web view") using qpdf, so that viewers can show the first page before
+    the whole file is downloaded.
+
+    :param pdf_path: string, path to the PDF file on the local disk
+    :param output_path: string, path of the linearized file
+    :return: boolean, whether the linearized file was written (False if the file is already linearized)
+    """
+    try:
+        check = subprocess.run(["qpdf", "--check-linearization", pdf_path], capture_output=True, timeout=60)
+        if check.returncode == 0:
+            return False
+        subprocess.run(["qpdf", "--linearize", pdf_path, output_path], check=True, capture_output=True, timeout=300)
+    except FileNotFoundError:
+        logger.warning("qpdf is not installed, documents are not linearized")
+        return False
+    except subprocess.CalledProcessError as error:
+        # qpdf exits with 3 if it wrote the file but found problems in the PDF
+        if error.returncode != 3:
+            logger.warning("Could not linearize %s", pdf_path)
+            return False
+    except subprocess.TimeoutExpired:
+        logger.warning("Could not linearize %s", pdf_path)
+        return False
+    return os.path.exists(output_path)
+
+
+def linearize_copy(document, pdf_path):
+    """
+    Linearize the local copy of the document's file and save the linearized copy next to the file.
+
+    :param document: document model object
+    :param pdf_path: string, path to the copy of the document's file on the local disk
+    :return: string, name of the linearized copy in the storage or None if it wasn't written
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        linearized_file = os.path.join(tmp_dir, "linearized.pdf")
+        if not linearize(pdf_path, linearized_file):
+            return None
+        with open(linearized_file, "rb") as fh:
+            return document.linearized.storage.save(linearized_path(document), File(fh))
+
+
+def store_linearized(document, name):
+    """Store the name of the linearized copy on the document, or delete the copy if the document was deleted."""
+    if not models.Document.objects.filter(pk=document.pk).update(linearized=name):
+        document.linearized.storage.delete(name)
+
+
+def linearize_document(document_id):
+    """
+    Store a linearized copy of the document's file next to it; downloads serve it instead of the original.
+
+    After an upload with LINEARIZE_PDFS set, uploads.process_upload does this from the copy shared with the other
+    processing of the file.
+
+    :param document_id: integer, primary key of the document
+    :return: None
+    """
+    try:
+        document = models.Document.objects.get(pk=document_id)
+    except models.Document.DoesNotExist:
+        return None
+    if document.linearized and document.linearized.storage.exists(document.linearized.name):
+        return None
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        original_path = os.path.join(tmp_dir, "original.pdf")
+        with document.file.open("rb") as fh, open(original_path, "wb") as out:
+            shutil.copyfileobj(fh, out)
+        name = linearize_copy(document, original_path)
+
+    if name is not None:
+        store_linearized(document, name)
+    return None
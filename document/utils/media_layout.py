@@ -0,0 +1,65 @@
+import os
+import shutil
+
+from document import models
+
+
+def target_directory(document, layout):
+    return models.document_directory(document.company.name, document.company_document_id, layout)
+
+
+def link_directory(root, old_directory, new_directory):
+    """
+    Make the files of a document's directory available in the new directory too.
+
+    Files are hard-linked (copied if the directories are on different file systems), so both paths work
+    until the document points to the new one and the old directory is removed. Files which are already
+    in the new directory are skipped, so a migration which was interrupted can be run again.
+
+    :param root: string, MEDIA_ROOT
+    :param old_directory: string, directory relative to root
+    :param new_directory: string, directory relative to root
+    :return: boolean, whether the new directory has the files (False if neither of the directories exists)
+    """
+    old_path = os.path.join(root, old_directory)
+    new_path = os.path.join(root, new_directory)
+    if not os.path.isdir(old_path):
+        return os.path.isdir(new_path)
+
+    os.makedirs(new_path, exist_ok=True)
+    for filename in os.listdir(old_path):
+        source = os.path.join(old_path, filename)
+        target = os.path.join(new_path, filename)
+        if os.path.exists(target) or not os.path.isfile(source):
+            continue
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+    return True
+
+
+def remove_directory(root, directory):
+    """
+    Remove the files of a document's old directory and the directories which became empty (up to the company's).
+
+    Subdirectories are kept: a flat directory of a document (e.g. alpha/12) can also be a shard directory.
+    """
+    path = os.path.join(root, directory)
+    if os.path.isdir(path):
+        for filename in os.listdir(path):
+            if os.path.isfile(os.path.join(path, filename)):
+                os.remove(os.path.join(path, filename))
+    parent = directory
+    while parent.count("/") > 0:
+        try:
+            os.rmdir(os.path.join(root, parent))
+        except OSError:
+            break
+        parent = os.path.dirname(parent)
+
+
+def rename(name, old_directory, new_directory):
+    if name and name.startswith(old_directory + "/"):
+        return new_directory + name[len(old_directory):]
+    return name
@@ -0,0 +1,161 @@
+import contextlib
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import tempfile
+
+from django.db import transaction
+from django.utils import timezone
+
+from document import models
+from document.utils import statistics, thumbnails, tiering, utils
+
+
+logger = logging.getLogger(__name__)
+
+PDFINFO_FIELDS = {"Pages": "page_count", "Producer": "producer", "Title": "pdf_title"}
+
+
+def read_pdf_info(pdf_path):
+    """
+    Read the number of pages, the producer and the title of the PDF file using pdfinfo (poppler-utils).
+
+    :param pdf_path: string, path to the PDF file on the local disk
+    :return: dictionary with page_count, producer and pdf_title (empty if the file can't be read)
+    """
+    try:
+        result = subprocess.run(["pdfinfo", "-enc", "UTF-8", pdf_path], check=True, capture_output=True, timeout=60)
+    except FileNotFoundError:
+        logger.warning("pdfinfo is not installed, page counts of documents are not extracted")
+        return {}
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        logger.warning("Could not read the metadata of %s", pdf_path)
+        return {}
+
+    info = {}
+    for line in result.stdout.decode("utf-8", errors="replace").splitlines():
+        key, _, value = line.partition(":")
+        if key in PDFINFO_FIELDS:
+            info[PDFINFO_FIELDS[key]] = value.strip()
+    if "page_count" in info:
+        info["page_count"] = int(info["page_count"]) if re.fullmatch(r"[0-9]+", info["page_count"]) else None
+    for field in ("producer", "pdf_title"):
+        if field in info:
+            info[field] = info[field][:models.Document._meta.get_field(field).max_length]
+    return info
+
+
+def read_chunks(document):
+    """Read the document's file in chunks from the storage of documents or from cold storage."""
+    entry = getattr(document, "cold", None)
+    if entry is not None:
+        yield from tiering.read_cold(entry)
+        return
+    with document.file.open("rb") as fh:
+        yield from fh.chunks()
+
+
+@contextlib.contextmanager
+def local_copy(document):
+    """
+    Copy the document's file to a temporary file, calculating its checksum and size while it's read.
+
+    :param document: document model object (with select_related("cold") to save a query)
+    :return: context manager giving (path of the copy, SHA-256 checksum, size); FileNotFoundError is raised
+        if the file is missing
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, "document.pdf")
+        with open(pdf_path, "wb") as out:
+            for chunk in read_chunks(document):
+                sha256.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+        yield pdf_path, sha256.hexdigest(), size
+
+
+def metadata_of_copy(document, pdf_path, sha256, size):
+    """
+    Get the metadata of the document's file and render the thumbnail of its first page from the local copy.
+
+    :param document: document model object
+    :param pdf_path: string, path to the copy of the document's file (see local_copy)
+    :param sha256: string, checksum of the file
+    :param size: integer, size of the file in bytes
+    :return: dictionary of values of the document's fields
+    """
+    values = {"sha256": sha256, "size": size, **read_pdf_info(pdf_path)}
+    thumbnail = thumbnails.update_thumbnail(document, pdf_path, sha256)
+    if thumbnail != (document.thumbnail.name or ""):
+        # Cached cards of the document show the thumbnail
+        values.update(thumbnail=thumbnail, updated_at=timezone.now())
+    return values
+
+
+def read_metadata(document):
+    """
+    Read the size, checksum, number of pages, producer and title of the document's file and render its thumbnail.
+
+    :param document: document model object (with select_related("cold") to save a query)
+    :return: dictionary of values of the document's fields or None if the file is missing
+    """
+    try:
+        with local_copy(document) as copy:
+            return metadata_of_copy(document, *copy)
+    except FileNotFoundError:
+        logger.warning("File of document %s is missing", document.pk)
+        return None
+
+
+def store_metadata(document_id, values, bump_version=True):
+    """
+    Store the metadata on the document and update the company's totals of size and pages.
+
+    The new thumbnail is deleted if the document was deleted in the meantime.
+
+    :param document_id: integer, primary key of the document
+    :param values: dictionary of values of the document's fields (see read_metadata)
+    :param bump_version: boolean, whether to change the data version of the company (commands storing metadata
+        of many documents change it once per batch)
+    :return: integer, id of the company of the document or None if the document was deleted
+    """
+    with transaction.atomic():
+        saved = models.Document.objects.select_for_update().filter(pk=document_id).values(
+            "company_id", "size", "page_count").first()
+        if saved is not None:
+            models.Document.objects.filter(pk=document_id).update(**values)
+            statistics.add_totals(saved["company_id"],
+                                  (values.get("size", saved["size"]) or 0) - (saved["size"] or 0),
+                                  (values.get("page_count", saved["page_count"]) or 0) - (saved["page_count"] or 0))
+            if bump_version:
+                # Pages showing the metadata are cached by the data version of the company
+                utils.bump_data_version(saved["company_id"])
+    if saved is None:
+        if values.get("thumbnail"):
+            models.Document.thumbnail.field.storage.delete(values["thumbnail"])
+        return None
+    return saved["company_id"]
+
+
+def extract_metadata(document_id):
+    """
+    Store the metadata of the document's file and the thumbnail of its first page on the document, so that
+    pages, statistics and duplicate checks don't need to read the file.
+
+    The file is read once and its checksum is calculated here for both. After an upload, uploads.process_upload
+    does this from the copy shared with the other processing of the file.
+
+    :param document_id: integer, primary key of the document
+    :return: None
+    """
+    document = models.Document.objects.select_related("cold").filter(pk=document_id).first()
+    if document is None:
+        return None
+    values = read_metadata(document)
+    if values is not None:
+        store_metadata(document_id, values)
+    return None
@@ -0,0 +1,81 @@
+import threading
+
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2)
+
+
+class Histogram:
+    """
+    Histogram of observations by view, kept in the memory of the process (Prometheus histogram semantics).
+
+    :param name: string, name of the metric
+    :param documentation: string, help text of the metric
+    :param buckets: tuple of upper bounds of buckets
+    """
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, view, value):
+        with self.lock:
+            if view not in self.series:
+                self.series[view] = {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0}
+            series = self.series[view]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def reset(self):
+        with self.lock:
+            self.series = {}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for view, series in sorted(self.series.items()):
+                label = view.replace("\\", "\\\\").replace('"', '\\"')
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append(f'{self.name}_bucket{{view="{label}",le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{view="{label}",le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{view="{label}"}} {series["sum"]}')
+                lines.append(f'{self.name}_count{{view="{label}"}} {series["count"]}')
+        return "\n".join(lines)
+
+
+HISTOGRAMS = {
+    "duration": Histogram("actudoc_request_duration_seconds", "Wall time of requests.", TIME_BUCKETS),
+    "db": Histogram("actudoc_request_db_duration_seconds", "Time of database queries of requests.", TIME_BUCKETS),
+    "template": Histogram("actudoc_request_template_duration_seconds", "Time of rendering templates of requests.",
+                          TIME_BUCKETS),
+    "queries": Histogram("actudoc_request_queries", "Number of database queries of requests.", COUNT_BUCKETS),
+    "duplicate_queries": Histogram("actudoc_request_duplicate_queries",
+                                   "Number of repeated identical database queries of requests.", COUNT_BUCKETS),
+    "bytes": Histogram("actudoc_response_bytes", "Size of response bodies.", SIZE_BUCKETS),
+    "memory": Histogram("actudoc_request_peak_memory_bytes", "Peak memory allocated by Python during requests.",
+                        SIZE_BUCKETS),
+}
+
+
+def observe(view, measurements):
+    """
+    Record measurements of a request.
+
+    :param view: string, name of the view, e.g. document.views.MainView
+    :param measurements: dictionary of values by names of HISTOGRAMS (missing ones are skipped)
+    :return: None
+    """
+    for name, value in measurements.items():
+        if name in HISTOGRAMS and value is not None:
+            HISTOGRAMS[name].observe(view, value)
+
+
+def render_prometheus():
+    """Get all metrics in the Prometheus text exposition format."""
+    return "\n".join(histogram.render() for histogram in HISTOGRAMS.values()) + "\n"
@@ -0,0 +1,138 @@
+import hashlib
+import re
+
+from django.db import connection
+
+from document import models
+
+
+def partitioned_tables():
+    """Get the names of the tables which are already partitioned (PostgreSQL)."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT c.relname FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def get_targets():
+    """
+    Get the tables which can be partitioned with their partition keys.
+
+    Documents and history are partitioned by company, so the rows of a company are in the same partition of each
+    table. The products of documents (the through table) aren't partitioned: its rows are written by Django's
+    many-to-many manager, which can't fill a company column.
+
+    :return: dictionary of (table name, partition key column) by short name
+    """
+    return {
+        "documents": (models.Document._meta.db_table, "company_id"),
+        "history": (models.History._meta.db_table, "company_id"),
+    }
+
+
+def temporary_name(name):
+    return "part_" + hashlib.md5(name.encode()).hexdigest()[:16]
+
+
+def plan(table, key, method, n_partitions, company_ids, skipped_references, batch_size):
+    """
+    Get SQL statements which replace the table with a partitioned copy holding the same data.
+
+    The copy gets the same columns, defaults, check constraints, indexes and foreign keys. The primary key and
+    unique constraints must include the partition key, so the primary key becomes (id, key). Foreign keys which
+    reference the table from other tables are dropped, because a partitioned table can't have a unique
+    constraint on id alone; Django still cascades deletes of related objects itself, and migrations don't create
+foreign keys to partitioned tables either (see actudoc/db/postgresql/schema.py).
+
+    :param table: string, name of the table
+    :param key: string, name of the partition key column
+    :param method: string, "hash" or "list" (one partition per company and a default one for new companies)
+    :param n_partitions: integer, number of partitions of the hash method
+    :param company_ids: list of ids of companies for the list method
+    :param skipped_references: set of tables which are (or will be) partitioned, foreign keys to them aren't copied
+    :param batch_size: integer, number of rows copied by one statement
+    :return: tuple of the list of SQL statements and the list of notes for the user
+    """
+    quote = connection.ops.quote_name
+    new_table = f"{table}__partitioned"
+    statements = [f"LOCK TABLE {quote(table)} IN ACCESS EXCLUSIVE MODE"]
+    notes = []
+    renames = []
+
+    statements.append(f"CREATE TABLE {quote(new_table)} (LIKE {quote(table)} INCLUDING DEFAULTS "
+                      f"INCLUDING CONSTRAINTS) PARTITION BY {method.upper()} ({quote(key)})")
+    partition_names = []
+    if method == "hash":
+        for i in range(n_partitions):
+            partition_names.append(f"{table}_p{i}")
+            statements.append(f"CREATE TABLE {quote(new_table + f'_p{i}')} PARTITION OF {quote(new_table)} "
+                              f"FOR VALUES WITH (MODULUS {n_partitions}, REMAINDER {i})")
+    else:
+        for company_id in company_ids:
+            partition_names.append(f"{table}_c{company_id}")
+            statements.append(f"CREATE TABLE {quote(new_table + f'_c{company_id}')} "
+                              f"PARTITION OF {quote(new_table)} FOR VALUES IN ({int(company_id)})")
+        partition_names.append(f"{table}_default")
+        statements.append(f"CREATE TABLE {quote(new_table + '_default')} PARTITION OF {quote(new_table)} DEFAULT")
+
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT conname, contype, pg_get_constraintdef(oid), confrelid::regclass::text,
+                   ARRAY(SELECT attname FROM pg_attribute WHERE attrelid = conrelid AND attnum = ANY(conkey))
+            FROM pg_constraint WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')
+        """, [table])
+        constraints = cursor.fetchall()
+        cursor.execute("""
+            SELECT i.relname, pg_get_indexdef(i.oid)
+            FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+            WHERE x.indrelid = %s::regclass AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.oid)
+        """, [table])
+        indexes = cursor.fetchall()
+        cursor.execute("SELECT conname, conrelid::regclass::text FROM pg_constraint "
+                       "WHERE confrelid = %s::regclass AND contype = 'f' AND conrelid <> confrelid", [table])
+        references = cursor.fetchall()
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id'), MIN(id), MAX(id) FROM " + quote(table), [table])
+        sequence, min_id, max_id = cursor.fetchone()
+
+    for name, kind, definition, referenced_table, columns in constraints:
+        if kind == "p":
+            columns = columns if key in columns else columns + [key]
+            definition = f"PRIMARY KEY ({', '.join(quote(column) for column in columns)})"
+        elif kind == "u" and key not in columns:
+            raise ValueError(f"Unique constraint {name} of {table} doesn't include the partition key {key}.")
+        elif kind == "f" and referenced_table.strip('"') in skipped_references:
+            notes.append(f"Foreign key {name} of {table} to partitioned {referenced_table} is dropped.")
+            continue
+        temporary = quote(temporary_name(name))
+        statements.append(f"ALTER TABLE {quote(new_table)} ADD CONSTRAINT {temporary} {definition}")
+        renames.append(f"ALTER TABLE {quote(table)} RENAME CONSTRAINT {temporary} TO {quote(name)}")
+
+    for name, definition in indexes:
+        match = re.match(r"CREATE (UNIQUE )?INDEX \S+ ON \S+ (.*)$", definition)
+        if match.group(1) and key not in match.group(2):
+            raise ValueError(f"Unique index {name} of {table} doesn't include the partition key {key}.")
+        statements.append(f"CREATE {match.group(1) or ''}INDEX {quote(temporary_name(name))} ON {quote(new_table)} "
+                          f"{match.group(2)}")
+        renames.append(f"ALTER INDEX {quote(temporary_name(name))} RENAME TO {quote(name)}")
+
+    # Rows are copied in ranges of ids, so that no statement builds a huge result in memory
+    if min_id is not None:
+        for start in range(min_id, max_id + 1, batch_size):
+            statements.append(f"INSERT INTO {quote(new_table)} SELECT * FROM {quote(table)} "
+                              f"WHERE id >= {start} AND id < {start + batch_size}")
+
+    for name, referencing_table in references:
+        notes.append(f"Foreign key {name} of {referencing_table} to {table} is dropped.")
+        statements.append(f"ALTER TABLE {referencing_table} DROP CONSTRAINT {quote(name)}")
+    if sequence:
+        statements.append(f"ALTER SEQUENCE {sequence} OWNED BY {quote(new_table)}.id")
+
+    statements.append(f"DO $$ BEGIN IF (SELECT COUNT(*) FROM {quote(table)}) <> "
+                      f"(SELECT COUNT(*) FROM {quote(new_table)}) "
+                      f"THEN RAISE EXCEPTION 'Rows of {table} were not all copied'; END IF; END $$")
+    statements.append(f"DROP TABLE {quote(table)}")
+    statements.append(f"ALTER TABLE {quote(new_table)} RENAME TO {quote(table)}")
+    for partition_name in partition_names:
+        old_name = new_table + partition_name[len(table):]
+        statements.append(f"ALTER TABLE {quote(old_name)} RENAME TO {quote(partition_name)}")
+    statements += renames
+    return statements, notes
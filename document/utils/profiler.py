@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+
+logger = logging.getLogger(__name__)
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", os.path.basename(code.co_filename))
+    return f"{module}.{code.co_name}:{code.co_firstlineno}"
+
+
+def collapse(frame):
+    """
+    Get the stack of the frame in the collapsed format of flame graphs: outermost function first, separated by ;.
+
+    :param frame: frame object
+    :return: string, e.g. "django.core.handlers.base._get_response:160;document.views.get:85"
+    """
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class Sampler:
+    """
+    Wall-clock sampling profiler of threads (pure Python, no native dependencies).
+
+    A SIGALRM interval timer fires every interval seconds and the signal handler records the current stacks
+    of the threads being profiled (sys._current_frames()), so requests handled in any thread are sampled.
+    Python runs signal handlers in the main thread only, so the sampler has to be installed from the main thread.
+
+    :param interval: float, seconds between two samples
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.threads = {}
+
+    def install(self):
+        signal.signal(signal.SIGALRM, self.sample)
+
+    def sample(self, signum, frame):
+        frames = sys._current_frames()
+        # The handler interrupted the main thread, whose own stack starts at the interrupted frame
+        frames[threading.main_thread().ident] = frame
+        # The signal may interrupt start() or stop() holding the lock in the main thread, so the sample is skipped
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            for thread_id, stacks in self.threads.items():
+                thread_frame = frames.get(thread_id)
+                if thread_frame is not None:
+                    stacks[collapse(thread_frame)] += 1
+        finally:
+            self.lock.release()
+
+    def start(self, thread_id):
+        with self.lock:
+            self.threads[thread_id] = Counter()
+            if len(self.threads) == 1:
+                signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+
+    def stop(self, thread_id):
+        """
+        Stop profiling the thread.
+
+        :return: Counter of numbers of samples by collapsed stack
+        """
+        with self.lock:
+            stacks = self.threads.pop(thread_id, Counter())
+            if not self.threads:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        return stacks
+
+
+def get_sampler(interval):
+    """
+    Get the sampler of the process, installing it on first use.
+
+    :param interval: float, seconds between two samples
+    :return: Sampler object or None if it can't be installed (outside of the main thread, e.g. under the autoreloader)
+    """
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            sampler = Sampler(interval)
+            try:
+                sampler.install()
+            except ValueError:
+                logger.warning("Sampling profiler can't be installed outside of the main thread")
+                sampler = False
+            _sampler = sampler
+    return _sampler or None
+
+
+def save_profile(directory, info, stacks, max_files):
+    """
+    Save the profile of a request as a JSON file, deleting the oldest profiles above max_files.
+
+    :param directory: string, directory of profiles
+    :param info: dictionary describing the request (view, method, path, duration...)
+    :param stacks: Counter of numbers of samples by collapsed stack
+    :param max_files: integer, number of kept profiles
+    :return: string, name of the file
+    """
+    os.makedirs(directory, exist_ok=True)
+    now = time.time_ns()
+    timestamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now / 1e9))
+    name = f"{timestamp}.{now % 10 ** 9:09d}-{uuid.uuid4().hex[:8]}.json"
+    with open(os.path.join(directory, name), "w") as fh:
+        json.dump({**info, "samples": sum(stacks.values()), "stacks": dict(stacks)}, fh)
+
+    # Names start with the time of the capture, so they sort from the oldest
+    files = sorted(entry for entry in os.listdir(directory) if entry.endswith(".json"))
+    for entry in files[:max(0, len(files) - max_files)]:
+        try:
+            os.remove(os.path.join(directory, entry))
+        except FileNotFoundError:
+            pass
+    return name
+
+
+def load_profile(directory, name):
+    """
+    Load a saved profile.
+
+    :return: dictionary or None if there is no such profile
+    """
+    if os.path.basename(name) != name or not name.endswith(".json"):
+        return None
+    try:
+        with open(os.path.join(directory, name)) as fh:
+            profile = json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return None
+    profile["name"] = name
+    return profile
+
+
+def list_profiles(directory, limit=50):
+    """
+    Get saved profiles, the slowest requests first.
+
+    :return: list of dictionaries
+    """
+    if not os.path.isdir(directory):
+        return []
+    profiles = (load_profile(directory, entry.name) for entry in os.scandir(directory))
+    profiles = [profile for profile in profiles if profile is not None]
+    return sorted(profiles, key=lambda profile: profile["duration"], reverse=True)[:limit]
+
+
+def collapsed_text(profile):
+    """Get the stacks of the profile in the collapsed format (input of flamegraph.pl or speedscope)."""
+    lines = [f"{stack} {count}" for stack, count in sorted(profile["stacks"].items(), key=lambda item: -item[1])]
+    return "\n".join(lines) + "\n"
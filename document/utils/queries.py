@@ -0,0 +1,122 @@
+import os
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+
+from document.utils import instrumentation
+
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LIST = re.compile(r"\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+# Frames of these files are never reported as callers of queries
+_SKIPPED_FILES = (os.path.abspath(__file__).rsplit(".", 1)[0], os.path.join("document", "middleware"))
+
+
+def fingerprint(sql):
+    """
+    Get the pattern of the SQL statement: literals are replaced with ? and lists of values are collapsed.
+
+    Statements which differ only in their parameters (e.g. the same query run for each document in a loop)
+    have the same fingerprint.
+
+    :param sql: string, SQL statement (with placeholders or literals)
+    :return: string
+    """
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _LIST.sub("(...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+def get_caller():
+    """
+    Get the location in actudoc which ran the current query.
+
+    The innermost template node being rendered wins, e.g. "document/main.html:12", otherwise the innermost frame of
+    the project's code, e.g. "document/views.py:85 in get".
+
+    :return: string or None
+    """
+    base_dir = str(settings.BASE_DIR)
+    code_location = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_code.co_name == "render_annotated":
+            node = frame.f_locals.get("self")
+            origin = getattr(node, "origin", None)
+            token = getattr(node, "token", None)
+            if origin is not None and token is not None:
+                return f"{origin.template_name}:{token.lineno}"
+        filename = frame.f_code.co_filename
+        if (code_location is None and filename.startswith(base_dir) and "site-packages" not in filename
+                and not filename.rsplit(".", 1)[0].endswith(_SKIPPED_FILES)):
+            code_location = f"{os.path.relpath(filename, base_dir)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return code_location
+
+
+class QueryDetector:
+    """
+    Detect SQL statements run repeatedly (N+1 queries) while it's active.
+
+    Usage:
+        with QueryDetector(threshold=5) as detector:
+            ...
+        for pattern in detector.repeated():
+            ...
+
+    :param threshold: integer, statements with the same fingerprint run more than threshold times are reported
+    """
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.patterns = {}
+        self.recording = True
+        self.stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        if not self.recording:
+            return execute(sql, params, many, context)
+        key = fingerprint(sql)
+        if key not in self.patterns:
+            self.patterns[key] = {"count": 0, "callers": Counter()}
+        self.patterns[key]["count"] += 1
+        self.patterns[key]["callers"][get_caller()] += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        self.stack.enter_context(instrumentation.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *args):
+        self.stack.close()
+
+    def reset(self):
+        self.patterns = {}
+
+    def repeated(self):
+        """
+        Get statements run more than threshold times, the most frequent first.
+
+        :return: list of dictionaries with keys sql (fingerprint), count and callers (list of (location, count))
+        """
+        result = [
+            {"sql": sql, "count": pattern["count"], "callers": pattern["callers"].most_common()}
+            for sql, pattern in self.patterns.items() if pattern["count"] > self.threshold
+        ]
+        return sorted(result, key=lambda pattern: pattern["count"], reverse=True)
+
+    def report(self):
+        """Get a human-readable description of the repeated statements."""
+        lines = []
+        for pattern in self.repeated():
+            lines.append(f"{pattern['count']}x {pattern['sql']}")
+            for caller, count in pattern["callers"]:
+                lines.append(f"    {count}x at {caller or 'unknown location'}")
+        return "\n".join(lines)
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+from document import models
+from document.utils import tiering
+
+
+class Throttle:
+    """
+    Limit the rate of reading files shared by several threads (token bucket).
+
+    :param bytes_per_second: float, maximum rate (0 means no limit)
+    """
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self.lock = threading.Lock()
+        self.available = bytes_per_second
+        self.updated_at = time.monotonic()
+
+    def consume(self, n_bytes):
+        if not self.bytes_per_second:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.available = min(self.bytes_per_second,
+                                 self.available + (now - self.updated_at) * self.bytes_per_second)
+            self.updated_at = now
+            self.available -= n_bytes
+            wait = -self.available / self.bytes_per_second if self.available < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def check_document(document, throttle):
+    """
+    Check that the document's file exists and still has the checksum stored when it was uploaded.
+
+    :param document: document model object (with select_related("cold") to save a query)
+    :param throttle: Throttle of reading
+    :return: string, "ok", "missing", "corrupt" or "no_checksum" (the file exists, but no checksum was stored)
+    """
+    storage = document.file.storage
+    entry = getattr(document, "cold", None)
+    if entry is None and (not document.file.name or not storage.exists(document.file.name)):
+        return "missing"
+    for derived in (document.thumbnail, document.linearized):
+        if derived and not storage.exists(derived.name):
+            return "missing"
+    if not document.sha256:
+        return "no_checksum"
+
+    sha256 = hashlib.sha256()
+    try:
+        if entry is not None:
+            # Files in cold storage are checked in their archive (see tiering.py)
+            throttle.consume(entry.length)
+            for chunk in tiering.read_cold(entry):
+                sha256.update(chunk)
+        else:
+            with storage.open(document.file.name, "rb") as fh:
+                for chunk in fh.chunks():
+                    throttle.consume(len(chunk))
+                    sha256.update(chunk)
+    except (FileNotFoundError, EOFError):
+        return "missing"
+    except zlib.error:
+        return "corrupt"
+    return "ok" if sha256.hexdigest() == document.sha256 else "corrupt"
+
+
+def known_files():
+    """Get the names of all files referenced by documents (relative to the storage's root)."""
+    names = set()
+    for files in models.Document.objects.values_list("file", "thumbnail", "linearized").iterator():
+        names.update(name for name in files if name)
+    return names
+
+
+def find_orphans(root, known, exclude=()):
+    """
+    Find files in the directory which aren't referenced by any document, e.g. left by failed deletes.
+
+    :param root: string, MEDIA_ROOT
+    :param known: set of names of referenced files (see known_files)
+    :param exclude: list of directories (absolute) which are not walked, e.g. where the scrubber keeps its files
+    :return: generator of names relative to root
+    """
+    exclude = {os.path.abspath(directory) for directory in exclude}
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories[:] = sorted(name for name in subdirectories
+                                   if os.path.abspath(os.path.join(directory, name)) not in exclude)
+        for filename in sorted(filenames):
+            name = os.path.relpath(os.path.join(directory, filename), root).replace(os.sep, "/")
+            if name not in known:
+                yield name
+
+
+def load_checkpoint(path):
+    """
+    Load the state of an unfinished scrub.
+
+    :param path: string, path of the checkpoint file
+    :return: dictionary with last_id (documents up to it are checked), started_at, counts and problems
+    """
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"last_id": 0, "started_at": time.time(), "counts": {}, "problems": []}
+
+
+def save_checkpoint(path, checkpoint):
+    # Written to a temporary file first, so an interrupted write doesn't lose the previous checkpoint
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as fh:
+        json.dump(checkpoint, fh)
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,270 @@
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from document import models
+from document.utils import metadata, utils
+
+
+logger = logging.getLogger(__name__)
+
+# Changing these makes the stored signatures incomparable, run index_similarity --all afterwards.
+# With 16 bands of 8 rows, pairs of documents with similarity above ~0.7 are likely to share a bucket.
+PERMUTATIONS = 128
+BANDS = 16
+ROWS = PERMUTATIONS // BANDS
+SHINGLE_SIZE = 5
+
+# Shingles are hashed in blocks, so memory doesn't grow with the length of the text
+BLOCK_SIZE = 4096
+
+_SHINGLE_BASE = np.uint64(1000003)
+_SHIFT = np.uint64(32)
+
+# Random odd multipliers and offsets of the hash functions (multiply-shift hashing); the seed is fixed, so
+# signatures computed by different processes can be compared
+_random = np.random.RandomState(20220601)
+_A = _random.randint(1, 2 ** 64 - 1, size=PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_B = _random.randint(0, 2 ** 64 - 1, size=PERMUTATIONS, dtype=np.uint64)
+
+
+def read_text(pdf_path):
+    """
+    Extract the text of the PDF file using pdftotext (poppler-utils).
+
+    :param pdf_path: string, path to the PDF file on the local disk
+    :return: string, text (empty if the file can't be read or has no text, e.g. scans)
+    """
+    try:
+        result = subprocess.run(["pdftotext", "-enc", "UTF-8", "-q", pdf_path, "-"], check=True,
+                                capture_output=True, timeout=120)
+    except FileNotFoundError:
+        logger.warning("pdftotext is not installed, similar documents are not found")
+        return ""
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        logger.warning("Could not extract the text of %s", pdf_path)
+        return ""
+    return result.stdout.decode("utf-8", errors="replace")
+
+
+def shingles(text):
+    """
+    Get the hashes of all sequences of SHINGLE_SIZE consecutive words of the text.
+
+    :param text: string
+    :return: sorted numpy array of unique uint64 hashes
+    """
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    tokens = np.array([zlib.crc32(word.encode("utf-8")) for word in words], dtype=np.uint64)
+    size = min(SHINGLE_SIZE, len(tokens))
+    n = len(tokens) - size + 1
+    hashes = tokens[:n].copy()
+    for i in range(1, size):
+        hashes = hashes * _SHINGLE_BASE + tokens[i:i + n]
+    return np.unique(hashes)
+
+
+def minhash(hashes):
+    """
+    Compute the MinHash signature of a set of shingles; the share of equal values of two signatures estimates
+    the Jaccard similarity of the sets.
+
+    :param hashes: numpy array of uint64 hashes of shingles (see shingles), not empty
+    :return: numpy array of PERMUTATIONS uint32 values
+    """
+    signature = np.full(PERMUTATIONS, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(hashes), BLOCK_SIZE):
+        block = hashes[start:start + BLOCK_SIZE]
+        values = (_A[:, np.newaxis] * block[np.newaxis, :] + _B[:, np.newaxis]) >> _SHIFT
+        np.minimum(signature, values.min(axis=1), out=signature)
+    return signature.astype(np.uint32)
+
+
+def buckets(signature):
+    """
+    Get the locality-sensitive hashing buckets of the signature, one for each band of ROWS values.
+
+    :param signature: numpy array of PERMUTATIONS uint32 values
+    :return: list of BANDS integers (signed 64-bit, for BigIntegerField)
+    """
+    data = signature.astype("<u4")
+    result = []
+    for band in range(BANDS):
+        digest = hashlib.blake2b(bytes([band]) + data[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8)
+        result.append(int.from_bytes(digest.digest(), "big", signed=True))
+    return result
+
+
+def similarity(signature, other):
+    """Estimate the similarity (0 to 1) of texts by their signatures."""
+    return float(np.mean(signature == other))
+
+
+def to_bytes(signature):
+    return signature.astype("<u4").tobytes()
+
+
+def from_bytes(value):
+    return np.frombuffer(bytes(value), dtype="<u4")
+
+
+def signature_of_copy(pdf_path):
+    """
+    Compute the signature of the text of the PDF file.
+
+    :param pdf_path: string, path to the PDF file on the local disk
+    :return: numpy array of PERMUTATIONS uint32 values or None if the file has no text
+    """
+    hashes = shingles(read_text(pdf_path))
+    if not len(hashes):
+        return None
+    return minhash(hashes)
+
+
+def compute_signature(document):
+    """
+    Read the document's file and compute the signature of its text.
+
+    :param document: document model object (with select_related("cold") to save a query)
+    :return: numpy array of PERMUTATIONS uint32 values or None if the file is missing or has no text
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, "document.pdf")
+        try:
+            with open(pdf_path, "wb") as out:
+                for chunk in metadata.read_chunks(document):
+                    out.write(chunk)
+        except FileNotFoundError:
+            logger.warning("File of document %s is missing", document.pk)
+            return None
+        return signature_of_copy(pdf_path)
+
+
+def similar_scores(company_id, document_id, signature):
+    """
+    Compare the signature with the signatures of the company's documents sharing a bucket with it.
+
+    Only documents sharing a bucket are compared, so the time doesn't depend on the number of documents of
+    the company.
+
+    :param company_id: integer, id of the company
+    :param document_id: integer, primary key of the document, which is excluded
+    :param signature: numpy array of PERMUTATIONS uint32 values
+    :return: dictionary of similarities at least SIMILARITY_THRESHOLD by primary key of the document
+    """
+    candidates = models.DocumentSignature.objects.filter(
+        document__company_id=company_id,
+        document__similarity_buckets__bucket__in=buckets(signature),
+    ).exclude(document_id=document_id).distinct().values_list("document_id", "minhash")
+    scores = {}
+    for other_id, other in candidates:
+        score = similarity(signature, from_bytes(other))
+        if score >= settings.SIMILARITY_THRESHOLD:
+            scores[other_id] = score
+    return scores
+
+
+def store_pairs(company_id, document_id, signature):
+    """
+    Store the pairs of the document with the company's documents with similar texts (see near_duplicates).
+
+    :param company_id: integer, id of the company
+    :param document_id: integer, primary key of the document
+    :param signature: numpy array of PERMUTATIONS uint32 values
+    :return: None
+    """
+    models.SimilarPair.objects.filter(Q(first_id=document_id) | Q(second_id=document_id)).delete()
+    models.SimilarPair.objects.bulk_create((
+        models.SimilarPair(company_id=company_id, first_id=min(document_id, other_id),
+                           second_id=max(document_id, other_id), score=score)
+        for other_id, score in similar_scores(company_id, document_id, signature).items()
+    ), ignore_conflicts=True)
+
+
+def store_signature(document_id, signature, bump_version=True):
+    """
+    Store the signature of the document, its buckets and its pairs with similar documents.
+
+    :param document_id: integer, primary key of the document
+    :param signature: numpy array of PERMUTATIONS uint32 values
+    :param bump_version: boolean, whether to change the data version of the company (commands storing many
+        signatures change it once per batch)
+    :return: integer, id of the company of the document or None if the document was deleted
+    """
+    with transaction.atomic():
+        # The document could have been deleted in the meantime
+        company_id = models.Document.objects.select_for_update().filter(pk=document_id).values_list(
+            "company_id", flat=True).first()
+        if company_id is None:
+            return None
+        models.DocumentSignature.objects.update_or_create(document_id=document_id,
+                                                          defaults={"minhash": to_bytes(signature)})
+        models.SimilarityBucket.objects.filter(document_id=document_id).delete()
+        models.SimilarityBucket.objects.bulk_create(
+            models.SimilarityBucket(document_id=document_id, bucket=bucket) for bucket in buckets(signature))
+        store_pairs(company_id, document_id, signature)
+        if bump_version:
+            # Pages listing similar documents are cached by the data version of the company
+            utils.bump_data_version(company_id)
+    return company_id
+
+
+def index_document(document_id):
+    """
+    Compute and store the signature of the document's text, so that its near-duplicates can be found.
+
+    After an upload, uploads.process_upload does this from the copy shared with the other processing of the file.
+
+    :param document_id: integer, primary key of the document
+    :return: None
+    """
+    document = models.Document.objects.select_related("cold").filter(pk=document_id).first()
+    if document is None:
+        return None
+    signature = compute_signature(document)
+    if signature is not None:
+        store_signature(document_id, signature)
+    return None
+
+
+def similar_documents(document, limit=10):
+    """
+    Find the company's documents with a text similar to the document's.
+
+    :param document: document model object
+    :param limit: integer, maximum number of documents
+    :return: list of (document, similarity) tuples, the most similar first
+    """
+    value = models.DocumentSignature.objects.filter(document_id=document.pk).values_list("minhash", flat=True).first()
+    if value is None:
+        return []
+    scores = similar_scores(document.company_id, document.pk, from_bytes(value))
+    if not scores:
+        return []
+
+    ids = sorted(scores, key=lambda pk: -scores[pk])[:limit]
+    documents = models.Document.objects.in_bulk(ids)
+    return [(documents[pk], scores[pk]) for pk in ids if pk in documents]
+
+
+def near_duplicates(company):
+    """
+    Get all pairs of the company's documents with similar texts, stored with their signatures.
+
+    :param company: company model object
+    :return: queryset of SimilarPair objects, the most similar first
+    """
+    return models.SimilarPair.objects.filter(company=company).select_related(
+        "first__category", "second__category").order_by("-score", "first__company_document_id",
+                                                        "second__company_document_id")
@@ -0,0 +1,90 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from document import models
+
+
+def month_key(date):
+    return date.year * 100 + date.month
+
+
+def add(company_id, dimension, key, delta):
+    """
+    Change the number of documents in the statistic.
+
+    :param company_id: integer, id of the company
+    :param dimension: string, one of DocumentStatistic.DIMENSIONS
+    :param key: integer, id of the category, product, user or month as YYYYMM
+    :param delta: integer, change of the number of documents
+    :return: None
+    """
+    statistics = models.DocumentStatistic.objects.filter(company_id=company_id, dimension=dimension, key=key)
+    if statistics.update(count=F("count") + delta):
+        return
+
+    try:
+        with transaction.atomic():
+            models.DocumentStatistic.objects.create(company_id=company_id, dimension=dimension, key=key, count=delta)
+    except IntegrityError:
+        # Created in the meantime by another request
+        statistics.update(count=F("count") + delta)
+
+
+def add_document(document, delta):
+    """
+    Change statistics of the document's category, creator and month and the totals of size and pages
+    (products are counted in m2m signals).
+    """
+    add(document.company_id, "category", document.category_id, delta)
+    add(document.company_id, "creator", document.created_by_id, delta)
+    add(document.company_id, "month", month_key(document.created_at), delta)
+    add_totals(document.company_id, (document.size or 0) * delta, (document.page_count or 0) * delta)
+
+
+def add_totals(company_id, size, pages):
+    """
+    Change the total size and number of pages of the company's documents, e.g. after their metadata is extracted.
+
+    :param company_id: integer, id of the company
+    :param size: integer, change of the total size in bytes
+    :param pages: integer, change of the total number of pages
+    :return: None
+    """
+    if size:
+        add(company_id, "size", 0, size)
+    if pages:
+        add(company_id, "pages", 0, pages)
+
+
+def rebuild(company):
+    """
+    Calculate statistics of the company from scratch.
+
+    :param company: company model object
+    :return: integer, number of statistics
+    """
+    documents = models.Document.objects.filter(company=company).order_by()
+    groupings = {
+        "category": documents.values_list("category_id").annotate(n=Count("id")),
+        "product": documents.filter(product__isnull=False).values_list("product").annotate(n=Count("id")),
+        "creator": documents.values_list("created_by_id").annotate(n=Count("id")),
+        "month": documents.annotate(year=ExtractYear("created_at"), month=ExtractMonth("created_at"))
+                          .values_list("year", "month").annotate(n=Count("id")),
+    }
+
+    statistics = []
+    for dimension, rows in groupings.items():
+        for *key, count in rows:
+            key = key[0] * 100 + key[1] if dimension == "month" else key[0]
+            statistics.append(models.DocumentStatistic(company=company, dimension=dimension, key=key, count=count))
+    totals = documents.aggregate(size=Sum("size"), pages=Sum("page_count"))
+    for dimension in ("size", "pages"):
+        if totals[dimension]:
+            statistics.append(models.DocumentStatistic(company=company, dimension=dimension, key=0,
+                                                       count=totals[dimension]))
+
+    with transaction.atomic():
+        models.DocumentStatistic.objects.filter(company=company).delete()
+        models.DocumentStatistic.objects.bulk_create(statistics)
+    return len(statistics)
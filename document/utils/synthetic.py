@@ -0,0 +1,277 @@
+import csv
+import datetime
+import io
+import os
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, models as db_models, transaction
+from django.db.models import Max
+from django.utils.crypto import get_random_string
+
+from account.models import Profile
+from document import models
+from document.utils import statistics, utils
+
+
+PASSWORD = "synthetic-password"
+FIRST_VALIDITY_START = datetime.date(1900, 1, 1)
+
+WORDS = ["term", "life", "annuity", "pension", "health", "critical", "illness", "unit", "linked", "endowment",
+         "savings", "protection", "mortgage", "group", "funeral", "disability", "income", "care", "whole", "child"]
+CATEGORIES = ["Terms and conditions", "Technical description", "Product sheet", "Pricing basis", "Reserving basis",
+              "Model documentation", "Reinsurance treaty", "Regulatory filing", "Actuarial opinion", "Tariff"]
+
+
+def tiny_pdf():
+    """Get bytes of a valid one-page PDF file (a few hundred bytes)."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (i, obj)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b"%010d 00000 n \n" % offset
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return pdf
+
+
+def phrase(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize()
+
+
+def next_company_names(prefix, n):
+    """Get n names of companies which don't exist yet, e.g. synth1, synth2..."""
+    existing = set(models.Company.objects.filter(name__startswith=prefix).values_list("name", flat=True))
+    names = []
+    i = 1
+    while len(names) < n:
+        name = f"{prefix}{i}"
+        if name not in existing:
+            names.append(name)
+        i += 1
+    return names
+
+
+def split_documents(total, n_companies, skew=0.0):
+    """
+    Split the number of documents between companies.
+
+    With skew 0 all companies get the same number of documents. With a positive skew, the number of documents of
+    the k-th company is proportional to 1 / k^skew, so there are a few large and many small companies.
+
+    :return: list of integers
+    """
+    weights = [1 / (k ** skew) for k in range(1, n_companies + 1)]
+    counts = [int(total * weight / sum(weights)) for weight in weights]
+    counts[0] += total - sum(counts)
+    return counts
+
+
+def copy_value(value):
+    return r"\N" if value is None else value
+
+
+def bulk_insert(model, objects, batch_size=5000):
+    """
+    Insert model objects with COPY on PostgreSQL or with bulk_create on other databases.
+
+    Signals are not sent and primary keys are not set on the objects.
+
+    :param model: model class
+    :param objects: iterable of model objects
+    :param batch_size: integer, number of rows inserted at once
+    :return: None
+    """
+    if connection.vendor != "postgresql":
+        model.objects.bulk_create(objects, batch_size=batch_size)
+        return
+
+    fields = [field for field in model._meta.concrete_fields if not isinstance(field, db_models.AutoField)]
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    table = connection.ops.quote_name(model._meta.db_table)
+    sql = f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for obj in objects:
+        writer.writerow([copy_value(field.get_db_prep_save(field.pre_save(obj, True), connection))
+                         for field in fields])
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(sql, buffer)
+
+
+def next_validity_starts(company, category_ids):
+    """
+    Get the first free validity start date of each category: the day after the latest document of the category, so
+    that (company, category, validity_start) stays unique when documents are added to an existing company.
+
+    :param company: company model object
+    :param category_ids: list of primary keys of the categories
+    :return: dictionary of dates by primary key of the category
+    """
+    latest = dict(models.Document.objects.filter(company=company).values_list("category_id")
+                  .annotate(Max("validity_start")))
+    dates = {}
+    for category_id in category_ids:
+        if category_id not in latest:
+            dates[category_id] = FIRST_VALIDITY_START
+        elif latest[category_id] < datetime.date.max:
+            dates[category_id] = latest[category_id] + datetime.timedelta(days=1)
+        else:
+            dates[category_id] = None
+    return dates
+
+
+def take_validity_start(dates, category_id):
+    """Get the next free validity start date of the category (see next_validity_starts) and reserve it."""
+    date = dates[category_id]
+    if date is None:
+        raise ValueError(f"No free validity start date is left in category {category_id}, "
+                         f"more categories are needed for this number of documents.")
+    dates[category_id] = date + datetime.timedelta(days=1) if date < datetime.date.max else None
+    return date
+
+
+def new_documents(company, batch, rng, category_ids, user_ids, dates):
+    for i in batch:
+        category_id = rng.choice(category_ids)
+        yield models.Document(
+            company=company,
+            company_document_id=i,
+            category_id=category_id,
+            validity_start=take_validity_start(dates, category_id),
+            file=f"{company.name}/{i}/document-{i}.pdf",
+            title=phrase(rng, 4),
+            description=phrase(rng, 12),
+            created_by_id=rng.choice(user_ids),
+        )
+
+
+def create_placeholder_file(path, content, size):
+    """
+    Create a placeholder file of a document.
+
+    Files larger than the content are sparse: the rest of the file doesn't take space on the disk.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fh:
+        fh.write(content)
+        if size > len(content):
+            fh.truncate(size)
+
+
+def generate_company(name, products, categories, documents, users, seed=0, files=True, file_size=0,
+                     batch_size=5000):
+    """
+    Generate products, categories, users and documents of a company using bulk inserts.
+
+    If the company doesn't exist, it is created. Otherwise, the new objects get the next internal ids of the company.
+    Each document has one to three products and validity start dates of each category follow its latest document
+    (from 1900-01-01). Files of documents are tiny PDFs (sparse files of file_size bytes).
+    All users have the password PASSWORD and e-mail addresses user<n>@<company name>.example.com.
+
+    :param name: string, short name of the company
+    :param products: integer, number of products
+    :param categories: integer, number of categories
+    :param documents: integer, number of documents
+    :param users: integer, number of users
+    :param seed: integer, seed of the random generator
+    :param files: boolean, whether to create files of documents under MEDIA_ROOT
+    :param file_size: integer, size of the files in bytes
+    :param batch_size: integer, number of rows inserted at once
+    :return: company model object
+    """
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)
+
+    with transaction.atomic():
+        company, _ = models.Company.objects.get_or_create(
+            name=name, defaults={"full_name": f"{name.capitalize()} Insurance Company",
+                                 "code": get_random_string(length=32)})
+
+        # Internal ids continue after the existing objects of the company
+        first_employee = utils.get_next_company_id(Profile.objects.filter(company=company), "employee_num")
+        first_product = utils.get_next_company_id(models.Product.objects.filter(company=company),
+                                                  "company_product_id")
+        first_category = utils.get_next_company_id(models.Category.objects.filter(company=company),
+                                                   "company_category_id")
+        first_document = utils.get_next_company_id(models.Document.objects.filter(company=company),
+                                                   "company_document_id")
+
+        employee_nums = range(first_employee, first_employee + users)
+        bulk_insert(User, (
+            User(username=f"{name}-{i}", email=f"user{i}@{name}.example.com", first_name=phrase(rng, 1),
+                 last_name=phrase(rng, 1), password=password)
+            for i in employee_nums
+        ), batch_size)
+        user_ids = dict(User.objects.filter(username__in=[f"{name}-{i}" for i in employee_nums])
+                        .values_list("username", "id"))
+        bulk_insert(Profile, (
+            Profile(user_id=user_ids[f"{name}-{i}"], company=company, employee_num=i,
+                    role="admin" if i == 1 else "contributor" if i % 2 == 0 else "viewer")
+            for i in employee_nums
+        ), batch_size)
+        user_ids = list(Profile.objects.filter(company=company).values_list("user_id", flat=True))
+
+        bulk_insert(models.Product, (
+            models.Product(company=company, company_product_id=i, name=phrase(rng, 3), model=f"MOD{i:04d}")
+            for i in range(first_product, first_product + products)
+        ), batch_size)
+        bulk_insert(models.Category, (
+            models.Category(company=company, company_category_id=i, name=f"{CATEGORIES[i % len(CATEGORIES)]} {i}")
+            for i in range(first_category, first_category + categories)
+        ), batch_size)
+        product_ids = list(models.Product.objects.filter(company=company).values_list("id", flat=True))
+        category_ids = list(models.Category.objects.filter(company=company).values_list("id", flat=True))
+
+        pdf = tiny_pdf()
+        dates = next_validity_starts(company, category_ids)
+        last_document = first_document + documents
+        for batch_start in range(first_document, last_document, batch_size):
+            batch = range(batch_start, min(batch_start + batch_size, last_document))
+            bulk_insert(models.Document, new_documents(company, batch, rng, category_ids, user_ids, dates), batch_size)
+
+            document_ids = models.Document.objects.filter(
+                company=company, company_document_id__gte=batch.start, company_document_id__lt=batch.stop
+            ).values_list("id", flat=True)
+            bulk_insert(models.Document.product.through, (
+                models.Document.product.through(document_id=document_id, product_id=product_id)
+                for document_id in document_ids
+                for product_id in rng.sample(product_ids, min(len(product_ids), rng.randint(1, 3)))
+            ), batch_size)
+
+            if files:
+                for i in batch:
+                    path = os.path.join(settings.MEDIA_ROOT, name, str(i), f"document-{i}.pdf")
+                    create_placeholder_file(path, pdf, file_size)
+
+        # Bulk inserts don't send signals
+        statistics.rebuild(company)
+        utils.bump_data_version(company.pk)
+
+    return company
+
+
+def generate_company_task(name, options):
+    """
+    Generate the company in a worker process.
+
+    :param name: string, short name of the company
+    :param options: dictionary of keyword arguments of generate_company()
+    :return: tuple of the name and the time of the generation in seconds
+    """
+    start = time.perf_counter()
+    generate_company(name, **options)
+    return name, time.perf_counter() - start
@@ -0,0 +1,66 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def init_worker():
+    """Set up Django in a freshly spawned worker process."""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "actudoc.settings")
+    import django
+    django.setup()
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error("Background task failed", exc_info=future.exception())
+
+
+def get_executor():
+    """
+    Get the process pool used for background processing of uploaded files.
+
+    Workers are spawned rather than forked so that they don't share database connections with the web process.
+
+    :return: ProcessPoolExecutor
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.BACKGROUND_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+        )
+    return _executor
+
+
+def submit_on_commit(func, *args):
+    """
+    Run a task in the background process pool after the current transaction is committed.
+
+    The task is a module-level function that receives primary keys, so that it reads committed data.
+    If BACKGROUND_WORKERS is 0, the task is run in the current process (useful in development).
+
+    :param func: module-level function to run
+    :param args: picklable arguments of the function
+    :return: None
+    """
+    def submit():
+        if settings.BACKGROUND_WORKERS == 0:
+            try:
+                func(*args)
+            except Exception:
+                logger.exception("Background task failed")
+        else:
+            future = get_executor().submit(func, *args)
+            future.add_done_callback(_log_failure)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,71 @@
+import logging
+import os
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+
+logger = logging.getLogger(__name__)
+
+
+def thumbnail_path(document, sha256):
+    """
+    Get the path of the thumbnail; it is stored next to the document's file (see document_path).
+
+    The checksum is part of the name, so that the browser never shows a thumbnail of a previous file.
+
+    :param document: document model object
+    :param sha256: string, checksum of the document's file
+    :return: string, path relative to MEDIA_ROOT
+    """
+    return f"{os.path.dirname(document.file.name)}/thumbnail-{sha256[:12]}.png"
+
+
+def render_first_page(pdf_path, width):
+    """
+    Render the first page of the PDF file as PNG using pdftoppm (poppler-utils).
+
+    :param pdf_path: string, path to the PDF file on the local disk
+    :param width: integer, width of the image in pixels
+    :return: bytes of the PNG image or None if the page can't be rendered
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_prefix = os.path.join(tmp_dir, "thumbnail")
+        command = ["pdftoppm", "-png", "-singlefile", "-f", "1", "-l", "1", "-scale-to-x", str(width),
+                   "-scale-to-y", "-1", pdf_path, output_prefix]
+        try:
+            subprocess.run(command, check=True, capture_output=True, timeout=60)
+        except FileNotFoundError:
+            logger.warning("pdftoppm is not installed, thumbnails are not generated")
+            return None
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            logger.warning("Could not render the first page of %s", pdf_path)
+            return None
+
+        with open(output_prefix + ".png", "rb") as fh:
+            return fh.read()
+
+
+def update_thumbnail(document, pdf_path, sha256):
+    """
+    Render the thumbnail of the document's first page from a local copy of its file.
+
+    Called by metadata.metadata_of_copy with the copy made for the metadata and its checksum.
+    The thumbnail is regenerated only if the checksum of the file has changed.
+
+    :param document: document model object
+    :param pdf_path: string, path to the copy of the document's file on the local disk
+    :param sha256: string, checksum of the file
+    :return: string, name of the thumbnail in the storage (empty if the page can't be rendered)
+    """
+    if sha256 == document.sha256 and document.thumbnail and document.thumbnail.storage.exists(document.thumbnail.name):
+        return document.thumbnail.name
+
+    image = render_first_page(pdf_path, settings.THUMBNAIL_WIDTH)
+    if document.thumbnail:
+        document.thumbnail.delete(save=False)
+    if image is None:
+        return ""
+    return document.thumbnail.storage.save(thumbnail_path(document, sha256), ContentFile(image))
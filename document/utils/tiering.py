@@ -0,0 +1,310 @@
+import datetime
+import functools
+import os
+import tempfile
+import zlib
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q, Sum
+from django.utils import timezone
+
+from document import models
+from document.storage import S3Storage
+from document.utils import linearize, tasks
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def candidates(days, company=None):
+    """
+    Get documents to move to cold storage: superseded by a newer one in the same category and not downloaded
+    (or uploaded, if never downloaded) for the number of days.
+
+    :param days: integer, number of days
+    :param company: company model object or None for all companies
+    :return: queryset
+    """
+    since = timezone.now() - datetime.timedelta(days=days)
+    newer = models.Document.objects.filter(company=OuterRef("company"), category=OuterRef("category"),
+                                           validity_start__gt=OuterRef("validity_start"))
+    documents = models.Document.objects.filter(Exists(newer), cold__isnull=True, created_at__lt=since)
+    documents = documents.filter(Q(last_accessed_at__isnull=True) | Q(last_accessed_at__lt=since))
+    if company is not None:
+        documents = documents.filter(company=company)
+    return documents.order_by("id")
+
+
+@functools.lru_cache(maxsize=None)
+def _archive_storage(bucket, directory):
+    if bucket:
+        return S3Storage(bucket=bucket)
+    return FileSystemStorage(location=directory)
+
+
+def archive_storage():
+    """
+    Get the storage of the archives: the bucket COLD_STORAGE_BUCKET of the object store if it's set, so that all
+    nodes read the same archives, otherwise the directory COLD_STORAGE_DIR.
+    """
+    return _archive_storage(settings.COLD_STORAGE_BUCKET, settings.COLD_STORAGE_DIR)
+
+
+def sync_archive(storage, name):
+    """Make sure that the archive is on the disk before the documents point to it and their files are deleted."""
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        # The object store has the archive once it's saved
+        return
+    with open(path, "rb") as fh:
+        os.fsync(fh.fileno())
+
+
+def new_archive_name():
+    return timezone.now().strftime("%Y%m%d-%H%M%S-%f") + ".gz"
+
+
+def compress(fh, out):
+    """
+    Append the file to the archive as a gzip member.
+
+    :param fh: file object open for reading
+    :param out: archive file open for appending
+    :return: tuple of the compressed length and the original size
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    length = size = 0
+    for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+        size += len(chunk)
+        data = compressor.compress(chunk)
+        out.write(data)
+        length += len(data)
+    data = compressor.flush()
+    out.write(data)
+    return length + len(data), size
+
+
+def save_archive(entries, out):
+    """
+    Save the archive built in the temporary file to the storage of archives and point the entries to it.
+
+    :param entries: list of ColdDocument model objects (not saved) with offsets in the archive
+    :param out: temporary file with the archive
+    :return: string, name of the archive
+    """
+    storage = archive_storage()
+    out.flush()
+    archive = storage.save(new_archive_name(), File(out))
+    sync_archive(storage, archive)
+    for entry in entries:
+        entry.archive = archive
+    return archive
+
+
+def move_to_cold(documents, max_archive_size):
+    """
+    Pack files of the documents into archives in the storage of archives and delete them from the storage of
+    documents.
+
+    The archive is saved before the documents point to it and their files are deleted, so an interruption at any
+    point loses no file.
+
+    :param documents: iterable of document model objects
+    :param max_archive_size: integer, bytes after which a new archive is started
+    :return: integer, number of moved documents
+    """
+    moved = 0
+    documents = iter(documents)
+    while True:
+        entries = []
+        with tempfile.NamedTemporaryFile(suffix=".gz") as out:
+            for document in documents:
+                try:
+                    fh = document.file.storage.open(document.file.name, "rb")
+                except FileNotFoundError:
+                    continue
+                with fh:
+                    offset = out.tell()
+                    length, size = compress(fh, out)
+                entries.append(models.ColdDocument(document=document, offset=offset, length=length, size=size))
+                if out.tell() >= max_archive_size:
+                    break
+            if not entries:
+                return moved
+            save_archive(entries, out)
+
+        # Linearized copies can be made again after a promotion, so they are deleted as well
+        with transaction.atomic():
+            models.ColdDocument.objects.bulk_create(entries)
+            models.Document.objects.filter(pk__in=[entry.document.pk for entry in entries]).update(linearized="")
+        for entry in entries:
+            document = entry.document
+            document.file.storage.delete(document.file.name)
+            if document.linearized:
+                document.linearized.storage.delete(document.linearized.name)
+        moved += len(entries)
+
+
+def read_compressed(entry):
+    """
+    Read the compressed file of the entry (a gzip member) from its archive, in chunks.
+
+    Only this part of the archive is downloaded from the object store. The archive is opened right away, so the
+    file can be read to the end even if the archive is deleted in the meantime (the last document was promoted or
+    the archive was repacked).
+
+    :param entry: ColdDocument model object
+    :return: generator of bytes
+    """
+    storage = archive_storage()
+    if isinstance(storage, S3Storage):
+        chunks = storage.read_range(entry.archive, entry.offset, entry.length, CHUNK_SIZE)
+    else:
+        fh = storage.open(entry.archive, "rb")
+        fh.seek(entry.offset)
+        chunks = read_file_range(fh, entry.length)
+    return check_length(chunks, entry)
+
+
+def read_file_range(fh, length):
+    with fh:
+        while length:
+            chunk = fh.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+def check_length(chunks, entry):
+    remaining = entry.length
+    for chunk in chunks:
+        remaining -= len(chunk)
+        yield chunk
+    if remaining:
+        raise EOFError(f"Archive {entry.archive} is truncated.")
+
+
+def read_cold(entry):
+    """
+    Read the document's file from its archive, decompressed in chunks.
+
+    :param entry: ColdDocument model object
+    :return: generator of bytes (see read_compressed)
+    """
+    return decompress(read_compressed(entry))
+
+
+def decompress(chunks):
+    decompressor = zlib.decompressobj(31)
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+def delete_archive_if_unused(archive):
+    """
+    Delete the archive once no document is stored in it, e.g. after all its documents were promoted or deleted.
+
+    :param archive: string, name of the archive
+    :return: boolean, whether the archive was deleted
+    """
+    if models.ColdDocument.objects.filter(archive=archive).exists():
+        return False
+    archive_storage().delete(archive)
+    return True
+
+
+def compact_archives(min_live_share):
+    """
+    Repack archives in which documents which were promoted or deleted take too much space: the files of the
+    remaining documents are copied (still compressed) to a new archive and the old archive is deleted.
+
+    :param min_live_share: float, archives in which the remaining documents take less than this share are repacked
+    :return: integer, number of repacked archives
+    """
+    storage = archive_storage()
+    live = models.ColdDocument.objects.values("archive").annotate(length=Sum("length")).order_by("archive")
+    repacked = 0
+    for row in live:
+        try:
+            size = storage.size(row["archive"])
+        except FileNotFoundError:
+            continue
+        if not size or row["length"] / size >= min_live_share:
+            continue
+
+        entries = list(models.ColdDocument.objects.filter(archive=row["archive"]).order_by("offset"))
+        with tempfile.NamedTemporaryFile(suffix=".gz") as out:
+            for entry in entries:
+                offset = out.tell()
+                for chunk in read_compressed(entry):
+                    out.write(chunk)
+                entry.offset = offset
+            save_archive(entries, out)
+
+        # Documents promoted or deleted in the meantime aren't updated
+        with transaction.atomic():
+            for entry in entries:
+                models.ColdDocument.objects.filter(pk=entry.pk, archive=row["archive"]).update(
+                    archive=entry.archive, offset=entry.offset)
+        delete_archive_if_unused(row["archive"])
+        delete_archive_if_unused(entries[0].archive)
+        repacked += 1
+    return repacked
+
+
+def record_access(document):
+    """
+    Record a download of the document; documents of cold storage downloaded COLD_PROMOTE_ACCESSES times
+    within COLD_PROMOTE_DAYS are promoted back in the background.
+
+    The time of the last access is only updated once a day, so downloads don't write to the database each time.
+
+    :param document: document model object
+    :return: None
+    """
+    now = timezone.now()
+    if document.last_accessed_at is None or document.last_accessed_at < now - datetime.timedelta(days=1):
+        models.Document.objects.filter(pk=document.pk).update(last_accessed_at=now)
+
+    entry = getattr(document, "cold", None)
+    if entry is None:
+        return None
+    window_start = now - datetime.timedelta(days=settings.COLD_PROMOTE_DAYS)
+    in_window = entry.accessed_at is not None and entry.accessed_at >= window_start
+    models.ColdDocument.objects.filter(pk=entry.pk).update(accesses=F("accesses") + 1 if in_window else 1,
+                                                           accessed_at=now)
+    if (entry.accesses + 1 if in_window else 1) >= settings.COLD_PROMOTE_ACCESSES:
+        tasks.submit_on_commit(promote, document.pk)
+    return None
+
+
+def promote(document_id):
+    """
+    Move the document's file from cold storage back to the storage of documents.
+
+    The archive is deleted when its last document is promoted (see signals.py), otherwise its space is reclaimed
+    by compact_archives.
+
+    :param document_id: integer, primary key of the document
+    :return: None
+    """
+    entry = models.ColdDocument.objects.select_related("document").filter(document_id=document_id).first()
+    if entry is None:
+        return None
+
+    document = entry.document
+    storage = document.file.storage
+    if not storage.exists(document.file.name):
+        name = storage.save(document.file.name, ContentFile(b"".join(read_cold(entry))))
+        if name != document.file.name:
+            models.Document.objects.filter(pk=document.pk).update(file=name)
+    entry.delete()
+    if settings.LINEARIZE_PDFS:
+        linearize.linearize_document(document_id)
+    return None
@@ -0,0 +1,43 @@
+import logging
+
+from django.conf import settings
+
+from document import models
+from document.utils import linearize, metadata, similarity, utils
+
+
+logger = logging.getLogger(__name__)
+
+
+def process_upload(document_id):
+    """
+    Process the uploaded file of the document: store its metadata and thumbnail, the signature of its text and
+    (with LINEARIZE_PDFS) its linearized copy.
+
+    The file is read from the storage once, to a local copy used by all of them. Runs in the background process
+    pool after the upload (see tasks.submit_on_commit).
+
+    :param document_id: integer, primary key of the document
+    :return: None
+    """
+    document = models.Document.objects.select_related("cold").filter(pk=document_id).first()
+    if document is None:
+        return None
+    try:
+        with metadata.local_copy(document) as (pdf_path, sha256, size):
+            values = metadata.metadata_of_copy(document, pdf_path, sha256, size)
+            company_id = metadata.store_metadata(document_id, values, bump_version=False)
+            if company_id is None:
+                return None
+            signature = similarity.signature_of_copy(pdf_path)
+            if signature is not None:
+                similarity.store_signature(document_id, signature, bump_version=False)
+            # Pages showing the metadata and similar documents are cached by the data version of the company
+            utils.bump_data_version(company_id)
+            if settings.LINEARIZE_PDFS:
+                name = linearize.linearize_copy(document, pdf_path)
+                if name is not None:
+                    linearize.store_linearized(document, name)
+    except FileNotFoundError:
+        logger.warning("File of document %s is missing", document_id)
+    return None
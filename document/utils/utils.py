@@ -1,6 +1,23 @@
-from django.core.files.storage import Storage
+import base64
+import binascii
+import functools
+import hashlib
+import json
+import operator
+import os
+import re
+import threading
+
+from django.contrib import messages
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db.models import F, Q
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.views.decorators.http import condition
 
 from document import models
+from document.utils import tiering
 
 
 def search(phrase, company):
@@ -39,25 +56,222 @@ def search(phrase, company):
     return documents
 
 
-def get_filename_msg(saved_filename, sent_filename, company_name):
+def get_filename_msg(saved_filename, sent_filename):
     """
     Get informational message about the changes to the filename.
 
     :param saved_filename: string, filename save on the disk
     :param sent_filename: string, filename sent in the form
-    :param company_name: string, short name of the company
     :return: string, message
     """
-    text = f"The file has been saved as {saved_filename}."
+    return f"The file has been saved as {saved_filename} instead of {sent_filename}."
+
+
+def get_duplicate_msg(document):
+    """
+    Get a warning if the company already has a document with the same file (by the checksum of its content).
+
+    :param document: document model object with sha256
+    :return: string, message or None
+    """
+    if not document.sha256:
+        return None
+    duplicate = models.Document.objects.filter(company_id=document.company_id, sha256=document.sha256).exclude(
+        pk=document.pk).values_list("company_document_id", flat=True).first()
+    if duplicate is None:
+        return None
+    return f"This exact file is already document #{duplicate}."
+
+
+def parse_range(header, size):
+    """
+    Parse the Range header of a request; only a single range of bytes is supported.
+
+    :param header: string or None, value of the header
+    :param size: integer, size of the file
+    :return: tuple of the first and the last byte (inclusive) or None to send the whole file
+    :raise ValueError: the range is outside the file
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip()) if header else None
+    if match is None or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if size == 0:
+        raise ValueError("Empty file.")
+    if first == "":
+        if int(last) == 0:
+            raise ValueError("Empty range.")
+        return max(0, size - int(last)), size - 1
+    if int(first) >= size or (last and int(last) < int(first)):
+        raise ValueError("Range outside the file.")
+    return int(first), min(int(last), size - 1) if last else size - 1
+
+
+def read_range(fh, start, length):
+    try:
+        fh.seek(start)
+        while length > 0:
+            chunk = fh.read(min(length, 64 * 1024))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        fh.close()
+
+
+def file_etag(document, name, size):
+    """
+    Get the ETag of the document's file as it is served: the original and its linearized copy have different
+    tags, so a range of one is never combined with ranges of the other.
+
+    :param document: document model object
+    :param name: string, name of the served file in the storage
+    :param size: integer, size of the served file
+    :return: string, quoted strong ETag
+    """
+    return '"' + hashlib.md5(f"{document.sha256}:{name}:{size}".encode()).hexdigest() + '"'
+
+
+def document_file_response(request, document):
+    """
+    Response with the document's file: streamed from cold storage if it was moved there, a redirect to
+    a presigned URL if the storage is an object store, otherwise streamed from the storage.
+
+    The linearized copy is sent if there is one (see linearize.py). Range requests are supported, so PDF
+    viewers can show the first page before the whole file is downloaded; a range is sent only if If-Range
+    (if any) matches the ETag of the served file, otherwise the whole file is sent.
+    The download is recorded for the tiering of documents (see tiering.record_access).
+
+    :param request: request
+    :param document: document model object (with select_related("cold") to save a query)
+    :return: response
+    """
+    mime_type = "application/pdf"
+    filename = os.path.basename(document.file.name)
+    tiering.record_access(document)
+    entry = getattr(document, "cold", None)
+    if entry is not None:
+        response = StreamingHttpResponse(tiering.read_cold(entry), content_type=mime_type)
+        response["Content-Length"] = entry.size
+        response["Content-Disposition"] = "inline; filename=" + filename
+        response["ETag"] = file_etag(document, document.file.name, entry.size)
+        return response
+
+    storage = document.file.storage
+    names = [document.linearized.name, document.file.name] if document.linearized else [document.file.name]
+    if hasattr(storage, "presigned_download_url"):
+        return HttpResponseRedirect(storage.presigned_download_url(names[0], mime_type, filename))
+
+    for name in names:
+        try:
+            size = storage.size(name)
+            fh = storage.open(name, "rb")
+            break
+        except FileNotFoundError:
+            continue
+    else:
+        raise Http404
+
+    etag = file_etag(document, name, size)
+    range_header = request.headers.get("Range")
+    if request.headers.get("If-Range", etag) != etag:
+        # The file has changed since the client got its part, e.g. the linearized copy replaced the original
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        fh.close()
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    if byte_range is None:
+        response = FileResponse(fh, content_type=mime_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_range(fh, start, end - start + 1), status=206, content_type=mime_type)
+        response["Content-Length"] = end - start + 1
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Accept-Ranges"] = "bytes"
+    response["Content-Disposition"] = "inline; filename=" + filename
+    response["ETag"] = etag
+    return response
+
+
+def get_next_company_id(queryset, field_name):
+    """
+    Get the next internal id within the company (e.g. company_document_id).
+
+    :param queryset: queryset of company's objects
+    :param field_name: string, name of the field with the internal id
+    :return: integer, the next id
+    """
+    try:
+        latest = queryset.latest(field_name)
+        return getattr(latest, field_name) + 1
+    except queryset.model.DoesNotExist:
+        return 1
+
+
+def encode_keyset_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_keyset_cursor(cursor, n_values):
+    """Decode the cursor of keyset pagination, returning None if it's invalid."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != n_values:
+        return None
+    if not all(value is None or isinstance(value, (str, int, float)) for value in values):
+        return None
+    return values
+
+
+def keyset_paginate(queryset, ordering, cursor, page_size):
+    """
+    Get a page of objects which follow the cursor in the given ordering (keyset pagination).
+
+    Unlike OFFSET pagination, the database seeks directly to the first object of the page,
+    so late pages are as fast as the first one. The ordering must be unique, e.g. end with a unique field.
+
+    :param queryset: queryset
+    :param ordering: list of field names (with "-" for descending order, "__" for related fields)
+    :param cursor: string, cursor of the page from the previous page or None for the first page
+    :param page_size: integer, number of objects per page
+    :return: tuple of the list of objects and the cursor of the next page (None if it's the last page)
+    """
+    values = decode_keyset_cursor(cursor, len(ordering)) if cursor else None
+    if values is not None:
+        # (a, b, c) > (x, y, z) is a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        conditions = []
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            conditions.append(equal & Q(**{f"{name}__{lookup}": value}))
+            equal &= Q(**{name: value})
+        try:
+            queryset = queryset.filter(functools.reduce(operator.or_, conditions))
+        except (TypeError, ValueError, ValidationError):
+            # Values of the wrong type for the fields, the cursor is invalid
+            pass
 
-    valid_sent_filename = Storage().get_valid_name(sent_filename)
-    sent_filepath = company_name + "/" + valid_sent_filename
-    if models.Document.objects.filter(file=sent_filepath).exists():
-        document = models.Document.objects.get(file=sent_filepath)
-        text += f" File with the name {valid_sent_filename} is already associated with " \
-                f"the document #{document.company_document_id}."
+    objects = list(queryset.order_by(*ordering)[:page_size + 1])
+    if len(objects) <= page_size:
+        return objects, None
 
-    return text
+    objects = objects[:page_size]
+    last = []
+    for field in ordering:
+        value = objects[-1]
+        for attribute in field.lstrip("-").split("__"):
+            value = getattr(value, attribute)
+        last.append(value)
+    return objects, encode_keyset_cursor(last)
 
 
 def user_is_contributor_or_admin(request):
@@ -66,5 +280,126 @@ def user_is_contributor_or_admin(request):
     return user_is_contributor or user_is_admin
 
 
+_company_ids = {}
+_company_ids_lock = threading.Lock()
+
+
+def get_company_id(company_name):
+    """
+    Get the id of the company from the process-local map of company names, querying the company on a miss.
+
+    The map is cleared when a company is saved or deleted (see signals.py).
+
+    :param company_name: string, name of the company (from url)
+    :return: integer or None if there is no such company
+    """
+    company_id = _company_ids.get(company_name)
+    if company_id is None:
+        company_id = models.Company.objects.filter(name=company_name).values_list("id", flat=True).first()
+        if company_id is not None:
+            with _company_ids_lock:
+                _company_ids[company_name] = company_id
+    return company_id
+
+
+def forget_company_ids():
+    with _company_ids_lock:
+        _company_ids.clear()
+
+
+def forget_company_id(company_name):
+    with _company_ids_lock:
+        _company_ids.pop(company_name, None)
+
+
 def user_is_employee(request, company_name):
-    return request.user.profile.company.name == company_name
+    """
+    Check that the request user is an employee of the company from url.
+
+    A company from the map which isn't the user's one might be outdated by a change in another process (e.g. the
+    company was renamed and another one got its name), so the name is resolved again before denying access.
+    """
+    company_id = get_company_id(company_name)
+    if company_id is not None and company_id != request.user.profile.company_id:
+        forget_company_id(company_name)
+        company_id = get_company_id(company_name)
+    return company_id is not None and company_id == request.user.profile.company_id
+
+
+def get_company_object(request, queryset, company_name, **lookup):
+    """
+    Get the object of the company from url, checking that the request user is an employee of the company.
+
+    The company is resolved from the map of company names, so only the object itself is queried (with its
+    company joined). The name is checked in the same query, so a map outdated by a change in another process
+    gives 404 instead of another company's object.
+
+    :param request: request
+    :param queryset: model or queryset of objects with a company
+    :param company_name: string, name of the company (from url)
+    :param lookup: id of the object within the company, e.g. company_document_id=1
+    :return: model object
+    """
+    if not user_is_employee(request, company_name):
+        raise PermissionDenied
+    company_id = request.user.profile.company_id
+
+    queryset = queryset.objects.all() if hasattr(queryset, "objects") else queryset
+    try:
+        return get_object_or_404(queryset.select_related("company"), company_id=company_id,
+                                 company__name=company_name, **lookup)
+    except Http404:
+        # The company might have been renamed in another process
+        forget_company_id(company_name)
+        raise
+
+
+def bump_data_version(company_id):
+    """
+    Increase the data version of the company; it's done after each change to the company's data.
+
+    :param company_id: integer, id of the company
+    :return: None
+    """
+    if company_id is not None:
+        models.Company.objects.filter(pk=company_id).update(data_version=F("data_version") + 1,
+                                                            data_updated_at=timezone.now())
+
+
+def touch_documents(documents):
+    """
+    Mark documents as updated, e.g. after renaming their product; cached cards of these documents become stale.
+
+    :param documents: queryset of documents
+    :return: None
+    """
+    documents.update(updated_at=timezone.now())
+
+
+def company_data_is_conditional(request):
+    """Pages with pending messages are always rendered, so that messages are not lost."""
+    return request.user.is_authenticated and len(messages.get_messages(request)) == 0
+
+
+def company_data_etag(request, *args, **kwargs):
+    """
+    ETag of pages which show only the data of the request user's company.
+
+    The page depends on the company's data and on the request user (name and role in the navigation bar).
+
+    :param request: request
+    :return: string or None
+    """
+    if not company_data_is_conditional(request):
+        return None
+    company = request.user.profile.company
+    return f"{company.pk}-{company.data_version}-{request.user.pk}"
+
+
+def company_data_last_modified(request, *args, **kwargs):
+    if not company_data_is_conditional(request):
+        return None
+    return request.user.profile.company.data_updated_at
+
+
+company_data_condition = condition(etag_func=company_data_etag, last_modified_func=company_data_last_modified)
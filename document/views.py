@@ -1,18 +1,23 @@
 import os
+import re
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.contrib.auth.models import User
 from django.contrib.messages.views import SuccessMessageMixin
 from django.core.exceptions import PermissionDenied
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, FileResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.cache import cache_control
 
 from document import models
 from document import forms
-from document.utils import utils
+from document.utils import facets, metrics, profiler, similarity, tasks, uploads, utils
 
 
 class MainView(LoginRequiredMixin, View):
@@ -20,11 +25,14 @@ class MainView(LoginRequiredMixin, View):
     Home page of the application.
 
     Shows ten newest documents in reverse-chronological order of company's documents.
-    Allows searching documents using a phrase.
+    Allows searching documents using a phrase and narrowing the results by product, category, year of validity
+    start and creator, with the number of results for each of them.
 
     Access company: filtering of objects based on request user's company
     Access roles: all
     """
+    read_from_replica = True
+
     def get(self, request):
         company = request.user.profile.company
         documents = models.Document.objects.filter(company=company)
@@ -48,7 +56,30 @@ class MainView(LoginRequiredMixin, View):
             category = get_object_or_404(models.Category, company=company, company_category_id=company_category_id)
             documents = documents.filter(category=category)
 
+        # User can search documents by year of validity start and by creator
+        year = request.GET.get("year")
+        if year:
+            # str.isdigit() also accepts digits which int() doesn't parse, e.g. "²"
+            if not re.fullmatch(r"[0-9]+", year) or not 1 <= int(year) <= 9999:
+                raise Http404("Invalid year.")
+            documents = documents.filter(validity_start__year=int(year))
+        employee_num = request.GET.get("creator")
+        if employee_num:
+            if not re.fullmatch(r"[0-9]+", employee_num):
+                raise Http404("Invalid creator.")
+            creator = get_object_or_404(User, profile__company=company, profile__employee_num=employee_num)
+            documents = documents.filter(created_by=creator)
+
+        # Counts of the results by product, category, year and creator are links which narrow the results further
+        # (the latest documents aren't counted, the statistics page has the counts of all documents)
+        selected = {"product": company_product_id, "category": company_category_id, "year": year,
+                    "creator": employee_num}
+        facet_filters = []
+        if phrase or any(selected.values()):
+            facet_filters = facets.options(company, facets.counts(documents), selected, request.GET)
+
         # Documents are split by pages
+        documents = documents.select_related("category").prefetch_related("product")
         paginator = Paginator(documents, 16)
         page = request.GET.get("page")
 
@@ -59,12 +90,19 @@ class MainView(LoginRequiredMixin, View):
         except EmptyPage:
             documents = paginator.page(paginator.num_pages)
 
+        # Links to other pages keep the phrase and the filters
+        params = request.GET.copy()
+        params.pop("page", None)
+
         ctx = {
             "page": page,
             "documents": documents,
             "phrase": phrase,
             "product": product,
             "category": category,
+            "facets": facet_filters,
+            "query_string": params.urlencode() + "&" if params else "",
+            "fragment_cache_timeout": settings.FRAGMENT_CACHE_TIMEOUT,
         }
         return render(request, "document/main.html", ctx)
 
@@ -76,11 +114,85 @@ class ManageView(LoginRequiredMixin, View):
     Access company: filtering of objects
     Access role: all can access but only contributors and admins have active links to edit/delete
     """
+    read_from_replica = True
+
+    @method_decorator(cache_control(private=True, no_cache=True))
+    @method_decorator(utils.company_data_condition)
     def get(self, request):
         company = self.request.user.profile.company
         categories = models.Category.objects.filter(company=company)
         products = models.Product.objects.filter(company=company)
-        return render(request, "document/manage.html", {"categories": categories, "products": products})
+        ctx = {
+            "categories": categories,
+            "products": products,
+            "data_version": company.data_version,
+            "fragment_cache_timeout": settings.FRAGMENT_CACHE_TIMEOUT,
+        }
+        return render(request, "document/manage.html", ctx)
+
+
+class StatisticsView(LoginRequiredMixin, View):
+    """
+    Number of company's documents by category, product, creator and month, and their total size and pages.
+
+    Reads only the precomputed statistics (and names of their categories, products and users),
+    so the page doesn't depend on the number of documents.
+
+    Access company: filtering of objects
+    Access roles: all
+    """
+    @method_decorator(cache_control(private=True, no_cache=True))
+    @method_decorator(utils.company_data_condition)
+    def get(self, request):
+        company = request.user.profile.company
+        rows = models.DocumentStatistic.objects.filter(company=company, count__gt=0).values_list(
+            "dimension", "key", "count")
+
+        counts = {dimension: {} for dimension, _ in models.DocumentStatistic.DIMENSIONS}
+        for dimension, key, count in rows:
+            counts[dimension][key] = count
+
+        products = models.Product.objects.filter(company=company, pk__in=counts["product"])
+        categories = models.Category.objects.filter(company=company, pk__in=counts["category"])
+        users = User.objects.filter(pk__in=counts["creator"])
+        ctx = {
+            "total": sum(counts["category"].values()),
+            "total_size": counts["size"].get(0, 0),
+            "total_pages": counts["pages"].get(0, 0),
+            "by_category": sorted(((c.name, counts["category"][c.pk]) for c in categories), key=lambda x: -x[1]),
+            "by_product": sorted(((str(p), counts["product"][p.pk]) for p in products), key=lambda x: -x[1]),
+            "by_creator": sorted(((str(u), counts["creator"][u.pk]) for u in users), key=lambda x: -x[1]),
+            "by_month": [(f"{key // 100}-{key % 100:02d}", count) for key, count in sorted(counts["month"].items(),
+                                                                                          reverse=True)],
+        }
+        return render(request, "document/statistics.html", ctx)
+
+
+class NearDuplicatesView(LoginRequiredMixin, View):
+    """
+    Pairs of company's documents with nearly the same text, e.g. re-issued terms which differ by a date.
+
+    Access company: filtering of objects
+    Access roles: all
+    """
+    @method_decorator(cache_control(private=True, no_cache=True))
+    @method_decorator(utils.company_data_condition)
+    def get(self, request):
+        company = request.user.profile.company
+        # Pairs are stored with the signatures (see similarity.store_pairs) and split by pages
+        paginator = Paginator(similarity.near_duplicates(company), 50)
+        try:
+            pairs = paginator.page(request.GET.get("page"))
+        except PageNotAnInteger:
+            pairs = paginator.page(1)
+        except EmptyPage:
+            pairs = paginator.page(paginator.num_pages)
+
+        ctx = {
+            "pairs": pairs,
+            "threshold": settings.SIMILARITY_THRESHOLD,
+        }
+        return render(request, "document/near_duplicates.html", ctx)
 
 
 class AddProductView(LoginRequiredMixin, UserPassesTestMixin, View):
@@ -103,11 +215,8 @@ class AddProductView(LoginRequiredMixin, UserPassesTestMixin, View):
         form = forms.ProductForm(request.POST)
         if form.is_valid():
             company = request.user.profile.company
-            try:
-                latest_product = models.Product.objects.filter(company=company).latest("company_product_id")
-                company_product_id = latest_product.company_product_id + 1
-            except models.Product.DoesNotExist:
-                company_product_id = 1
+            company_product_id = utils.get_next_company_id(models.Product.objects.filter(company=company),
+                                                           "company_product_id")
 
             name = form.cleaned_data["name"]
             model = form.cleaned_data["model"]
@@ -133,24 +242,16 @@ class EditProductView(LoginRequiredMixin, UserPassesTestMixin, SuccessMessageMix
     def test_func(self):
         return utils.user_is_contributor_or_admin(self.request)
 
-    def instance(self, company_name, company_product_id):
-        company = get_object_or_404(models.Company, name=company_name)
-        product = get_object_or_404(models.Product, company=company, company_product_id=company_product_id)
-        return product
+    def instance(self, request, company_name, company_product_id):
+        return utils.get_company_object(request, models.Product, company_name, company_product_id=company_product_id)
 
     def get(self, request, company_name, company_product_id):
-        if not utils.user_is_employee(request, company_name):
-            raise PermissionDenied
-
-        product = self.instance(company_name, company_product_id)
+        product = self.instance(request, company_name, company_product_id)
         form = forms.ProductForm(instance=product)
         return render(request, "document/product_update_form.html", {"form": form})
 
     def post(self, request, company_name, company_product_id):
-        if not utils.user_is_employee(request, company_name):
-            raise PermissionDenied
-
-        product = self.instance(company_name, company_product_id)
+        product = self.instance(request, company_name, company_product_id)
         form = forms.ProductForm(request.POST, instance=product)
         if form.is_valid():
             form.save()
@@ -170,23 +271,15 @@ class DeleteProductView(LoginRequiredMixin, UserPassesTestMixin, View):
     def test_func(self):
         return utils.user_is_contributor_or_admin(self.request)
 
-    def instance(self, company_name, company_product_id):
-        company = get_object_or_404(models.Company, name=company_name)
-        product = get_object_or_404(models.Product, company=company, company_product_id=company_product_id)
-        return product
+    def instance(self, request, company_name, company_product_id):
+        return utils.get_company_object(request, models.Product, company_name, company_product_id=company_product_id)
 
     def get(self, request, company_name, company_product_id):
-        if not utils.user_is_employee(request, company_name):
-            raise PermissionDenied
-
-        product = self.instance(company_name, company_product_id)
+        product = self.instance(request, company_name, company_product_id)
         return render(request, "document/product_confirm_delete.html", {"product": product})
 
     def post(self, request, company_name, company_product_id):
-        if not utils.user_is_employee(request, company_name):
-            raise PermissionDenied
-
-        product = self.instance(company_name, company_product_id)
+        product = self.instance(request, company_name, company_product_id)
         product.delete()
         messages.success(request, "Insurance product deleted!")
         return redirect(reverse_lazy("manage"))
@@ -210,12 +303,8 @@ class AddCategoryView(LoginRequiredMixin, UserPassesTestMixin, View):
         form = forms.CategoryForm(request.POST)
         if form.is_valid():
             company = request.user.profile.company
-
-            try:
-                latest_category = models.Category.objects.filter(company=company).latest("company_category_id")
-                company_category_id = latest_category.company_category_id + 1
-            except models.Category.DoesNotExist:
-                company_category_id = 1
+            company_category_id = utils.get_next_company_id(models.Category.objects.filter(company=company),
+                                                            "company_category_id")
 
             name = form.cleaned_data["name"]
             models.Category.objects.create(
@@ -239,24 +328,16 @@ class EditCategoryView(LoginRequiredMixin, UserPassesTestMixin, View):
     def test_func(self):
         return utils.user_is_contributor_or_admin(self.request)
 
-    def instance(self, company_name, company_category_id):
-        company = get_object_or_404(models.Company, name=company_name)
-        category = get_object_or_404(models.Category, company=company, company_category_id=company_category_id)
-        return category
+    def instance(self, request, company_name, company_category_id):
+        return utils.get_company_object(request, models.Category, company_name, company_category_id=company_category_id)
 
     def get(self, request, company_name, company_category_id):
-        if not utils.user_is_employee(request, company_name):
-            raise PermissionDenied
-
-        category = self.instance(company_name, company_category_id)
+        category = self.instance(request, company_name, company_category_id)
         form = forms.CategoryForm(instance=category)
         return render(request, "document/category_update_form.html", {"form": form})
 
     def post(self, request, company_name, company_category_id):
-        if not utils.user_is_employee(request, company_name):
-            raise PermissionDenied
-
-        category = self.instance(company_name, company_category_id)
+        category = self.instance(request, company_name, company_category_id)
         form = forms.CategoryForm(request.POST, instance=category)
         if form.is_valid():
             form.save()
@@ -276,23 +357,15 @@ class DeleteCategoryView(LoginRequiredMixin, UserPassesTestMixin, View):
     def test_func(self):
         return utils.user_is_contributor_or_admin(self.request)
 
-    def instance(self, company_name, company_category_id):
-        company = get_object_or_404(models.Company, name=company_name)
-        category = get_object_or_404(models.Category, company=company, company_category_id=company_category_id)
-        return category
+    def instance(self, request, company_name, company_category_id):
+        return utils.get_company_object(request, models.Category, company_name, company_category_id=company_category_id)
 
     def get(self, request, company_name, company_category_id):
-        if not utils.user_is_employee(request, company_name):
-            raise PermissionDenied
-
-        category = self.instance(company_name, company_category_id)
+        category = self.instance(request, company_name, company_category_id)
         return render(request, "document/category_confirm_delete.html", {"category": category})
 
     def post(self, request, company_name, company_category_id):
-        if not utils.user_is_employee(request, company_name):
-            raise PermissionDenied
-
-        category = self.instance(company_name, company_category_id)
+        category = self.instance(request, company_name, company_category_id)
         category.delete()
         messages.success(request, "Document category deleted!")
         return redirect(reverse_lazy("manage"))
@@ -328,27 +401,29 @@ class AddDocumentView(LoginRequiredMixin, UserPassesTestMixin, View):
             form_file = cd.get("file")
 
             # Documents have internal id within the company
-            try:
-                latest_document = models.Document.objects.filter(company=company).latest("company_document_id")
-                company_document_id = latest_document.company_document_id + 1
-            except models.Document.DoesNotExist:
-                company_document_id = 1
+            company_document_id = utils.get_next_company_id(models.Document.objects.filter(company=company),
+                                                            "company_document_id")
 
             # Document has some attributes outside the form
             document.company = company
             document.company_document_id = company_document_id
             document.file = form_file
             document.created_by = request.user
+            document.sha256 = getattr(request, "upload_sha256", {}).get("file", "")
+            document.size = form_file.size
             document.save()
             form.save_m2m()
+            tasks.submit_on_commit(uploads.process_upload, document.pk)
 
             # Saved filename might be different from the sent filename
             saved_filename = os.path.basename(document.file.name)
             sent_filename = form_file.name
             if saved_filename != sent_filename:
-                text = utils.get_filename_msg(saved_filename=saved_filename, sent_filename=sent_filename,
-                                              company_name=company.name)
+                text = utils.get_filename_msg(saved_filename=saved_filename, sent_filename=sent_filename)
                 messages.info(request, text)
+            text = utils.get_duplicate_msg(document)
+            if text:
+                messages.warning(request, text)
 
             messages.success(request, "Document added!")
             return redirect("main")
@@ -363,34 +438,26 @@ class EditDocumentView(LoginRequiredMixin, UserPassesTestMixin, View):
     Edit an existing document and save history of the changes made to the document.
     It's not allowed to change file itself. The user should add a new document and delete the existing one.
 
-    Access company: company name is in url and then check in get() and post()
+    Access company: company name is in url and then check in utils.get_company_object()
     Access roles: contributors and admins (test_func)
     """
-    def instance(self, company_name, company_document_id):
-        company = get_object_or_404(models.Company, name=company_name)
-        document = get_object_or_404(models.Document, company=company, company_document_id=company_document_id)
-        return document
+    def instance(self, request, company_name, company_document_id):
+        return utils.get_company_object(request, models.Document, company_name, company_document_id=company_document_id)
 
     def test_func(self):
         return utils.user_is_contributor_or_admin(self.request)
 
     def get(self, request, company_name, company_document_id):
-        if not utils.user_is_employee(request, company_name):
-            raise PermissionDenied
-
-        document = self.instance(company_name, company_document_id)
+        document = self.instance(request, company_name, company_document_id)
         form = forms.DocumentEditForm(instance=document)
-        company = request.user.profile.company
+        company = document.company
         form.fields["product"].queryset = models.Product.objects.filter(company=company)
         form.fields["category"].queryset = models.Category.objects.filter(company=company)
         return render(request, "document/document_update_form.html", {"form": form})
 
     def post(self, request, company_name, company_document_id):
-        if not utils.user_is_employee(request, company_name):
-            raise PermissionDenied
-
-        company = request.user.profile.company
-        document = self.instance(company_name, company_document_id)
+        document = self.instance(request, company_name, company_document_id)
+        company = document.company
         form = forms.DocumentEditForm(request.POST, request.FILES, instance=document)
 
         if form.is_valid():
@@ -407,29 +474,21 @@ class DeleteDocumentView(LoginRequiredMixin, UserPassesTestMixin, SuccessMessage
     """
     Delete a document.
 
-    Access company: company name is in url and then check in get() and post()
+    Access company: company name is in url and then check in utils.get_company_object()
     Access roles: contributors and admins (test_func)
     """
-    def instance(self, company_name, company_document_id):
-        company = get_object_or_404(models.Company, name=company_name)
-        document = get_object_or_404(models.Document, company=company, company_document_id=company_document_id)
-        return document
+    def instance(self, request, company_name, company_document_id):
+        return utils.get_company_object(request, models.Document, company_name, company_document_id=company_document_id)
 
     def test_func(self):
         return utils.user_is_contributor_or_admin(self.request)
 
     def get(self, request, company_name, company_document_id):
-        if not utils.user_is_employee(request, company_name):
-            raise PermissionDenied
-
-        document = self.instance(company_name, company_document_id)
+        document = self.instance(request, company_name, company_document_id)
         return render(request, "document/document_confirm_delete.html", {"document": document})
 
     def post(self, request, company_name, company_document_id):
-        if not utils.user_is_employee(request, company_name):
-            raise PermissionDenied
-
-        document = self.instance(company_name, company_document_id)
+        document = self.instance(request, company_name, company_document_id)
         document.delete()
         messages.success(request, "Document deleted!")
         return redirect(reverse_lazy("main"))
@@ -439,44 +498,118 @@ class DocumentDetailView(LoginRequiredMixin, View):
     """
     Show document's details.
 
-    Access company: company name is in url and then check in get()
+    Access company: company name is in url and then check in utils.get_company_object()
     Access roles: all
     """
-    def get(self, request, company_name, company_document_id):
-        if not utils.user_is_employee(request, company_name):
-            raise PermissionDenied
+    read_from_replica = True
 
-        company = get_object_or_404(models.Company, name=company_name)
-        document = get_object_or_404(models.Document, company=company, company_document_id=company_document_id)
+    @method_decorator(cache_control(private=True, no_cache=True))
+    @method_decorator(utils.company_data_condition)
+    def get(self, request, company_name, company_document_id):
+        documents = models.Document.objects.select_related("category", "created_by").prefetch_related("product")
+        document = utils.get_company_object(request, documents, company_name, company_document_id=company_document_id)
         history_set = document.history_set.all().order_by("-changed_at")
         ctx = {
             "document": document,
             "document_filename": os.path.basename(document.file.name),
             "history_set": history_set,
+            "similar_documents": similarity.similar_documents(document),
         }
         return render(request, "document/document_detail.html", ctx)
 
 
 class DownloadDocumentView(LoginRequiredMixin, View):
     """
-    Download a document's file.
+    Download a document's file (from the storage, or a redirect to the object store, see S3Storage).
 
-    Access company: company name is in url and then check in get()
+    Access company: company name is in url and then check in utils.get_company_object()
     Access roles: all
     """
     def get(self, request, company_name, company_document_id):
-        if not utils.user_is_employee(request, company_name):
-            raise PermissionDenied
+        documents = models.Document.objects.select_related("cold")
+        document = utils.get_company_object(request, documents, company_name, company_document_id=company_document_id)
+        return utils.document_file_response(request, document)
+
+
+class ThumbnailView(LoginRequiredMixin, View):
+    """
+    Thumbnail of a document's first page.
 
-        company = get_object_or_404(models.Company, name=company_name)
-        document = get_object_or_404(models.Document, company=company, company_document_id=company_document_id)
+    Thumbnails are generated in the background after upload, so the document might not have one yet.
+    The file of a document can't be changed, so the thumbnail can be cached by the browser for a long time.
 
-        filepath = os.path.join(settings.MEDIA_ROOT, document.file.name)
-        if os.path.exists(filepath):
-            with open(filepath, "rb") as fh:
-                mime_type = "application/pdf"
-                response = HttpResponse(fh.read(), content_type=mime_type)
-                response["Content-Disposition"] = "inline; filename=" + os.path.basename(filepath)
-                return response
+    Access company: company name is in url and then check in utils.get_company_object()
+    Access roles: all
+    """
+    def get(self, request, company_name, company_document_id):
+        document = utils.get_company_object(request, models.Document, company_name,
+                                            company_document_id=company_document_id)
+        if not document.thumbnail or not document.thumbnail.storage.exists(document.thumbnail.name):
+            raise Http404
+
+        etag = f'"{document.sha256}"'
+        if request.headers.get("If-None-Match") == etag:
+            response = HttpResponse(status=304)
         else:
+            response = FileResponse(document.thumbnail.open("rb"), content_type="image/png")
+        response["ETag"] = etag
+        response["Cache-Control"] = f"private, max-age={settings.THUMBNAIL_MAX_AGE}"
+        return response
+
+
+class MetricsView(View):
+    """
+    Performance metrics of requests in the Prometheus text format (see PerformanceMiddleware).
+
+    Access company: metrics are not company data; they cover the whole application
+    Access roles: superusers or scrapers with the METRICS_TOKEN bearer token
+    """
+    def get(self, request):
+        authorization = request.headers.get("Authorization", "")
+        token_is_valid = settings.METRICS_TOKEN and constant_time_compare(authorization,
+                                                                          f"Bearer {settings.METRICS_TOKEN}")
+        if not token_is_valid and not request.user.is_superuser:
+            raise PermissionDenied
+
+        return HttpResponse(metrics.render_prometheus(), content_type="text/plain; version=0.0.4")
+
+
+class ProfileListView(UserPassesTestMixin, View):
+    """
+    Slowest requests captured by the sampling profiler (see ProfilerMiddleware).
+
+    Access company: profiles are not company data; they cover the whole application
+    Access roles: superusers
+    """
+    def test_func(self):
+        return self.request.user.is_superuser
+
+    def get(self, request):
+        profiles = profiler.list_profiles(settings.PROFILER_DIR)
+        ctx = {
+            "title": "Slow requests",
+            "profiles": profiles,
+            "profiler_enabled": settings.PROFILER_ENABLED,
+            "threshold": settings.PROFILER_THRESHOLD_MS,
+        }
+        return render(request, "admin/profiles.html", ctx)
+
+
+class ProfileDetailView(UserPassesTestMixin, View):
+    """
+    Stacks of a captured profile in the collapsed format, ready for flamegraph.pl or speedscope.
+
+    Access company: profiles are not company data; they cover the whole application
+    Access roles: superusers
+    """
+    def test_func(self):
+        return self.request.user.is_superuser
+
+    def get(self, request, name):
+        profile = profiler.load_profile(settings.PROFILER_DIR, name)
+        if profile is None:
             raise Http404
+        response = HttpResponse(profiler.collapsed_text(profile), content_type="text/plain")
+        if "download" in request.GET:
+            response["Content-Disposition"] = f'attachment; filename="{name[:-len(".json")]}.folded"'
+        return response